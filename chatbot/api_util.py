@@ -1,9 +1,15 @@
 import os
+import asyncio
+import typing
 import requests
 import json
+import copy
+import hashlib
 import sentry_sdk
 import aiohttp
 
+from ttl_cache import TTLCache
+
 BACKEND_URL = os.environ['BACKEND_URL']
 
 API_CHATBOT_AUTH_TOKEN = os.environ['CHATBOT_API_AUTH_TOKEN']
@@ -31,72 +37,173 @@ API_EVENT_HANDLER_TYPE_INVITE_USERS_WITH_ROLE_TO_CURRENT_THREAD = \
     'EVENT_HANDLER_TYPE_INVITE_USERS_WITH_ROLE_TO_CURRENT_THREAD'
 API_EVENT_HANDLER_TYPE_SHOW_CAPTCHA = 'EVENT_HANDLER_TYPE_SHOW_CAPTCHA'
 
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '100'))
+HTTP_POOL_SIZE_PER_HOST = int(os.environ.get('HTTP_POOL_SIZE_PER_HOST', '30'))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get('HTTP_KEEPALIVE_SECONDS', '60'))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '5'))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', '30'))
+
+# One session (and connection pool) for the lifetime of the bot, so calls reuse kept-alive
+# connections instead of doing a TCP+TLS handshake each time
+session = None
+
+def get_session() -> aiohttp.ClientSession:
+    global session
+
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE,
+                                         limit_per_host=HTTP_POOL_SIZE_PER_HOST,
+                                         keepalive_timeout=HTTP_KEEPALIVE_SECONDS)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    return session
+
+async def close_session():
+    global session
+
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
+
+# Event, event handler and flow definitions rarely change but are read on every button click. Cached
+# copies are dropped whenever the entry points returned by the backend change, TTL covers the rest.
+API_CACHE_MAX_SIZE = int(os.environ.get('API_CACHE_MAX_SIZE', '1000'))
+API_CACHE_TTL_SECONDS = float(os.environ.get('API_CACHE_TTL_SECONDS', '300'))
+
+event_cache = TTLCache(API_CACHE_MAX_SIZE, API_CACHE_TTL_SECONDS)
+event_handler_cache = TTLCache(API_CACHE_MAX_SIZE, API_CACHE_TTL_SECONDS)
+flow_cache = TTLCache(API_CACHE_MAX_SIZE, API_CACHE_TTL_SECONDS)
+
+entry_points_version = None
+# Bumped on invalidation, so a response fetched before it is not cached after it
+cache_generation = 0
+
+def clear_definition_caches():
+    global cache_generation
+
+    if len(event_cache) or len(event_handler_cache) or len(flow_cache):
+        print("DEFINITION CACHES CLEARED", cache_generation, {'events': event_cache.stats(),
+                                                               'event_handlers': event_handler_cache.stats(),
+                                                               'flows': flow_cache.stats()})
+    event_cache.clear()
+    event_handler_cache.clear()
+    flow_cache.clear()
+    cache_generation += 1
+
 async def get_entry_point_events():
-    async with aiohttp.ClientSession() as session:
-        response = await session.get(BACKEND_URL + '/api/events/entry-points', headers={'auth': API_CHATBOT_AUTH_TOKEN})
-        return await response.json()
+    global entry_points_version
+
+    async with get_session().get(BACKEND_URL + '/api/events/entry-points', headers={'auth': API_CHATBOT_AUTH_TOKEN}) as response:
+        entry_points = await response.json()
+
+    version = hashlib.sha256(json.dumps(entry_points, sort_keys=True).encode()).hexdigest()
+    if version != entry_points_version:
+        if entry_points_version is not None:
+            print("ENTRY POINTS CHANGED, CLEARING DEFINITION CACHES")
+        clear_definition_caches()
+        entry_points_version = version
 
-async def sync_all_channels(data):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    return entry_points
+
+# key -> task of the request currently in flight for it
+in_flight_requests = {}
+
+async def single_flight(key, request_fn):
+    """
+    Runs request_fn() once for all concurrent callers with the same key. Its result or exception is
+    returned to every caller, and a caller being cancelled does not cancel the request for the others.
+    """
+    task = in_flight_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(request_fn())
+        in_flight_requests[key] = task
+        task.add_done_callback(lambda done_task: _on_flight_done(key, done_task))
+
+    return await asyncio.shield(task)
+
+def _on_flight_done(key, task):
+    if in_flight_requests.get(key) is task:
+        del in_flight_requests[key]
+
+    # Marks the exception as retrieved, in case every caller was cancelled before it was raised
+    if not task.cancelled():
+        task.exception()
+
+async def _get_cached_json(cache, key, url):
+    data = cache.get(key)
+    if data is None:
+        async def request():
+            generation = cache_generation
+            async with get_session().get(url, headers={'auth': API_CHATBOT_AUTH_TOKEN}) as response:
+                response_data = await response.json()
+                if response.status == 200 and generation == cache_generation:
+                    cache.set(key, response_data)
+            return response_data
+
+        data = await single_flight(url, request)
+
+    # Callers are free to modify what they get
+    return copy.deepcopy(data)
+
+async def sync_all_channels(data, timeout: typing.Optional[aiohttp.ClientTimeout] = None):
+    """
+    :raises aiohttp.ClientResponseError: on an error response, so callers can tell whether to retry
+    """
+    async with get_session().post(
             BACKEND_URL + '/api/sync_all_channels',
             json=data,
             headers={
                 'auth': API_CHATBOT_AUTH_TOKEN,
-                'Content-Type': 'application/json'})
+                'Content-Type': 'application/json'},
+            timeout=timeout) as response:
+        response.raise_for_status()
         return await response.json()
     
 
 async def get_event_by_id(event_id):
-    async with aiohttp.ClientSession() as session:
-        sentry_sdk.add_breadcrumb(
-            category='bot',
-            message='get_event_by_id_before_request',
-            level='info',
-            data={
-                "event_id": event_id
-            }
-        )
-        response = await session.get(BACKEND_URL + f'/api/events/{event_id}', headers={'auth': API_CHATBOT_AUTH_TOKEN})
-        sentry_sdk.add_breadcrumb(
-            category='bot',
-            message='get_event_by_id_after_request',
-            level='info',
-            data={
-                "event_id": event_id
-            }
-        )
-        return await response.json()
+    sentry_sdk.add_breadcrumb(
+        category='bot',
+        message='get_event_by_id_before_request',
+        level='info',
+        data={
+            "event_id": event_id
+        }
+    )
+    event = await _get_cached_json(event_cache, str(event_id), BACKEND_URL + f'/api/events/{event_id}')
+    sentry_sdk.add_breadcrumb(
+        category='bot',
+        message='get_event_by_id_after_request',
+        level='info',
+        data={
+            "event_id": event_id
+        }
+    )
+    return event
 
 
 async def get_event_handler_by_id(event_handler_id):
-    async with aiohttp.ClientSession() as session:
-        response = await session.get(BACKEND_URL + f'/api/event_handlers/{event_handler_id}', headers={'auth': API_CHATBOT_AUTH_TOKEN})
-        return await response.json()
+    return await _get_cached_json(event_handler_cache, str(event_handler_id),
+                                  BACKEND_URL + f'/api/event_handlers/{event_handler_id}')
 
 async def get_flow_by_id(flow_id):
     # TODO: Start refactor from here
-    async with aiohttp.ClientSession() as session:
-        response = await session.get(BACKEND_URL + f'/api/get_flow_by_id/{flow_id}', headers={'auth': API_CHATBOT_AUTH_TOKEN})
-        return await response.json()
+    return await _get_cached_json(flow_cache, str(flow_id), BACKEND_URL + f'/api/get_flow_by_id/{flow_id}')
 
 async def get_permanent_embed_by_channel_id(channel_id):
-    async with aiohttp.ClientSession() as session:
-        response = await session.get(BACKEND_URL + f'/api/permanent_embed/{channel_id}', headers={'auth': API_CHATBOT_AUTH_TOKEN})
+    async with get_session().get(BACKEND_URL + f'/api/permanent_embed/{channel_id}', headers={'auth': API_CHATBOT_AUTH_TOKEN}) as response:
         return await response.json()
 
 async def get_first_message_mapping_in_message_id_list(message_id_list):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + f'/api/get_discord_message_mapping/list',
             json={'message_id_list': message_id_list},
             headers={'auth': API_CHATBOT_AUTH_TOKEN,
-            'Content-Type': 'application/json'})
+            'Content-Type': 'application/json'}) as response:
         return await response.json()
 
 async def add_discord_message_mapping(message_id, flow_step_id, callback_ids_sets):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + f'/api/add_discord_message_mapping/{message_id}',
             json={
                 'flow_step_id': flow_step_id,
@@ -105,12 +212,11 @@ async def add_discord_message_mapping(message_id, flow_step_id, callback_ids_set
             headers={
                 'auth': API_CHATBOT_AUTH_TOKEN,
                 'Content-Type': 'application/json'
-            })
+            }) as response:
         return await response.json()
 
 async def add_user_file_upload(filename, file_url, discord_user_id, discord_username, flow_step_id):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + f'/api/add_user_file_upload',
             json={
                 'filename': filename,
@@ -121,14 +227,13 @@ async def add_user_file_upload(filename, file_url, discord_user_id, discord_user
             },
             headers={
                 'auth': API_CHATBOT_AUTH_TOKEN,
-                'Content-Type': 'application/json'})
+                'Content-Type': 'application/json'}) as response:
         return await response.json()
 
 async def create_event_record(event_id: str, record_source: str, discord_user_id: str,
                         discord_user_name: str,
                         guild_id: str, channel_id: str, values: object):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + f'/api/event_records/',
             json={
                 "source": record_source,
@@ -142,21 +247,19 @@ async def create_event_record(event_id: str, record_source: str, discord_user_id
             headers={
                 'auth': API_CHATBOT_AUTH_TOKEN,
                 'Content-Type': 'application/json'
-            })
+            }) as response:
         return await response.json()
 
 
 async def create_captcha_challenge(captcha_type: str):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + '/api/create-captcha-challenge',
             json={"captcha_type":captcha_type},
-            headers={'auth': API_CHATBOT_AUTH_TOKEN})
+            headers={'auth': API_CHATBOT_AUTH_TOKEN}) as response:
         return await response.json()
 
 async def verify_captcha_challenge(request_id: str, discord_user_id: str,  answer: str):
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
+    async with get_session().post(
             BACKEND_URL + f'/api/verify-captcha-challenge/{request_id}/{discord_user_id}',
             json={
                 "answer": answer
@@ -164,20 +267,19 @@ async def verify_captcha_challenge(request_id: str, discord_user_id: str,  answe
             headers={
                 'auth': API_CHATBOT_AUTH_TOKEN,
                 'Content-Type': 'application/json'
-            })
+            }) as response:
 
         return await response.json()
 
-async def get_embeddings(text: str, model: str):
-    async with aiohttp.ClientSession() as session:
-            response = await session.post(
-                "https://api.openai.com/v1/embeddings", 
-                json={
-                    "input": text,
-                    "model": model
-                },
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f"Bearer {OPENAI_API_KEY}"
-                })
-            return await response.json()
\ No newline at end of file
+async def get_embeddings(text: typing.Union[str, typing.List[str]], model: str):
+    async with get_session().post(
+            "https://api.openai.com/v1/embeddings", 
+            json={
+                "input": text,
+                "model": model
+            },
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f"Bearer {OPENAI_API_KEY}"
+            }) as response:
+        return await response.json()
\ No newline at end of file
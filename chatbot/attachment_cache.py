@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Optional
+
+
+class AttachmentCache:
+    """
+    Local disk cache for attachments, keyed by their S3 url.
+
+    Blobs are stored content-addressed (by sha256), so keys pointing at identical files share one blob.
+    The index (key -> blob, size, etag, last use) is kept in memory and persisted as JSON next to the
+    blobs. When the total size of blobs exceeds max_bytes, least recently used keys are evicted.
+
+    Methods do blocking file IO, callers on the event loop should run them in an executor.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self.entries = self._load_index()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            print("Attachment cache index is corrupted, starting empty")
+            traceback.print_exc()
+            return {}
+
+        return {key: entry for key, entry in entries.items() if os.path.exists(self.blob_path(entry['sha256']))}
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def blob_path(self, sha256) -> str:
+        return os.path.join(self.directory, 'blobs', sha256[:2], sha256)
+
+    def get(self, key) -> Optional[dict]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or not os.path.exists(self.blob_path(entry['sha256'])):
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            entry['last_used_at'] = time.time()
+            self.hits += 1
+            return dict(entry)
+
+    def read(self, entry) -> Optional[bytes]:
+        """
+        :return: content of the entry's blob, None if it was evicted meanwhile. Read under the lock, so an
+                 eviction cannot remove the blob halfway
+        """
+        with self._lock:
+            try:
+                with open(self.blob_path(entry['sha256']), 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+    def mark_validated(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['validated_at'] = time.time()
+
+    def put(self, key, content: bytes, etag=None) -> dict:
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(sha256)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        entry = {
+            'sha256': sha256,
+            'size': len(content),
+            'etag': etag,
+            'last_used_at': now,
+            'validated_at': now,
+        }
+
+        with self._lock:
+            self.entries[key] = entry
+            self._evict()
+            self._save_index()
+        return dict(entry)
+
+    def _evict(self):
+        size_by_blob = {}
+        for entry in self.entries.values():
+            size_by_blob[entry['sha256']] = entry['size']
+        total_size = sum(size_by_blob.values())
+
+        if total_size <= self.max_bytes:
+            return
+
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used_at']):
+            if total_size <= self.max_bytes:
+                break
+
+            del self.entries[key]
+            if any(other['sha256'] == entry['sha256'] for other in self.entries.values()):
+                continue
+
+            print("ATTACHMENT CACHE EVICT", key)
+            total_size -= entry['size']
+            try:
+                os.remove(self.blob_path(entry['sha256']))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        return {'keys': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,166 @@
+import asyncio
+import io
+import os
+import tempfile
+import time
+import traceback
+from typing import List, Optional
+
+import aiohttp
+import discord
+
+from api_util import get_session, single_flight
+from attachment_cache import AttachmentCache
+
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(8 * 1024 * 1024)))
+ATTACHMENT_DOWNLOAD_CONCURRENCY = int(os.environ.get('ATTACHMENT_DOWNLOAD_CONCURRENCY', '8'))
+ATTACHMENT_DOWNLOAD_TIMEOUT_SECONDS = float(os.environ.get('ATTACHMENT_DOWNLOAD_TIMEOUT_SECONDS', '20'))
+
+# Empty ATTACHMENT_CACHE_DIR disables the disk cache
+ATTACHMENT_CACHE_DIR = os.environ.get('ATTACHMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'bot-attachments'))
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Cached files older than this are revalidated with their ETag, 0 disables revalidation
+ATTACHMENT_CACHE_REVALIDATE_SECONDS = float(os.environ.get('ATTACHMENT_CACHE_REVALIDATE_SECONDS', '3600'))
+
+CHUNK_SIZE = 64 * 1024
+
+# Shared by all guilds, so a burst of flow steps cannot open an unbounded number of S3 downloads
+download_semaphore = None
+
+# Created in an executor on first use, loading the index reads the cache directory
+_attachment_cache_future = None
+
+class AttachmentTooLargeError(Exception):
+    pass
+
+def _get_semaphore():
+    global download_semaphore
+
+    if download_semaphore is None:
+        download_semaphore = asyncio.Semaphore(ATTACHMENT_DOWNLOAD_CONCURRENCY)
+    return download_semaphore
+
+async def get_attachment_cache() -> Optional[AttachmentCache]:
+    """
+    :return: the disk cache, None if it is disabled or could not be opened (files are downloaded every time)
+    """
+    global _attachment_cache_future
+
+    if not ATTACHMENT_CACHE_DIR:
+        return None
+
+    if _attachment_cache_future is None:
+        _attachment_cache_future = asyncio.get_running_loop().run_in_executor(
+            None, AttachmentCache, ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES)
+    future = _attachment_cache_future
+    try:
+        return await asyncio.shield(future)
+    except Exception:
+        print("Error opening attachment cache", ATTACHMENT_CACHE_DIR)
+        traceback.print_exc()
+        # Tried again on the next call
+        if _attachment_cache_future is future:
+            _attachment_cache_future = None
+        return None
+
+async def _download(url, headers=None, max_bytes=ATTACHMENT_MAX_BYTES):
+    """
+    Downloads the file without blocking the event loop. The body is streamed, so files over max_bytes are
+    abandoned without being read completely.
+
+    :return: (status, content, etag), status is None if the file could not be downloaded
+    """
+    timeout = aiohttp.ClientTimeout(total=ATTACHMENT_DOWNLOAD_TIMEOUT_SECONDS)
+
+    try:
+        async with _get_semaphore():
+            async with get_session().get(url, headers=headers, timeout=timeout) as response:
+                if response.status != 200:
+                    return response.status, None, None
+
+                if response.content_length is not None and response.content_length > max_bytes:
+                    raise AttachmentTooLargeError(f"{response.content_length} bytes")
+
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    data += chunk
+                    if len(data) > max_bytes:
+                        raise AttachmentTooLargeError(f"over {max_bytes} bytes")
+
+                return response.status, bytes(data), response.headers.get('ETag')
+    except AttachmentTooLargeError as e:
+        print('file too large', url, e)
+    except asyncio.TimeoutError:
+        print('file fetch timeout', url)
+    except aiohttp.ClientError:
+        print('file fetch error', url)
+        traceback.print_exc()
+
+    return None, None, None
+
+async def download_attachment(url, max_bytes=ATTACHMENT_MAX_BYTES) -> Optional[bytes]:
+    """
+    :return: file content, or None if it could not be downloaded
+    """
+    status, content, _ = await _download(url, max_bytes=max_bytes)
+    if status is not None and status != 200:
+        print('file fetch error', url, status)
+    return content
+
+async def _get_cached_attachment_content(cache, key, url) -> Optional[bytes]:
+    """
+    :return: file content, read from the cache while it cannot be evicted, or downloaded
+    """
+    loop = asyncio.get_running_loop()
+    entry = await loop.run_in_executor(None, cache.get, key)
+
+    status, content, etag = None, None, None
+    if entry is not None:
+        if ATTACHMENT_CACHE_REVALIDATE_SECONDS <= 0 or entry['etag'] is None or \
+                time.time() - entry['validated_at'] < ATTACHMENT_CACHE_REVALIDATE_SECONDS:
+            cached_content = await loop.run_in_executor(None, cache.read, entry)
+        else:
+            status, content, etag = await _download(url, headers={'If-None-Match': entry['etag']})
+            # On a failed revalidation the cached file is still better than none
+            cached_content = await loop.run_in_executor(None, cache.read, entry) \
+                if status == 304 or status is None else None
+            if cached_content is not None:
+                cache.mark_validated(key)
+
+        if cached_content is not None:
+            return cached_content
+
+    if content is None:
+        # Not cached, or evicted since the lookup
+        status, content, etag = await _download(url)
+
+    if content is None:
+        print('file fetch error', url, status)
+        return None
+
+    await loop.run_in_executor(None, cache.put, key, content, etag)
+    return content
+
+async def _get_attachment_file(cache, key, url, name) -> Optional[discord.File]:
+    if cache is None:
+        content = await download_attachment(url)
+    else:
+        content = await single_flight(('attachment', key), lambda: _get_cached_attachment_content(cache, key, url))
+    return discord.File(io.BytesIO(content), name) if content is not None else None
+
+async def get_s3_attachment_files(bucket_url, file_db_objects) -> List[discord.File]:
+    """
+    Fetches the files in parallel, from the local disk cache when possible.
+
+    :param: bucket_url          base url of the S3 bucket
+    :param: file_db_objects     rows with the S3 object key in 'file' and the filename in 'name'
+    :return: discord files in the given order, files that could not be fetched are skipped
+    """
+    cache = await get_attachment_cache()
+
+    # Keyed by the whole url, the same object key can exist in more than one bucket
+    urls = [f'{bucket_url}/{row["file"]}' for row in file_db_objects]
+    files = await asyncio.gather(*[_get_attachment_file(cache, url, url, row['name'])
+                                   for url, row in zip(urls, file_db_objects)])
+
+    return [file for file in files if file is not None]
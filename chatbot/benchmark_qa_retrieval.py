@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import qa_vectors
+from database import execute, execute_values, close_pool
+from embedding_codec import encode_embedding
+from qa_index import load_qa_index, select_top_k
+
+
+# Compares the in-memory and pgvector QA retrieval backends on synthetic guilds of growing size.
+# Meant for the local stand-in database from docker-compose.pgvector.yml.
+# Run as
+# python3 benchmark_qa_retrieval.py [--create-tables] [--sizes 1000 10000 50000] [--queries 100]
+
+MODEL = 'benchmark-model'
+# Far away from real discord snowflakes
+BENCHMARK_GUILD_ID_BASE = 1000
+
+TOP_K = 4
+MIN_SIMILARITY = 0.5
+
+# Minimal versions of the backend tables, only the columns the bot reads
+CREATE_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS api_qadocument (
+        id bigserial PRIMARY KEY,
+        guild_id bigint NOT NULL,
+        prompt text,
+        completion text,
+        model text,
+        embedding_vector bytea,
+        question_jump_url text,
+        answer_jump_url text,
+        is_spam boolean NOT NULL DEFAULT FALSE,
+        is_public boolean NOT NULL DEFAULT FALSE,
+        created_on timestamptz NOT NULL DEFAULT NOW(),
+        last_modified_on timestamptz NOT NULL DEFAULT NOW(),
+        deleted_on timestamptz
+    );
+
+    CREATE TABLE IF NOT EXISTS api_qadocumentalternativeprompt (
+        id bigserial PRIMARY KEY,
+        qa_document_id bigint NOT NULL REFERENCES api_qadocument (id),
+        alternative_prompt text,
+        model text,
+        embedding_vector bytea
+    );
+
+    CREATE TABLE IF NOT EXISTS api_qadocumentcompletionbutton (
+        id bigserial PRIMARY KEY,
+        qa_document_id bigint NOT NULL REFERENCES api_qadocument (id),
+        label text,
+        button_style integer,
+        triggered_flow_id bigint
+    );
+"""
+
+
+def random_unit_vectors(rng, count, dim):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def noisy(rng, vectors, noise):
+    return vectors + rng.standard_normal(vectors.shape).astype(np.float32) * noise
+
+
+async def delete_guild(guild_id):
+    await execute(f"DELETE FROM {qa_vectors.VECTOR_TABLE} WHERE guild_id = %s", [guild_id])
+    await execute("""DELETE FROM api_qadocumentcompletionbutton WHERE qa_document_id IN
+                     (SELECT id FROM api_qadocument WHERE guild_id = %s)""", [guild_id])
+    await execute("""DELETE FROM api_qadocumentalternativeprompt WHERE qa_document_id IN
+                     (SELECT id FROM api_qadocument WHERE guild_id = %s)""", [guild_id])
+    await execute("DELETE FROM api_qadocument WHERE guild_id = %s", [guild_id])
+
+
+async def create_guild(rng, guild_id, size, dim, alternative_prompts_per_document, buttons_per_document):
+    """
+    Documents are spread around a few hundred topics so that queries have several close matches, like
+    real FAQs that have many variations of the same question.
+    """
+    topics = random_unit_vectors(rng, max(1, size // 20), dim)
+    doc_vectors = noisy(rng, topics[rng.integers(0, len(topics), size)], 0.03)
+
+    rows = await execute_values("""
+        INSERT INTO api_qadocument (guild_id, prompt, completion, model, embedding_vector, is_public, is_spam,
+                                    created_on, last_modified_on)
+        VALUES %s RETURNING id
+    """, [(guild_id, f'question {i}', f'answer {i}', MODEL, encode_embedding(vector))
+          for i, vector in enumerate(doc_vectors)],
+        template="(%s, %s, %s, %s, %s, FALSE, FALSE, NOW(), NOW())", page_size=1000, fetch=True, timeout=600)
+    doc_ids = [row['id'] for row in rows]
+
+    alternatives = []
+    for doc_id, vector in zip(doc_ids, doc_vectors):
+        for j in range(rng.poisson(alternative_prompts_per_document)):
+            alternatives.append((doc_id, f'alternative {j}', MODEL, encode_embedding(noisy(rng, vector, 0.03))))
+
+    if alternatives:
+        await execute_values("""
+            INSERT INTO api_qadocumentalternativeprompt (qa_document_id, alternative_prompt, model, embedding_vector)
+            VALUES %s
+        """, alternatives, page_size=1000, timeout=600)
+
+    # Completion buttons are loaded with the documents and returned with search results
+    buttons = []
+    for doc_id in doc_ids:
+        for j in range(rng.poisson(buttons_per_document)):
+            buttons.append((doc_id, f'button {j}', 1, None))
+
+    if buttons:
+        await execute_values("""
+            INSERT INTO api_qadocumentcompletionbutton (qa_document_id, label, button_style, triggered_flow_id)
+            VALUES %s
+        """, buttons, page_size=1000, timeout=600)
+
+    return topics
+
+
+def memory_search(index, embedding):
+    similarities = index.document_similarities(embedding)
+    return [index.documents[i]['id'] for i in select_top_k(similarities, TOP_K, MIN_SIMILARITY)]
+
+
+def percentile_ms(timings, percentile):
+    return np.percentile(timings, percentile) * 1000
+
+
+async def benchmark_size(rng, size, args):
+    guild_id = BENCHMARK_GUILD_ID_BASE + size
+    await delete_guild(guild_id)
+
+    start = time.perf_counter()
+    topics = await create_guild(rng, guild_id, size, args.dim, args.alternative_prompts, args.buttons)
+    print(f"\n{size} documents created in {time.perf_counter() - start:.1f}s")
+
+    queries = noisy(rng, topics[rng.integers(0, len(topics), args.queries)], 0.05)
+
+    start = time.perf_counter()
+    index = await load_qa_index(guild_id, MODEL)
+    memory_load_seconds = time.perf_counter() - start
+
+    memory_timings = []
+    exact_results = []
+    for query in queries:
+        start = time.perf_counter()
+        exact_results.append(memory_search(index, query))
+        memory_timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await qa_vectors.sync_guild_vectors_if_changed(guild_id, MODEL)
+    await execute("ANALYZE " + qa_vectors.VECTOR_TABLE, timeout=600)
+    pgvector_sync_seconds = time.perf_counter() - start
+
+    pgvector_timings = []
+    recalls = []
+    for query, exact in zip(queries, exact_results):
+        start = time.perf_counter()
+        results = await qa_vectors.search_documents(guild_id, MODEL, query, TOP_K, MIN_SIMILARITY)
+        pgvector_timings.append(time.perf_counter() - start)
+
+        if exact:
+            recalls.append(len(set(exact) & {doc['id'] for _, doc in results}) / len(exact))
+
+    print(f"{'backend':<10} {'load/sync s':>12} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(TOP_K):>10}")
+    print(f"{'memory':<10} {memory_load_seconds:>12.2f} {percentile_ms(memory_timings, 50):>8.2f} "
+          f"{percentile_ms(memory_timings, 95):>8.2f} {1.0:>10.3f}")
+    print(f"{'pgvector':<10} {pgvector_sync_seconds:>12.2f} {percentile_ms(pgvector_timings, 50):>8.2f} "
+          f"{percentile_ms(pgvector_timings, 95):>8.2f} {np.mean(recalls) if recalls else float('nan'):>10.3f}")
+
+    if not args.keep:
+        await delete_guild(guild_id)
+
+
+async def main(args):
+    if args.create_tables:
+        await execute(CREATE_TABLES_SQL)
+    await execute(qa_vectors.get_schema_sql(dimension=args.dim), timeout=600)
+    qa_vectors.schema_ready = True
+
+    rng = np.random.default_rng(args.seed)
+    for size in args.sizes:
+        await benchmark_size(rng, size, args)
+
+    close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark in-memory and pgvector QA retrieval")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--dim', type=int, default=qa_vectors.PGVECTOR_DIMENSION)
+    parser.add_argument('--alternative-prompts', type=float, default=1.0,
+                        help="Average number of alternative prompts per document")
+    parser.add_argument('--buttons', type=float, default=0.3,
+                        help="Average number of completion buttons per document")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--create-tables', action='store_true',
+                        help="Create minimal api_qadocument, alternative prompt and completion button tables, "
+                             "for an empty stand-in database")
+    parser.add_argument('--keep', action='store_true', help="Keep the synthetic guilds after the run")
+    asyncio.run(main(parser.parse_args()))
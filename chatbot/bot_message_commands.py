@@ -2,7 +2,7 @@ import logging
 from const import REPLY_ANSWER_UPDATED, REPLY_DO_YOU_WANT_TO_DELETE_THIS_QA_PAIR, REPLY_WHAT_IS_CORRECT_ANSWER
 from slack_util import post_message_to_slack_event_logs
 from utils import check_if_text_contains_question, create_user_if_not_exists
-from database import execute_sql
+from database import fetch, execute
 import traceback
 import discord
 import datetime
@@ -10,6 +10,7 @@ import datetime
 from commands_guided_flows import QaDocumentCompletionButton
 
 from event_logger import EventLogger
+from kick_executor import KICK_REASON_SPAM
 
 EVENT_TYPE_QUESTION_WITH_DIRECT_ANSWER = "QUESTION_WITH_DIRECT_ANSWER"
 EVENT_TYPE_QUESTION_WITH_POTENTIAL_ANSWERS = "QUESTION_WITH_POTENTIAL_ANSWERS"
@@ -31,7 +32,7 @@ async def handle_message_question(bot, message, _community, conversation):
     except:
         return
 
-    create_user_if_not_exists(message.author)
+    await create_user_if_not_exists(message.author)
 
     qa_matches_result = None
 
@@ -78,7 +79,7 @@ async def handle_message_question(bot, message, _community, conversation):
                 if count_start < datetime.datetime.fromisoformat('2022-12-02'):
                     count_start = datetime.datetime.fromisoformat('2022-12-02')
 
-                res = execute_sql("SELECT COUNT(*) AS cnt FROM api_eventlog WHERE triggered_by_user_id = %s AND related_qa_document_id = %s AND created_on > %s",
+                res = await fetch("SELECT COUNT(*) AS cnt FROM api_eventlog WHERE triggered_by_user_id = %s AND related_qa_document_id = %s AND created_on > %s",
                                   [message.author.id, qa_matches_result.direct_answer.doc_idx,
                                    count_start])
 
@@ -156,31 +157,27 @@ async def handle_message_question(bot, message, _community, conversation):
         await message.reply(bot_answer, view=view)
 
     if is_spam_kick:
-        await message.author.kick()
+        bot.kick_executor.enqueue(message.author, _community, KICK_REASON_SPAM)
 
     if event_type == EVENT_TYPE_QUESTION_WITH_DIRECT_ANSWER:
-        execute_sql(
+        await execute(
             'INSERT INTO api_eventlog (created_on, last_modified_on, type, user_prompt, bot_response, community_id, related_qa_document_id, triggered_by_user_id, slackbot_log, is_spam) VALUES ( NOW(), NOW(), %s, %s, %s, %s, %s, %s, %s, %s )',
             [EVENT_TYPE_QUESTION_WITH_DIRECT_ANSWER, message.content, bot_answer, _community.guild_id,
-             related_document_idx, message.author.id, slackbot_log, is_spam],
-            fetch=False)
+             related_document_idx, message.author.id, slackbot_log, is_spam])
     elif event_type == EVENT_TYPE_QUESTION_WITH_POTENTIAL_ANSWERS:
-        execute_sql(
+        await execute(
             'INSERT INTO api_eventlog (created_on, last_modified_on, type, user_prompt, bot_response, community_id, related_qa_document_id, triggered_by_user_id, slackbot_log, is_spam) VALUES ( NOW(), NOW(), %s, %s, %s, %s, %s, %s, %s, %s )',
             [EVENT_TYPE_QUESTION_WITH_POTENTIAL_ANSWERS, message.content, bot_answer, _community.guild_id,
-             None, message.author.id, slackbot_log, is_spam],
-            fetch=False)
+             None, message.author.id, slackbot_log, is_spam])
     elif event_type == EVENT_TYPE_QUESTION_WITHOUT_ANSWER:
-        qa_view.insert_unanswered_question_into_db(message.content, message.author.id)
-        execute_sql(
+        await qa_view.insert_unanswered_question_into_db(message.content, message.author.id)
+        await execute(
             'INSERT INTO api_eventlog (created_on, last_modified_on, type, user_prompt, bot_response, community_id, related_qa_document_id, triggered_by_user_id, slackbot_log, is_spam) VALUES ( NOW(), NOW(), %s, %s, %s, %s, %s, %s, %s, %s )',
-            [EVENT_TYPE_QUESTION_WITHOUT_ANSWER, message.content, "", _community.guild_id, None, message.author.id, slackbot_log, is_spam],
-            fetch=False)
+            [EVENT_TYPE_QUESTION_WITHOUT_ANSWER, message.content, "", _community.guild_id, None, message.author.id, slackbot_log, is_spam])
     elif event_type == EVENT_TYPE_QUESTION_PROCESSING_RUNTIME_ERROR:
-        execute_sql(
+        await execute(
             'INSERT INTO api_eventlog (created_on, last_modified_on, type, user_prompt, bot_response, community_id, related_qa_document_id, triggered_by_user_id, slackbot_log, is_spam) VALUES ( NOW(), NOW(), %s, %s, %s, %s, %s, %s, %s, %s )',
-            [EVENT_TYPE_QUESTION_PROCESSING_RUNTIME_ERROR, message.content, "", _community.guild_id, None, message.author.id, slackbot_log, is_spam],
-            fetch=False)
+            [EVENT_TYPE_QUESTION_PROCESSING_RUNTIME_ERROR, message.content, "", _community.guild_id, None, message.author.id, slackbot_log, is_spam])
 
     if slackbot_log:
         post_message_to_slack_event_logs(slackbot_log,
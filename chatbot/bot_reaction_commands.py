@@ -33,16 +33,12 @@ async def handle_reaction_delete_answer(bot, message, _community, conversation):
     answer, question = conversation[-2], conversation[-1]
 
     qa_view = bot.get_qa_view(_community)
-    bot_response = None
-
-    should_ask_to_delete = False
-    should_delete_without_ask = False
 
     # TODO: Update
-    bot_response = await qa_view.get_answer_for_question(question.content)
+    direct_match = await qa_view.find_direct_match(question.content)
 
-    if bot_response.direct_answer:
-        qa_view.delete_qa_pair_from_db(bot_response.direct_answer.doc_idx)
+    if direct_match:
+        await qa_view.delete_qa_pair_from_db(direct_match.doc_idx)
         await message.delete()
 
 
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import List
+
+import aiohttp
+
+from api_util import sync_all_channels
+
+# Channel lists of guilds are synced to the backend concurrently, at most CHANNEL_SYNC_CONCURRENCY
+# requests at a time. Each guild is a separate request (one request with all guilds overflowed the
+# backend), failed requests are retried with exponential backoff and jitter.
+#
+# A guild is only sent when the fingerprint of its channels differs from the last one synced. Channel
+# gateway events sync their guild after CHANNEL_SYNC_DEBOUNCE_SECONDS, the periodic sync only catches
+# what events missed (e.g. while disconnected), and every CHANNEL_SYNC_FULL_INTERVAL_SECONDS all guilds
+# are sent regardless, in case the backend lost them.
+#
+# The unit of a sync is one guild's complete channel map, also after a channel event: /api/sync_all_channels
+# takes the full channel list of each guild it receives and has no way to express a deleted channel, so a
+# map with only the changed channels would not be a safe delta. What events save is the other guilds.
+CHANNEL_SYNC_CONCURRENCY = int(os.environ.get('CHANNEL_SYNC_CONCURRENCY', '8'))
+CHANNEL_SYNC_TIMEOUT_SECONDS = float(os.environ.get('CHANNEL_SYNC_TIMEOUT_SECONDS', '30'))
+CHANNEL_SYNC_MAX_ATTEMPTS = int(os.environ.get('CHANNEL_SYNC_MAX_ATTEMPTS', '3'))
+CHANNEL_SYNC_BACKOFF_SECONDS = float(os.environ.get('CHANNEL_SYNC_BACKOFF_SECONDS', '1'))
+CHANNEL_SYNC_DEBOUNCE_SECONDS = float(os.environ.get('CHANNEL_SYNC_DEBOUNCE_SECONDS', '2'))
+CHANNEL_SYNC_FULL_INTERVAL_SECONDS = float(os.environ.get('CHANNEL_SYNC_FULL_INTERVAL_SECONDS', str(24 * 3600)))
+
+logger = logging.getLogger('channel_sync')
+# Root logging is left at its default (WARNING), sync summaries are still wanted in the output
+logger.setLevel(os.environ.get('CHANNEL_SYNC_LOG_LEVEL', 'INFO'))
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+def guild_channels_payload(guild) -> dict:
+    return {
+        'id': str(guild.id),
+        'channels_by_id': {str(channel.id): {'name': channel.name} for channel in guild.channels}
+    }
+
+def channels_fingerprint(guild_data) -> str:
+    return hashlib.sha256(json.dumps(guild_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# guild_id -> fingerprint of the channels last synced successfully
+SYNCED_FINGERPRINTS = {}
+last_full_sync_time = None
+# Shared by periodic and event triggered syncs, created on first use inside the running loop
+_semaphore = None
+# guild_id -> pending debounced sync
+_pending_guild_syncs = {}
+
+def get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(CHANNEL_SYNC_CONCURRENCY)
+    return _semaphore
+
+async def sync_guild_channels(guild, force=False) -> dict:
+    """
+    :param: force   send the channels even if they did not change since the last sync
+    :return: result of the guild, with 'ok', 'skipped', 'attempts', 'channels' and 'seconds' (including
+             waits for the semaphore and backoff)
+    """
+    start_time = time.monotonic()
+    guild_data = guild_channels_payload(guild)
+    fingerprint = channels_fingerprint(guild_data)
+    if not force and SYNCED_FINGERPRINTS.get(guild.id) == fingerprint:
+        return {'guild_id': guild.id, 'ok': True, 'skipped': True, 'attempts': 0,
+                'channels': len(guild_data['channels_by_id']), 'seconds': 0}
+
+    timeout = aiohttp.ClientTimeout(total=CHANNEL_SYNC_TIMEOUT_SECONDS)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with get_semaphore():
+                await sync_all_channels({'guilds': [guild_data]}, timeout=timeout)
+            SYNCED_FINGERPRINTS[guild.id] = fingerprint
+            ok = True
+            break
+        except Exception as e:
+            if attempt >= CHANNEL_SYNC_MAX_ATTEMPTS or not is_retryable(e):
+                logger.warning("Channel sync of guild %s failed after %d attempts", guild.id, attempt,
+                               exc_info=True)
+                ok = False
+                break
+
+            backoff = CHANNEL_SYNC_BACKOFF_SECONDS * 2 ** (attempt - 1) * (0.5 + random.random())
+            logger.info("Channel sync of guild %s failed (%s), retrying in %.1fs", guild.id, e, backoff)
+            await asyncio.sleep(backoff)
+
+    seconds = time.monotonic() - start_time
+    logger.debug("Synced %d channels of guild %s in %.2fs (%d attempts)",
+                 len(guild_data['channels_by_id']), guild.id, seconds, attempt)
+    return {'guild_id': guild.id, 'ok': ok, 'skipped': False, 'attempts': attempt,
+            'channels': len(guild_data['channels_by_id']), 'seconds': seconds}
+
+async def sync_guilds_channels(guilds) -> List[dict]:
+    """
+    Syncs channels of all guilds that changed since their last sync concurrently, and logs a summary.
+
+    :return: per guild results, see sync_guild_channels
+    """
+    global last_full_sync_time
+
+    start_time = time.monotonic()
+    force = last_full_sync_time is None or start_time - last_full_sync_time >= CHANNEL_SYNC_FULL_INTERVAL_SECONDS
+
+    # Guilds the bot has left
+    guild_ids = {guild.id for guild in guilds}
+    for guild_id in list(SYNCED_FINGERPRINTS.keys()):
+        if guild_id not in guild_ids:
+            del SYNCED_FINGERPRINTS[guild_id]
+
+    results = await asyncio.gather(*[sync_guild_channels(guild, force) for guild in guilds])
+    if force:
+        last_full_sync_time = start_time
+
+    synced = [result for result in results if not result['skipped']]
+    failed = [result['guild_id'] for result in synced if not result['ok']]
+    slowest = max(synced, key=lambda result: result['seconds'], default=None)
+    logger.info("Channel sync%s: %d guilds, %d changed, %d channels sent, %d failed, %d retries in %.2fs "
+                "(slowest guild %s %.2fs)%s",
+                " (full)" if force else "", len(results), len(synced),
+                sum(result['channels'] for result in synced), len(failed),
+                sum(result['attempts'] - 1 for result in synced), time.monotonic() - start_time,
+                slowest['guild_id'] if slowest else None, slowest['seconds'] if slowest else 0,
+                f" failed guilds: {failed}" if failed else "")
+    return results
+
+def schedule_guild_channel_sync(guild):
+    """
+    Syncs the guild after CHANNEL_SYNC_DEBOUNCE_SECONDS, so that a burst of channel events (e.g. a new
+    category with its channels) is sent once. Channels are read when the sync runs, and the guild's whole
+    channel map is sent (the backend endpoint has no per-channel delta, see the top of this module).
+    """
+    if guild.id in _pending_guild_syncs:
+        return
+
+    async def sync_later():
+        try:
+            await asyncio.sleep(CHANNEL_SYNC_DEBOUNCE_SECONDS)
+            del _pending_guild_syncs[guild.id]
+            result = await sync_guild_channels(guild)
+            if not result['skipped']:
+                logger.info("Channel sync of guild %s after channel event: %s in %.2fs", guild.id,
+                            "ok" if result['ok'] else "failed", result['seconds'])
+        except Exception:
+            _pending_guild_syncs.pop(guild.id, None)
+            logger.exception("Error in channel sync of guild %s", guild.id)
+
+    _pending_guild_syncs[guild.id] = asyncio.get_running_loop().create_task(sync_later())
@@ -1,5 +1,5 @@
 import discord
-from database import execute_sql
+from database import fetch, execute
 from community import initialize_all_supported_communities, SUPPORTED_COMMUNITIES
 from qa_view import QAView
 from datetime import datetime, timezone
@@ -9,7 +9,6 @@ from discord.ui import InputText, Modal
 from utils import create_user_if_not_exists
 
 from commands_guided_flows import generate_custom_id, parse_custom_id
-from database import execute_sql
 
 EVENT_TYPE_CREATE_QA_DOC = 'EVENT_TYPE_CREATE_QA_DOC'
 EVENT_TYPE_UPDATE_QA_DOC = 'EVENT_TYPE_UPDATE_QA_DOC'
@@ -33,7 +32,7 @@ async def get_questions(ctx: discord.AutocompleteContext):
         sql += " AND prompt ILIKE %s"
         params.append('%%%s%%' % token)
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return [row['prompt'][:99] for row in result]
 
@@ -50,7 +49,7 @@ async def get_answers(ctx: discord.AutocompleteContext):
         sql += " AND completion ILIKE %s"
         params.append('%%%s%%' % token)
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return [row['completion'][:99] for row in result]
 
@@ -68,12 +67,12 @@ async def get_tags(ctx: discord.AutocompleteContext):
         sql += " AND t.name ILIKE %s"
         params.append('%%%s%%' % token)
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return [row['name'][:99] for row in result]
 
 async def add_tags_to_question(question, guild_id, tag_options):
-    qa_doc_id = get_qadocument_id(question, guild_id)
+    qa_doc_id = await get_qadocument_id(question, guild_id)
 
     tag_ids = []
     tag_names = []
@@ -81,16 +80,16 @@ async def add_tags_to_question(question, guild_id, tag_options):
     for t in tag_options:
         if t is None:
             continue
-        tag_ids.append(get_tag_id_or_create(t, guild_id))
+        tag_ids.append(await get_tag_id_or_create(t, guild_id))
         tag_names.append(t)
 
     for tag_id in tag_ids:
-        add_tag_to_qa_doc(qa_doc_id, tag_id)
+        await add_tag_to_qa_doc(qa_doc_id, tag_id)
 
     return tag_names
 
 async def remove_tags_from_question(question, guild_id, tag_options):
-    qa_doc_id = get_qadocument_id(question, guild_id)
+    qa_doc_id = await get_qadocument_id(question, guild_id)
 
     tag_ids = []
     tag_names = []
@@ -98,18 +97,18 @@ async def remove_tags_from_question(question, guild_id, tag_options):
     for t in tag_options:
         if t is None:
             continue
-        tag_id = get_tag_id(t, qa_doc_id)
+        tag_id = await get_tag_id(t, qa_doc_id)
         if tag_id is None:
             continue
         tag_ids.append(tag_id)
         tag_names.append(t)
 
     for tag_id in tag_ids:
-        remove_tag_from_qa_doc(qa_doc_id, tag_id)
+        await remove_tag_from_qa_doc(qa_doc_id, tag_id)
 
     return tag_names
 
-def get_tag_id(tag_name, qa_doc_id):
+async def get_tag_id(tag_name, qa_doc_id):
     select_sql = """
         SELECT t.id AS id, t.name AS name FROM "api_tag" t 
             JOIN "api_tag_qa_documents" tq ON tq.tag_id = t.id
@@ -118,53 +117,53 @@ def get_tag_id(tag_name, qa_doc_id):
             AND t.deleted_on IS NULL
     """
     params = [tag_name, qa_doc_id]
-    result = execute_sql(select_sql, params)
+    result = await fetch(select_sql, params)
 
     if len(result) == 0:
         return None
 
     return result[0]['id']
 
-def get_tag_id_or_create(tag_name, guild_id):
+async def get_tag_id_or_create(tag_name, guild_id):
     select_sql = 'SELECT t.id FROM "api_tag" t JOIN "api_community" c ON t.community_id = c.id WHERE t.deleted_on IS NULL AND t.name = %s AND guild_id = %s'
     params = [tag_name, guild_id]
-    result = execute_sql(select_sql, params)
+    result = await fetch(select_sql, params)
     if len(result) == 0:
         insert_sql = 'INSERT INTO "api_tag" (name, community_id, created_on, last_modified_on) ' \
                     'SELECT %s, id, NOW(), NOW() FROM api_community WHERE deleted_on IS NULL AND guild_id = %s'
         params = [tag_name, guild_id]
-        result = execute_sql(insert_sql, params, fetch=False)
+        result = await execute(insert_sql, params)
 
         params = [tag_name, guild_id]
-        result = execute_sql(select_sql, params)
+        result = await fetch(select_sql, params)
 
     return result[0]['id']
 
-def add_tag_to_qa_doc(qa_doc_id, tag_id):
+async def add_tag_to_qa_doc(qa_doc_id, tag_id):
     sql = 'INSERT INTO "api_tag_qa_documents" (tag_id, qadocument_id) VALUES (' \
           '%s, ' \
           '%s' \
           ')'
     params = [tag_id, qa_doc_id]
-    result = execute_sql(sql, params, fetch=False)
+    result = await execute(sql, params)
 
-def remove_tag_from_qa_doc(qa_doc_id, tag_id):
+async def remove_tag_from_qa_doc(qa_doc_id, tag_id):
     sql = 'DELETE FROM "api_tag_qa_documents" WHERE tag_id = %s AND qadocument_id = %s'
     params = [tag_id, qa_doc_id]
-    result = execute_sql(sql, params, fetch=False)
+    result = await execute(sql, params)
 
-def get_qadocument_id(prompt, guild_id):
+async def get_qadocument_id(prompt, guild_id):
     sql = 'SELECT id FROM "api_qadocument" WHERE deleted_on IS NULL AND prompt = %s AND guild_id = %s'
     params = [prompt, guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     if result:
         return result[0]['id']
     else:
         raise ApplicationCommandError("No QA document found for supplied prompt and guild id")
 
-def get_tags_by_qa_doc(qa_doc_id):
+async def get_tags_by_qa_doc(qa_doc_id):
     sql = """
         SELECT t.id AS id, t.name AS name 
             FROM "api_tag_qa_documents" tq
@@ -177,27 +176,27 @@ def get_tags_by_qa_doc(qa_doc_id):
 
     params = [qa_doc_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return list(map(lambda x: x['name'], result))
 
 
-def get_answer(prompt, guild_id):
+async def get_answer(prompt, guild_id):
     sql = 'SELECT completion FROM "api_qadocument" WHERE deleted_on IS NULL AND prompt = %s AND guild_id = %s'
     params = [prompt, guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     if len(result) == 0:
         return None
 
     return result[0]['completion']
 
-def get_qa_doc_by_completion(completion, guild_id):
+async def get_qa_doc_by_completion(completion, guild_id):
     sql = 'SELECT prompt, completion FROM "api_qadocument" WHERE deleted_on IS NULL AND completion = %s AND guild_id = %s'
     params = [completion, guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     if len(result) == 0:
         return None
@@ -217,7 +216,7 @@ def parse_datetime(datetime_str):
 def format_datetime(dt):
     return dt.replace(tzinfo=timezone.utc).strftime(DATETIME_FORMAT)
 
-def get_qa_docs_with_revision_dates(guild_id):
+async def get_qa_docs_with_revision_dates(guild_id):
     sql = """
                 SELECT * FROM "api_qadocument"
                     WHERE revision_date IS NOT NULL
@@ -227,11 +226,11 @@ def get_qa_docs_with_revision_dates(guild_id):
 
     params = [guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return result
 
-def get_qa_docs_with_due_revision_dates(guild_id):
+async def get_qa_docs_with_due_revision_dates(guild_id):
     sql = """
                 SELECT * FROM "api_qadocument"
                     WHERE revision_date IS NOT NULL
@@ -242,11 +241,11 @@ def get_qa_docs_with_due_revision_dates(guild_id):
 
     params = [guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     return result
 
-def set_revision_date(q_id, dt, guild_id):
+async def set_revision_date(q_id, dt, guild_id):
     sql = """
             UPDATE "api_qadocument"
                 SET revision_date = %s
@@ -255,11 +254,11 @@ def set_revision_date(q_id, dt, guild_id):
 
     params = [dt, q_id]
 
-    result = execute_sql(sql, params, fetch=False)
+    result = await execute(sql, params)
 
-    return list(filter(lambda x: x['id'] == q_id, get_qa_docs_with_revision_dates(guild_id)))[0]['revision_date']
+    return list(filter(lambda x: x['id'] == q_id, await get_qa_docs_with_revision_dates(guild_id)))[0]['revision_date']
 
-def clear_revision_date(q_id, guild_id):
+async def clear_revision_date(q_id, guild_id):
     sql = """
             UPDATE "api_qadocument"
                 SET revision_date = NULL
@@ -268,9 +267,9 @@ def clear_revision_date(q_id, guild_id):
 
     params = [q_id]
 
-    result = execute_sql(sql, params, fetch=False)
+    result = await execute(sql, params)
 
-def get_notification_channel_id(guild_id):
+async def get_notification_channel_id(guild_id):
     sql = """
                     SELECT ch.channel_id FROM "api_community" com
                         JOIN api_alldiscordchanels ch ON ch.id = com.notifications_channel_ref_id
@@ -280,14 +279,14 @@ def get_notification_channel_id(guild_id):
 
     params = [guild_id]
 
-    result = execute_sql(sql, params)
+    result = await fetch(sql, params)
 
     if len(result) == 0:
         return None
 
     return result[0]["channel_id"]
 
-def set_notification_channel_id(guild_id, channel_id):
+async def set_notification_channel_id(guild_id, channel_id):
     sql = """
                 UPDATE "api_community"
                     SET notifications_channel_ref_id = (
@@ -301,9 +300,9 @@ def set_notification_channel_id(guild_id, channel_id):
 
     params = [channel_id, guild_id]
 
-    result = execute_sql(sql, params, fetch=False)
+    result = await execute(sql, params)
 
-    return get_notification_channel_id(guild_id)
+    return await get_notification_channel_id(guild_id)
 
 
 
@@ -351,12 +350,12 @@ async def update_qa_modal_callback(custom_id, interaction, bot):
     
     message = await interaction.channel.fetch_message(message_id)
     
-    bot_response = await qa_view.get_answer_for_question(message.content)
+    direct_match = await qa_view.find_direct_match(message.content)
 
     answer = interaction.data['components'][0]['components'][0]['value']
 
-    if bot_response.direct_answer:
-        await qa_view.update_answer_for_qa_doc(bot_response.direct_answer.doc_idx, answer)
+    if direct_match:
+        await qa_view.update_answer_for_qa_doc(direct_match.doc_idx, answer)
 
         await interaction.response.send_message('Q&A pair successfully updated',
                                                 ephemeral=True)
@@ -378,7 +377,7 @@ async def delete_qa_modal_callback(custom_id, interaction, bot):
 
     message = await interaction.channel.fetch_message(message_id)
 
-    bot_response = await qa_view.get_answer_for_question(message.content)
+    direct_match = await qa_view.find_direct_match(message.content)
 
     confirm = interaction.data['components'][0]['components'][0]['value']
 
@@ -387,8 +386,8 @@ async def delete_qa_modal_callback(custom_id, interaction, bot):
                                                 ephemeral=True)
         return
 
-    if bot_response.direct_answer:
-        qa_view.delete_qa_pair_from_db(bot_response.direct_answer.doc_idx)
+    if direct_match:
+        await qa_view.delete_qa_pair_from_db(direct_match.doc_idx)
 
         await interaction.response.send_message('Q&A pair successfully deleted',
                                                 ephemeral=True)
@@ -406,17 +405,15 @@ async def toggle_admin_rights_callback(custom_id: str, interaction: discord.Inte
     guild = interaction.guild
     user = await guild.fetch_member(user_id)
 
-    create_user_if_not_exists(user)
+    await create_user_if_not_exists(user)
     
     if add == 1:
-        execute_sql("INSERT INTO api_community_admins (community_id, user_id) VALUES ((SELECT id FROM api_community WHERE guild_id = %s), (SELECT id FROM api_user WHERE discord_user_id = %s))",
-                    [guild.id, user_id],
-                    fetch=False)
+        await execute("INSERT INTO api_community_admins (community_id, user_id) VALUES ((SELECT id FROM api_community WHERE guild_id = %s), (SELECT id FROM api_user WHERE discord_user_id = %s))",
+                      [guild.id, user_id])
     else:
-        execute_sql(
+        await execute(
             "DELETE FROM api_community_admins WHERE community_id = (SELECT id FROM api_community WHERE guild_id = %s) AND user_id = (SELECT id FROM api_user WHERE discord_user_id = %s)",
-            [guild.id, user_id],
-            fetch=False)
+            [guild.id, user_id])
 
     await interaction.response.send_message(f"<@{user_id}> was succesfully added to admin list"
                                             if add
@@ -437,7 +434,7 @@ class Commands(discord.Cog):
                              ctx,
                              user
                              ):
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
 
         community = SUPPORTED_COMMUNITIES[ctx.guild_id]
         is_admin = community.user_has_admin_access(ctx.author)
@@ -445,7 +442,7 @@ class Commands(discord.Cog):
             await ctx.respond(f'Sorry, you don\'t have permissions to do this!', ephemeral=True)
             return
 
-        admin_rows = execute_sql("SELECT * FROM api_community_admins WHERE community_id = (SELECT id FROM api_community WHERE guild_id = %s) AND user_id = (SELECT id FROM api_user WHERE discord_user_id = %s)",
+        admin_rows = await fetch("SELECT * FROM api_community_admins WHERE community_id = (SELECT id FROM api_community WHERE guild_id = %s) AND user_id = (SELECT id FROM api_user WHERE discord_user_id = %s)",
                                  [ctx.guild_id, user.id])
 
         add = len(admin_rows) == 0
@@ -524,7 +521,7 @@ class Commands(discord.Cog):
 
         guild_id = ctx.interaction.guild_id
 
-        answer = get_answer(search, guild_id)
+        answer = await get_answer(search, guild_id)
 
         if answer:
             await ctx.respond(f"Question: {search}\n\nAnswer: {answer}\n")
@@ -540,7 +537,7 @@ class Commands(discord.Cog):
 
         guild_id = ctx.interaction.guild_id
 
-        qa_doc = get_qa_doc_by_completion(search, guild_id)
+        qa_doc = await get_qa_doc_by_completion(search, guild_id)
 
         if qa_doc:
             if show_question:
@@ -567,7 +564,7 @@ class Commands(discord.Cog):
                       ):
         guild_id = ctx.interaction.guild_id
 
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
 
         community = SUPPORTED_COMMUNITIES[guild_id]
 
@@ -602,14 +599,14 @@ class Commands(discord.Cog):
                       ):
         guild_id = ctx.interaction.guild_id
 
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
         if not is_admin:
             await ctx.respond(f'Sorry, you don\'t have permissions to do this!')
             return
 
-        if get_answer(question, guild_id) is not None:
+        if await get_answer(question, guild_id) is not None:
             await ctx.respond(f"Oops! It looks like this question already exists")
             return
 
@@ -634,7 +631,7 @@ class Commands(discord.Cog):
                       question: discord.commands.Option(str, "Search questions", autocomplete=get_questions)
                       ):
         guild_id = ctx.interaction.guild_id
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
         if not is_admin:
@@ -642,8 +639,8 @@ class Commands(discord.Cog):
             return
 
         try:
-            qa_doc_id = get_qadocument_id(question, guild_id)
-            tag_names = get_tags_by_qa_doc(qa_doc_id)
+            qa_doc_id = await get_qadocument_id(question, guild_id)
+            tag_names = await get_tags_by_qa_doc(qa_doc_id)
             await ctx.respond(f"Q: {question}\n\nTags: {', '.join(tag_names)}")
         except Exception as e:
             print(traceback.format_exc())
@@ -665,7 +662,7 @@ class Commands(discord.Cog):
                       tag10: discord.commands.Option(str, "Search tags", autocomplete=get_tags, required=False),
                       ):
         guild_id = ctx.interaction.guild_id
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
         if not is_admin:
@@ -686,7 +683,7 @@ class Commands(discord.Cog):
                               ctx,
                               channel: discord.commands.Option(discord.SlashCommandOptionType.channel, "Channel")
                               ):
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         guild_id = ctx.interaction.guild_id
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
@@ -695,7 +692,7 @@ class Commands(discord.Cog):
                               ephemeral=True)
             return
 
-        channel_id = set_notification_channel_id(ctx.interaction.guild_id, channel.id)
+        channel_id = await set_notification_channel_id(ctx.interaction.guild_id, channel.id)
         if channel_id is None:
             await ctx.respond(f'Unexpected error happened (channel seems to have been created very recently), please try again in 10 seconds',
                               ephemeral=True)
@@ -710,13 +707,13 @@ class Commands(discord.Cog):
                        question: discord.commands.Option(str, "Search questions", autocomplete=get_questions),
                        datetime: discord.commands.Option(str, "'YYYY-MM-DD HH:MM' in UTC")
                        ):
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         guild_id = ctx.interaction.guild_id
         community = SUPPORTED_COMMUNITIES[guild_id]
 
         is_admin = community.user_has_admin_access(ctx.interaction.user)
 
-        notifications_channel_id = get_notification_channel_id(guild_id)
+        notifications_channel_id = await get_notification_channel_id(guild_id)
 
         if notifications_channel_id is None:
             await ctx.respond(f"First, please use **/setnotificationchannel** slash command to set the channel where notifications " + \
@@ -732,9 +729,9 @@ class Commands(discord.Cog):
             return
 
         try:
-            qa_doc_id = get_qadocument_id(question, guild_id)
+            qa_doc_id = await get_qadocument_id(question, guild_id)
             dt = parse_datetime(datetime)
-            set_dt = set_revision_date(qa_doc_id, dt, guild_id)
+            set_dt = await set_revision_date(qa_doc_id, dt, guild_id)
             await ctx.respond(f"✏️ Revision date for Q: '**{question}**' successfully set to 🕒 **{format_datetime(set_dt)}** UTC. " + \
                               f"You will be notified in <#{notifications_channel_id}> when question needs revision. " + \
                               "In order to view revision dates of all questions, please use **/showrevisiondates** slash command. ",
@@ -759,7 +756,7 @@ class Commands(discord.Cog):
 
         strings_by_revision_date = {}
 
-        for qa_doc in get_qa_docs_with_revision_dates(guild_id):
+        for qa_doc in await get_qa_docs_with_revision_dates(guild_id):
             strings_by_revision_date[qa_doc['revision_date']] = \
                 f"- Revision date 🕒 **{format_datetime(qa_doc['revision_date'])}** UTC. Q: '**{qa_doc['prompt']}**'; A: '**{qa_doc['completion']}**'"
 
@@ -776,12 +773,12 @@ class Commands(discord.Cog):
                               ephemeral=True)
 
 async def send_all_notifications(guild):
-    channel_id = get_notification_channel_id(guild.id)
+    channel_id = await get_notification_channel_id(guild.id)
     if channel_id is None:
         return
     strings = []
     qa_doc_ids = []
-    for qa_doc in get_qa_docs_with_due_revision_dates(guild.id):
+    for qa_doc in await get_qa_docs_with_due_revision_dates(guild.id):
         try:
             strings.append(f'**{str(len(strings) + 1)}.** Q: "**{qa_doc["prompt"]}**"; A: "**{qa_doc["completion"]}**"')
             qa_doc_ids.append(qa_doc['id'])
@@ -791,4 +788,4 @@ async def send_all_notifications(guild):
     if len(strings) > 0:
         await channel.send('🕒 ✏️ **Revisions due: **\n' + '\n'.join(strings))
         for qa_id in qa_doc_ids:
-            clear_revision_date(qa_id, guild.id)
+            await clear_revision_date(qa_id, guild.id)
@@ -19,6 +19,7 @@ from api_util import get_entry_point_events, get_event_by_id, API_EVENT_TYPE_GUI
     create_captcha_challenge, verify_captcha_challenge, API_EVENT_HANDLER_TYPE_GRANT_ROLE
 import json
 from interaction_wrapper import InteractionWrapper
+from attachments import download_attachment, get_s3_attachment_files
 
 from event_logger import EventLogger
 
@@ -66,23 +67,8 @@ async def get_all_guided_flows():
     flows = list(filter(lambda x: x['event_type'] == API_EVENT_TYPE_GUIDED_FLOW, entry_points))
     return flows
 
-def get_step_files(step_file_db_objects):
-    files = []
-
-    for row in step_file_db_objects:
-        name = row['name']
-        file = row['file']
-
-        url = f'https://bn-bot-storage.s3.amazonaws.com/{file}'
-
-        response = requests.get(url)
-        if response.status_code != 200:
-            print('file fetch error', url)
-            continue
-        data = io.BytesIO(response.content)
-        files.append(discord.File(data, name))
-
-    return files
+async def get_step_files(step_file_db_objects):
+    return await get_s3_attachment_files('https://bn-bot-storage.s3.amazonaws.com', step_file_db_objects)
 
 async def handle_granted_role(interaction, granted_role_id, granted_role_needs_approval_by):
     guild = interaction.guild
@@ -323,7 +309,7 @@ async def respond_for_triggered_handlers(interaction_wrapper, triggered_handlers
             else:
                 message = await interaction_wrapper.send_message(step_text + "\n\nLoading attachments...", view=view,
                                                                  ephemeral=is_ephemeral)
-                files = get_step_files(step_file_db_objects)
+                files = await get_step_files(step_file_db_objects)
                 await message.edit(content=step_text, files=files)
             await add_discord_message_mapping(str(message.id), step["guided_flow_step_id"], callback_ids_sets)
         if handler_type == API_EVENT_HANDLER_TYPE_GRANT_ROLE:
@@ -402,13 +388,12 @@ async def respond_for_triggered_handlers(interaction_wrapper, triggered_handlers
             image_url = response["image"]
             captcha_request_id = response["id"]
             
-            response = requests.get(image_url)
-            if response.status_code != 200:
-                print('file fetch error', image_url)
+            image = await download_attachment(image_url)
+            if image is None:
                 message = await message.edit(content="Ups. Something went wrong")
                 return
 
-            data = io.BytesIO(response.content)
+            data = io.BytesIO(image)
 
             view = discord.ui.View()
             view.add_item(CaptchaButton(handler['event_id'], callback_ids_sets, captcha_request_id,
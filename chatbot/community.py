@@ -1,5 +1,5 @@
 from enum import Enum, unique
-from database import execute_sql
+from database import fetch
 
 class CommunityConfiguration:
 
@@ -59,66 +59,70 @@ class CommunityConfiguration:
 
 SUPPORTED_COMMUNITIES = {}
 
-def initialize_all_supported_communities():
-    # TODO: Make Async
+COMMUNITIES_SQL = """
+    SELECT c.id, 
+       c.id AS internal_id,
+       c.name AS name,
+       c.slug AS slug,
+       c.guild_id AS guild_id,
+       string_agg(DISTINCT u.discord_user_id :: text, ',') AS community_admin_ids,
+       string_agg(DISTINCT adc.channel_id :: text, ',') AS discord_channel_ids,
+       c.is_active AS is_active,
+       c.minimum_threshold AS minimum_threshold,
+       admin_role_ids,
+       verified_role_id,
+       kick_users_who_joined_but_did_not_verify_after_days,
+       kick_users_who_joined_but_did_not_verify_after_hours,
+       kick_users_ignore_datetime_before_utc,
+       kick_users_who_sent_spam_times
+    FROM api_community c 
+    LEFT JOIN api_community_admins ca ON c.id = ca.community_id
+    LEFT JOIN api_user u ON ca.user_id = u.id
+    LEFT JOIN api_botenableddiscordchannel dc ON c.id = dc.community_id AND dc.deleted_on IS NULL
+    LEFT JOIN api_alldiscordchanels adc on dc.channel_ref_id = adc.id
+"""
+
+def split_nums(str):
+    return list(map(int, filter(lambda x: bool(x), (str or '').split(','))))
+
+def community_from_row(row) -> CommunityConfiguration:
+    return CommunityConfiguration(
+        internal_id=row['internal_id'],
+        display_name=row['name'],
+        guild_id=row['guild_id'],
+        guild_slug=row['slug'],
+        users_with_write_access=split_nums(row['community_admin_ids']),
+        active_channels=split_nums(row['discord_channel_ids']),
+        is_active=row['is_active'],
+        minimum_threshold=row['minimum_threshold'],
+        admin_role_ids=split_nums(row['admin_role_ids']),
+        verified_role_id=row['verified_role_id'],
+        kick_users_who_joined_but_did_not_verify_after_days=row['kick_users_who_joined_but_did_not_verify_after_days'],
+        kick_users_who_joined_but_did_not_verify_after_hours=row['kick_users_who_joined_but_did_not_verify_after_hours'],
+        kick_users_ignore_datetime_before_utc=row['kick_users_ignore_datetime_before_utc'],
+        kick_users_who_sent_spam_times=row['kick_users_who_sent_spam_times']
+    )
+
+async def initialize_all_supported_communities():
+    q = await fetch(COMMUNITIES_SQL + " GROUP BY c.id")
+
     for k in list(SUPPORTED_COMMUNITIES.keys()):
         del SUPPORTED_COMMUNITIES[k]
 
-    q = execute_sql("""
-        SELECT c.id, 
-           c.id AS internal_id,
-           c.name AS name,
-           c.slug AS slug,
-           c.guild_id AS guild_id,
-           string_agg(DISTINCT u.discord_user_id :: text, ',') AS community_admin_ids,
-           string_agg(DISTINCT adc.channel_id :: text, ',') AS discord_channel_ids,
-           c.is_active AS is_active,
-           c.minimum_threshold AS minimum_threshold,
-           admin_role_ids,
-           verified_role_id,
-           kick_users_who_joined_but_did_not_verify_after_days,
-           kick_users_who_joined_but_did_not_verify_after_hours,
-           kick_users_ignore_datetime_before_utc,
-           kick_users_who_sent_spam_times
-        FROM api_community c 
-        LEFT JOIN api_community_admins ca ON c.id = ca.community_id
-        LEFT JOIN api_user u ON ca.user_id = u.id
-        LEFT JOIN api_botenableddiscordchannel dc ON c.id = dc.community_id AND dc.deleted_on IS NULL
-        LEFT JOIN api_alldiscordchanels adc on dc.channel_ref_id = adc.id
-        GROUP BY c.id
-    """)
-
-    def split_nums(str):
-        return list(map(int, filter(lambda x: bool(x), (str or '').split(','))))
-
     for row in q:
-        internal_id = row['internal_id']
-        name = row['name']
-        slug = row['slug']
-        guild_id = row['guild_id']
-        community_admin_ids = split_nums(row['community_admin_ids'])
-        discord_channel_ids = split_nums(row['discord_channel_ids'])
-        is_active = row['is_active']
-        minimum_threshold = row['minimum_threshold']
-        admin_role_ids = split_nums(row['admin_role_ids'])
-        verified_role_id = row['verified_role_id']
-        kick_users_who_joined_but_did_not_verify_after_days = row['kick_users_who_joined_but_did_not_verify_after_days']
-        kick_users_who_joined_but_did_not_verify_after_hours = row['kick_users_who_joined_but_did_not_verify_after_hours']
-        kick_users_ignore_datetime_before_utc = row['kick_users_ignore_datetime_before_utc']
-        kick_users_who_sent_spam_times = row['kick_users_who_sent_spam_times']
-        SUPPORTED_COMMUNITIES[guild_id] = CommunityConfiguration(
-            internal_id=internal_id,
-            display_name=name,
-            guild_id=guild_id,
-            guild_slug=slug,
-            users_with_write_access=community_admin_ids,
-            active_channels=discord_channel_ids,
-            is_active=is_active,
-            minimum_threshold=minimum_threshold,
-            admin_role_ids=admin_role_ids,
-            verified_role_id=verified_role_id,
-            kick_users_who_joined_but_did_not_verify_after_days=kick_users_who_joined_but_did_not_verify_after_days,
-            kick_users_who_joined_but_did_not_verify_after_hours=kick_users_who_joined_but_did_not_verify_after_hours,
-            kick_users_ignore_datetime_before_utc=kick_users_ignore_datetime_before_utc,
-            kick_users_who_sent_spam_times=kick_users_who_sent_spam_times
-        )
+        SUPPORTED_COMMUNITIES[row['guild_id']] = community_from_row(row)
+
+async def initialize_supported_community(guild_id):
+    """
+    Reloads configuration of a single community.
+
+    :return: the refreshed CommunityConfiguration, or None if the community no longer exists
+    """
+    q = await fetch(COMMUNITIES_SQL + " WHERE c.guild_id = %s GROUP BY c.id", [guild_id])
+
+    if len(q) == 0:
+        SUPPORTED_COMMUNITIES.pop(guild_id, None)
+        return None
+
+    SUPPORTED_COMMUNITIES[guild_id] = community_from_row(q[0])
+    return SUPPORTED_COMMUNITIES[guild_id]
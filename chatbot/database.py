@@ -1,23 +1,28 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from os import environ
 
-connection = psycopg2.connect(user=environ['SQL_USER'],
-                              password=environ['SQL_PASSWORD'],
-                              host=environ['SQL_HOST'],
-                              port=environ['SQL_PORT'],
-                              database=environ['SQL_DATABASE'])
+def create_connection():
+    return psycopg2.connect(user=environ['SQL_USER'],
+                            password=environ['SQL_PASSWORD'],
+                            host=environ['SQL_HOST'],
+                            port=environ['SQL_PORT'],
+                            database=environ['SQL_DATABASE'])
+
+# Blocking connection for scripts, code on the event loop uses the async pool below
+connection = None
 
 def reinitialize_connection():
     global connection
 
-    connection = psycopg2.connect(user=environ['SQL_USER'],
-                                  password=environ['SQL_PASSWORD'],
-                                  host=environ['SQL_HOST'],
-                                  port=environ['SQL_PORT'],
-                                  database=environ['SQL_DATABASE'])
+    connection = create_connection()
 
 def execute_sql(query, vars=None, fetch=True):
-    if connection.closed:
+    if connection is None or connection.closed:
         reinitialize_connection()
 
     cursor = connection.cursor()
@@ -40,3 +45,195 @@ def execute_sql(query, vars=None, fetch=True):
     cursor.close()
 
     return result
+
+# Async access for code running on the event loop. Queries run on a bounded pool of connections in worker
+# threads, so a slow query only occupies its own connection instead of blocking every guild.
+
+DB_POOL_MIN_SIZE = int(environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_QUERY_TIMEOUT_SECONDS = float(environ.get('DB_QUERY_TIMEOUT_SECONDS', '15'))
+
+class DatabaseTimeoutError(Exception):
+    pass
+
+def _rows_to_dicts(cursor):
+    rows = cursor.fetchall()
+    colnames = [desc[0] for desc in cursor.description]
+    return list(map(lambda row: dict(zip(colnames, row)), rows))
+
+class Transaction:
+    """
+    Single connection checked out of the pool. Everything executed through it is committed together
+    when the `transaction()` block exits, or rolled back if it raises.
+    """
+
+    def __init__(self, connection, executor, timeout):
+        self._connection = connection
+        self._executor = executor
+        self._timeout = timeout
+        self._statement_timeout = None
+        self._pending = None
+        self.is_broken = False
+
+    def _with_statement_timeout(self, query, timeout):
+        if timeout != self._statement_timeout:
+            # Sent together with the query to save a round-trip, results are those of the last statement
+            query = "SET LOCAL statement_timeout = %d; " % int(timeout * 1000) + query
+            self._statement_timeout = timeout
+        return query
+
+    def _execute_in_thread(self, query, vars, fetch, timeout):
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(self._with_statement_timeout(query, timeout), vars)
+            return _rows_to_dicts(cursor) if fetch else None
+        finally:
+            cursor.close()
+
+    def _execute_values_in_thread(self, query, argslist, template, page_size, fetch, timeout):
+        cursor = self._connection.cursor()
+        try:
+            rows = psycopg2.extras.execute_values(cursor, self._with_statement_timeout(query, timeout), argslist,
+                                                  template=template, page_size=page_size, fetch=fetch)
+            if not fetch:
+                return None
+            colnames = [desc[0] for desc in cursor.description]
+            return list(map(lambda row: dict(zip(colnames, row)), rows))
+        finally:
+            cursor.close()
+
+    async def _run(self, fn, *args, timeout):
+        loop = asyncio.get_running_loop()
+        self._pending = loop.run_in_executor(self._executor, fn, *args)
+        try:
+            # statement_timeout stops the query on the server, this also covers a stalled network
+            return await asyncio.wait_for(asyncio.shield(self._pending), timeout + 1)
+        except asyncio.TimeoutError:
+            self.is_broken = True
+            self._connection.cancel()
+            raise DatabaseTimeoutError(f"Query did not finish in {timeout} seconds")
+        except asyncio.CancelledError:
+            self.is_broken = True
+            self._connection.cancel()
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.is_broken = True
+            raise
+
+    async def fetch(self, query, vars=None, timeout=None):
+        timeout = timeout or self._timeout
+        return await self._run(self._execute_in_thread, query, vars, True, timeout, timeout=timeout)
+
+    async def execute(self, query, vars=None, timeout=None):
+        timeout = timeout or self._timeout
+        await self._run(self._execute_in_thread, query, vars, False, timeout, timeout=timeout)
+
+    async def execute_values(self, query, argslist, template=None, page_size=100, fetch=False, timeout=None):
+        """
+        Multi-row statement, `query` has a single %s that is replaced by VALUES of up to page_size rows
+        (see psycopg2.extras.execute_values).
+        """
+        timeout = timeout or self._timeout
+        return await self._run(self._execute_values_in_thread, query, argslist, template, page_size, fetch, timeout,
+                               timeout=timeout)
+
+    async def _wait_pending(self):
+        if self._pending is not None:
+            try:
+                await self._pending
+            except Exception:
+                pass
+            self._pending = None
+
+    async def _finish(self, commit):
+        # A cancelled query may still be running in its worker thread
+        await self._wait_pending()
+        if self.is_broken:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._connection.commit if commit else self._connection.rollback)
+        except Exception:
+            self.is_broken = True
+            if commit:
+                raise
+
+class AsyncConnectionPool:
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_QUERY_TIMEOUT_SECONDS):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = None
+        self._executor = None
+        self._semaphore = None
+
+    def _ensure_initialized(self):
+        if self._pool is None:
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                self.min_size, self.max_size,
+                user=environ['SQL_USER'],
+                password=environ['SQL_PASSWORD'],
+                host=environ['SQL_HOST'],
+                port=environ['SQL_PORT'],
+                database=environ['SQL_DATABASE'])
+            self._executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='db')
+            # Callers wait here instead of getting PoolError when all connections are checked out
+            self._semaphore = asyncio.Semaphore(self.max_size)
+
+    @asynccontextmanager
+    async def transaction(self, timeout=None):
+        self._ensure_initialized()
+        loop = asyncio.get_running_loop()
+
+        async with self._semaphore:
+            connection = await loop.run_in_executor(self._executor, self._pool.getconn)
+            if connection.closed:
+                self._pool.putconn(connection, close=True)
+                connection = await loop.run_in_executor(self._executor, self._pool.getconn)
+
+            tx = Transaction(connection, self._executor, timeout or self.timeout)
+            try:
+                yield tx
+            except BaseException:
+                await tx._finish(commit=False)
+                raise
+            else:
+                await tx._finish(commit=True)
+            finally:
+                self._pool.putconn(connection, close=tx.is_broken or bool(connection.closed))
+
+    async def fetch(self, query, vars=None, timeout=None):
+        async with self.transaction(timeout=timeout) as tx:
+            return await tx.fetch(query, vars)
+
+    async def execute(self, query, vars=None, timeout=None):
+        async with self.transaction(timeout=timeout) as tx:
+            await tx.execute(query, vars)
+
+    async def execute_values(self, query, argslist, template=None, page_size=100, fetch=False, timeout=None):
+        async with self.transaction(timeout=timeout) as tx:
+            return await tx.execute_values(query, argslist, template, page_size, fetch)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._executor.shutdown(wait=False)
+            self._pool = None
+
+pool = AsyncConnectionPool()
+
+async def fetch(query, vars=None, timeout=None):
+    return await pool.fetch(query, vars, timeout=timeout)
+
+async def execute(query, vars=None, timeout=None):
+    await pool.execute(query, vars, timeout=timeout)
+
+async def execute_values(query, argslist, template=None, page_size=100, fetch=False, timeout=None):
+    return await pool.execute_values(query, argslist, template, page_size, fetch, timeout=timeout)
+
+def transaction(timeout=None):
+    return pool.transaction(timeout=timeout)
+
+def close_pool():
+    pool.close()
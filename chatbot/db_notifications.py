@@ -0,0 +1,259 @@
+import asyncio
+import json
+import textwrap
+import traceback
+
+import psycopg2
+import psycopg2.extensions
+
+from database import create_connection
+
+NOTIFY_CHANNEL = 'landing_party_changes'
+
+NOTIFY_FUNCTION_NAME = 'landing_party_notify_change'
+
+# Tables whose changes affect CommunityConfiguration or QA retrieval state of a guild
+NOTIFY_TABLES = [
+    'api_community',
+    'api_botenableddiscordchannel',
+    'api_community_admins',
+    'api_qadocument',
+    'api_qadocumentalternativeprompt',
+]
+
+COMMUNITY_TABLES = ['api_community', 'api_botenableddiscordchannel', 'api_community_admins']
+QA_DOCUMENT_TABLES = ['api_qadocument', 'api_qadocumentalternativeprompt']
+
+# Payload only carries ids, pg_notify payload is limited to 8000 bytes
+CREATE_NOTIFY_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION {NOTIFY_FUNCTION_NAME}() RETURNS trigger AS $$
+    DECLARE
+        rec jsonb;
+        changed_guild_id text;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            rec := to_jsonb(OLD);
+        ELSE
+            rec := to_jsonb(NEW);
+        END IF;
+
+        changed_guild_id := rec->>'guild_id';
+
+        IF changed_guild_id IS NULL AND rec ? 'community_id' THEN
+            SELECT c.guild_id::text INTO changed_guild_id FROM api_community c
+                WHERE c.id = (rec->>'community_id')::bigint;
+        END IF;
+
+        IF changed_guild_id IS NULL AND rec ? 'qa_document_id' THEN
+            SELECT qa.guild_id::text INTO changed_guild_id FROM api_qadocument qa
+                WHERE qa.id = (rec->>'qa_document_id')::bigint;
+        END IF;
+
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', rec->'id',
+            'guild_id', changed_guild_id
+        )::text);
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+def create_trigger_sql(table) -> str:
+    return f"""
+        CREATE TRIGGER {NOTIFY_FUNCTION_NAME}
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {NOTIFY_FUNCTION_NAME}()
+    """
+
+def notification_triggers_sql() -> str:
+    """
+    Script creating the notify function and triggers, for a DB owner to run once
+    """
+    statements = [textwrap.dedent(CREATE_NOTIFY_FUNCTION_SQL).strip()]
+    for table in NOTIFY_TABLES:
+        statements.append(f"DROP TRIGGER IF EXISTS {NOTIFY_FUNCTION_NAME} ON {table};")
+        statements.append(textwrap.dedent(create_trigger_sql(table)).strip() + ";")
+    return '\n\n'.join(statements)
+
+def missing_notification_triggers(connection) -> list:
+    """
+    :return: tables of NOTIFY_TABLES without the notify trigger
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT tgrelid::regclass::text FROM pg_trigger WHERE tgname = %s AND NOT tgisinternal",
+                   [NOTIFY_FUNCTION_NAME])
+    installed = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return [table for table in NOTIFY_TABLES if table not in installed]
+
+def install_notification_triggers(connection):
+    """
+    Creates the notify function and the missing triggers. Existing triggers are left untouched,
+    so restarting the bot does not take table locks.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_NOTIFY_FUNCTION_SQL)
+
+    for table in missing_notification_triggers(connection):
+        print("CREATING NOTIFY TRIGGER", table)
+        cursor.execute(create_trigger_sql(table))
+
+    cursor.close()
+
+class ChangeListener:
+    """
+    Listens for row change notifications on a dedicated connection, without blocking the event loop
+    (the connection socket is watched by the loop itself).
+
+    Notifications are coalesced per guild for `debounce_seconds` (one admin portal save may touch many
+    rows) and then handed to `on_change(guild_id, tables)`. If the connection drops, changes made in the
+    meantime are unknown, so `on_reconnect()` is called once listening again.
+
+    Changes are only notified if the triggers exist on all NOTIFY_TABLES, `triggers_installed` tells
+    whether they did when the connection was opened.
+    """
+
+    def __init__(self, on_change, on_reconnect, install_triggers=False, debounce_seconds=1.0,
+                 reconnect_delay_seconds=5):
+        self.on_change = on_change
+        self.on_reconnect = on_reconnect
+        self.install_triggers = install_triggers
+        self.debounce_seconds = debounce_seconds
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+
+        self._connection = None
+        self._loop = None
+        self._pending_tables_by_guild_id = {}
+        self._flush_handle = None
+        self._has_connected = False
+        self._closed = False
+        self.triggers_installed = False
+
+    @property
+    def is_connected(self):
+        return self._connection is not None and not self._connection.closed
+
+    @property
+    def delivers_changes(self):
+        return self.is_connected and self.triggers_installed
+
+    def _connect(self):
+        connection = create_connection()
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        if self.install_triggers:
+            try:
+                install_notification_triggers(connection)
+            except Exception:
+                # Triggers may have been installed by a DB owner instead
+                print("Could not install notify triggers")
+                traceback.print_exc()
+
+        try:
+            missing_tables = missing_notification_triggers(connection)
+        except Exception:
+            print("Could not check notify triggers")
+            traceback.print_exc()
+            missing_tables = NOTIFY_TABLES
+        if missing_tables:
+            print("NOTIFY TRIGGERS MISSING, POLLING FOR CHANGES OF", missing_tables)
+        self.triggers_installed = not missing_tables
+
+        cursor = connection.cursor()
+        cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        cursor.close()
+
+        return connection
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+
+        while not self._closed:
+            try:
+                connection = await self._loop.run_in_executor(None, self._connect)
+                break
+            except Exception:
+                print("Change listener connection error")
+                traceback.print_exc()
+                await asyncio.sleep(self.reconnect_delay_seconds)
+        else:
+            return
+
+        self._connection = connection
+        self._loop.add_reader(connection.fileno(), self._on_readable)
+        print("CHANGE LISTENER STARTED")
+
+        if self._has_connected:
+            self._loop.create_task(self.on_reconnect())
+        self._has_connected = True
+
+    def close(self):
+        self._closed = True
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._connection is None:
+            return
+
+        try:
+            self._loop.remove_reader(self._connection.fileno())
+        except Exception:
+            pass
+
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+
+        self._connection = None
+
+    def _on_readable(self):
+        try:
+            self._connection.poll()
+        except Exception:
+            print("Change listener connection lost")
+            traceback.print_exc()
+            self._disconnect()
+            if not self._closed:
+                self._loop.call_later(self.reconnect_delay_seconds, lambda: self._loop.create_task(self.start()))
+            return
+
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+            except ValueError:
+                continue
+
+            if payload.get('guild_id') is None:
+                continue
+
+            guild_id = int(payload['guild_id'])
+            self._pending_tables_by_guild_id.setdefault(guild_id, set()).add(payload['table'])
+
+        if self._pending_tables_by_guild_id and self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.debounce_seconds, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        pending = self._pending_tables_by_guild_id
+        self._pending_tables_by_guild_id = {}
+
+        for guild_id, tables in pending.items():
+            self._loop.create_task(self._handle_change(guild_id, tables))
+
+    async def _handle_change(self, guild_id, tables):
+        try:
+            await self.on_change(guild_id, tables)
+        except Exception:
+            print("Error handling change notification", guild_id, tables)
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    # e.g. python3 db_notifications.py | psql "$DATABASE_URL"
+    print(notification_triggers_sql())
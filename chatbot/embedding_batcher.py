@@ -0,0 +1,98 @@
+import asyncio
+from typing import List
+
+from api_util import get_embeddings
+
+
+class EmbeddingApiError(Exception):
+    pass
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding requests for one model and sends them as a single embeddings API call,
+    once `max_batch_size` texts are waiting or `max_delay_seconds` after the first one arrived. If the API
+    rejects a batch (e.g. one text is over the token limit), its texts are sent again one by one, so only
+    the requests of the offending text fail.
+    """
+
+    def __init__(self, model, max_batch_size=64, max_delay_seconds=0.01):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay_seconds = max_delay_seconds
+
+        self._pending = []
+        self._flush_handle = None
+        # Sends in flight, referenced until done so they are not garbage collected
+        self._send_tasks = set()
+        self.batches_sent = 0
+        self.texts_sent = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay_seconds, self._flush)
+
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*[self.embed(text) for text in texts]))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = [(text, future) for text, future in self._pending if not future.done()]
+        self._pending = []
+
+        if len(batch) > 0:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    async def _request(self, texts) -> dict:
+        """
+        :return: embedding by text
+        """
+        response = await get_embeddings(texts, self.model)
+        if 'data' not in response:
+            raise EmbeddingApiError(response.get('error'))
+
+        self.batches_sent += 1
+        self.texts_sent += len(texts)
+        return {texts[item['index']]: item['embedding'] for item in response['data']}
+
+    async def _send(self, batch):
+        # The same text is often asked in several guilds at once, it is only sent once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+
+        try:
+            embedding_by_text = await self._request(texts)
+        except Exception as e:
+            if len(texts) == 1:
+                self._set_results(batch, {}, e)
+                return
+            print("Embedding batch of", len(texts), "texts failed, sending them one by one:", e)
+            await asyncio.gather(*[self._send([(text, future) for batch_text, future in batch if batch_text == text])
+                                   for text in texts])
+            return
+
+        self._set_results(batch, embedding_by_text)
+
+    @staticmethod
+    def _set_results(batch, embedding_by_text, error=None):
+        for text, future in batch:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif text in embedding_by_text:
+                future.set_result(embedding_by_text[text])
+            else:
+                future.set_exception(EmbeddingApiError("No embedding returned for input"))
@@ -0,0 +1,109 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+from ttl_cache import TTLCache
+
+
+def normalize_text(text: str) -> str:
+    """
+    Unicode, whitespace and case variants of the same message map to the same key.
+    """
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip().casefold()
+
+
+class SqliteEmbeddingStore:
+    """
+    Persistent tier of the embedding cache, so cached embeddings survive restarts. Vectors are stored as
+    little-endian float64, which keeps them exactly as returned by the API.
+    """
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    PRIMARY KEY (model, text)
+                )
+            """)
+            self._connection.commit()
+
+    def get(self, model, text) -> Optional[List[float]]:
+        with self._lock:
+            row = self._connection.execute("SELECT embedding FROM embedding_cache WHERE model = ? AND text = ?",
+                                           (model, text)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype='<f8').tolist()
+
+    def put(self, model, text, embedding: List[float]):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO embedding_cache (model, text, embedding) VALUES (?, ?, ?)",
+                                     (model, text, np.asarray(embedding, dtype='<f8').tobytes()))
+            self._connection.commit()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model, normalized text), in an in-memory LRU in front of an optional persistent
+    store. Store methods are blocking and meant to be run in an executor.
+    """
+
+    def __init__(self, max_size=10000, store: Optional[SqliteEmbeddingStore] = None):
+        self.memory = TTLCache(max_size=max_size, ttl_seconds=None)
+        self.store = store
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get_from_memory(self, model, text) -> Optional[List[float]]:
+        embedding = self.memory.get((model, normalize_text(text)))
+        if embedding is not None:
+            self.memory_hits += 1
+        return embedding
+
+    def get_from_store(self, model, text) -> Optional[List[float]]:
+        if self.store is None:
+            return None
+
+        key = normalize_text(text)
+        embedding = self.store.get(model, key)
+        if embedding is not None:
+            self.store_hits += 1
+            self.memory.set((model, key), embedding)
+        return embedding
+
+    def record_miss(self):
+        """
+        Called when neither tier had the embedding, whether or not the API returns it afterwards
+        """
+        self.misses += 1
+
+    @property
+    def lookups(self) -> int:
+        return self.memory_hits + self.store_hits + self.misses
+
+    def put(self, model, text, embedding: List[float]):
+        self.memory.set((model, normalize_text(text)), embedding)
+
+    def put_to_store(self, model, text, embedding: List[float]):
+        if self.store is not None:
+            self.store.put(model, normalize_text(text), embedding)
+
+    def stats(self) -> dict:
+        lookups = self.lookups
+        return {
+            'size': len(self.memory),
+            'memory_hits': self.memory_hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.store_hits) / lookups if lookups > 0 else 0.0,
+        }
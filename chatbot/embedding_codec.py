@@ -0,0 +1,85 @@
+import io
+import pickle
+import struct
+from typing import Any, List
+
+import numpy as np
+
+# Binary embedding format:
+#   16 byte header: magic, version, dtype code, reserved, dimension, L2 norm of the vector
+#   payload: dimension values of the dtype, little-endian
+# The header size keeps the float32 payload aligned, so it is read with np.frombuffer without copying.
+
+MAGIC = b'QAEV'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sBBHIf')
+
+DTYPE_FLOAT32 = 1
+
+DTYPES_BY_CODE = {
+    DTYPE_FLOAT32: np.dtype('<f4'),
+}
+
+
+class EmbeddingFormatError(ValueError):
+    pass
+
+
+def encode_embedding(embedding: List[float]) -> bytes:
+    vector = np.asarray(embedding, dtype='<f4')
+    if vector.ndim != 1:
+        raise EmbeddingFormatError(f"Embedding must be one-dimensional, got shape {vector.shape}")
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_FLOAT32, 0, len(vector), float(np.linalg.norm(vector)))
+    return header + vector.tobytes()
+
+
+def is_encoded_embedding(blob: Any) -> bool:
+    return bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def read_embedding_header(blob: Any) -> dict:
+    if len(blob) < HEADER.size:
+        raise EmbeddingFormatError("Embedding is shorter than its header")
+
+    magic, version, dtype_code, _, dimension, norm = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise EmbeddingFormatError("Not an encoded embedding")
+    if version != FORMAT_VERSION:
+        raise EmbeddingFormatError(f"Unsupported embedding format version {version}")
+    if dtype_code not in DTYPES_BY_CODE:
+        raise EmbeddingFormatError(f"Unsupported embedding dtype {dtype_code}")
+
+    return {'version': version, 'dtype': DTYPES_BY_CODE[dtype_code], 'dimension': dimension, 'norm': norm}
+
+
+class _LegacyEmbeddingUnpickler(pickle.Unpickler):
+    # Legacy rows are pickled lists of floats, which need no globals. Refusing every global means a
+    # crafted row cannot run code.
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Global {module}.{name} is not allowed in an embedding")
+
+
+def decode_legacy_embedding(blob: Any) -> np.ndarray:
+    embedding = _LegacyEmbeddingUnpickler(io.BytesIO(bytes(blob))).load()
+    if not isinstance(embedding, (list, tuple)) or not all(isinstance(x, (float, int)) for x in embedding):
+        raise EmbeddingFormatError("Legacy embedding is not a list of numbers")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def decode_embedding(blob: Any) -> np.ndarray:
+    """
+    Reads an embedding stored by encode_embedding, or a legacy pickled one.
+
+    :return: one-dimensional float32 array. For the binary format it is a read-only view over the blob.
+    """
+    if not is_encoded_embedding(blob):
+        return decode_legacy_embedding(blob)
+
+    header = read_embedding_header(blob)
+    expected_size = HEADER.size + header['dimension'] * header['dtype'].itemsize
+    if len(blob) != expected_size:
+        raise EmbeddingFormatError(f"Embedding has {len(blob)} bytes, expected {expected_size}")
+
+    return np.frombuffer(blob, dtype=header['dtype'], count=header['dimension'], offset=HEADER.size)
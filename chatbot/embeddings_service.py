@@ -1,8 +1,46 @@
 from typing import List, Any
+import asyncio
+import os
 import pickle
+import traceback
 
 import subprocess
-from api_util import get_embeddings
+from embedding_codec import encode_embedding
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, SqliteEmbeddingStore
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '10000'))
+# Optional sqlite file, keeps cached embeddings across restarts
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH')
+# Cache stats are printed every this many lookups
+EMBEDDING_CACHE_STATS_EVERY = int(os.environ.get('EMBEDDING_CACHE_STATS_EVERY', '1000'))
+
+# Shared by the services of all guilds, the same message is often posted in many of them
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE,
+                                 SqliteEmbeddingStore(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else None)
+
+EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get('EMBEDDING_BATCH_MAX_SIZE', '64'))
+EMBEDDING_BATCH_DELAY_SECONDS = float(os.environ.get('EMBEDDING_BATCH_DELAY_SECONDS', '0.01'))
+
+# 'binary' (embedding_codec) or 'pickle', for deployments where something else still unpickles the column
+EMBEDDING_DB_FORMAT = os.environ.get('EMBEDDING_DB_FORMAT', 'binary')
+
+# model -> EmbeddingBatcher
+embedding_batchers = {}
+
+def get_embedding_batcher(model) -> EmbeddingBatcher:
+    if model not in embedding_batchers:
+        embedding_batchers[model] = EmbeddingBatcher(model, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_DELAY_SECONDS)
+    return embedding_batchers[model]
+
+def _lookup_done():
+    if EMBEDDING_CACHE_STATS_EVERY > 0 and embedding_cache.lookups % EMBEDDING_CACHE_STATS_EVERY == 0:
+        print("EMBEDDING CACHE", embedding_cache.stats())
+
+def _check_store_put(future):
+    if not future.cancelled() and future.exception() is not None:
+        print("Error writing embedding to the cache store")
+        traceback.print_exception(type(future.exception()), future.exception(), future.exception().__traceback__)
 
 class EmbeddingsService:
 
@@ -10,12 +48,25 @@ class EmbeddingsService:
         self.api_engine = "text-similarity-ada-001"
 
     async def get_embedding_for_text(self, text: str) -> List[float]:
-        embedding_response = await get_embeddings(text, self.api_engine)
-        embedding = embedding_response['data'][0]['embedding']
-        return embedding
+        loop = asyncio.get_running_loop()
+        embedding = embedding_cache.get_from_memory(self.api_engine, text)
+        if embedding is None and embedding_cache.store is not None:
+            embedding = await loop.run_in_executor(None, embedding_cache.get_from_store, self.api_engine, text)
+        if embedding is not None:
+            _lookup_done()
+            return list(embedding)
+
+        embedding_cache.record_miss()
+        _lookup_done()
+        embedding = await get_embedding_batcher(self.api_engine).embed(text)
+
+        embedding_cache.put(self.api_engine, text, embedding)
+        if embedding_cache.store is not None:
+            loop.run_in_executor(None, embedding_cache.put_to_store, self.api_engine, text,
+                                 list(embedding)).add_done_callback(_check_store_put)
+        return list(embedding)
 
     def format_embedding_for_db(self, embedding: List[float]) -> Any:
-        # sqlite3 can't store lists/arrays, so concatenate floats with commas and store it as a string.
-        # TODO: Conversion precision loss from float to str?
-        # return ",".join((map(lambda x: str(x), embedding)))
-        return pickle.dumps(embedding)
\ No newline at end of file
+        if EMBEDDING_DB_FORMAT == 'pickle':
+            return pickle.dumps(list(embedding))
+        return encode_embedding(embedding)
\ No newline at end of file
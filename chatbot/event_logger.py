@@ -86,7 +86,7 @@ class EventLogger:
             )
         )
 
-    def track_user_kick(self, user, community):
+    def _user_kick_event(self, user, community) -> BaseEvent:
 
         event_name = 'KICK_USER'
 
@@ -118,11 +118,20 @@ class EventLogger:
             event_properties["verified_role_id"] = \
                 community.verified_role_id
 
-        self._amplitude_client.track(
-            BaseEvent(
-                event_type=event_name,
-                user_id=str(user.id),
-                event_properties=event_properties,
-                user_properties=user_properties
-            )
+        return BaseEvent(
+            event_type=event_name,
+            user_id=str(user.id),
+            event_properties=event_properties,
+            user_properties=user_properties
         )
+
+    def track_user_kick(self, user, community):
+        self._amplitude_client.track(self._user_kick_event(user, community))
+
+    def track_user_kicks(self, kicks):
+        """
+        :param: kicks   (user, community) pairs, sent to Amplitude together
+        """
+        for user, community in kicks:
+            self._amplitude_client.track(self._user_kick_event(user, community))
+        self._amplitude_client.flush()
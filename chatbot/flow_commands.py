@@ -3,28 +3,12 @@ from discord.commands import SlashCommandGroup
 from commands_guided_flows import OnboardingInvitationButton
 from commands_guided_flows import ActionButton
 import api_util
-import requests
-import io
+from attachments import get_s3_attachment_files
 from community import initialize_all_supported_communities, SUPPORTED_COMMUNITIES
 
-def get_embed_files(embed_file_db_objects):
-    files = []
-
-    for row in embed_file_db_objects:
-        name = row['name']
-        file = row['file']
-
-        # TODO Replace with your S3 url (needs to the same as on back-end)
-        url = f'https://yours3url.s3.amazonaws.com/{file}'
-
-        response = requests.get(url)
-        if response.status_code != 200:
-            print('file fetch error', url)
-            continue
-        data = io.BytesIO(response.content)
-        files.append(discord.File(data, name))
-
-    return files
+async def get_embed_files(embed_file_db_objects):
+    # TODO Replace with your S3 url (needs to the same as on back-end)
+    return await get_s3_attachment_files('https://yours3url.s3.amazonaws.com', embed_file_db_objects)
 
 class FlowCommands(discord.Cog):
 
@@ -33,7 +17,7 @@ class FlowCommands(discord.Cog):
 
     @discord.slash_command(name="create_button_for_flowentry")
     async def select_menu_single_choice(self, ctx, title: discord.commands.Option(str, "title"), description: discord.commands.Option(str, "description")):
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         guild_id = ctx.interaction.guild_id
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
@@ -88,7 +72,7 @@ class FlowCommands(discord.Cog):
             interaction = ctx.interaction
             await interaction.response.send_message("Loading attachments...")
 
-            files = get_embed_files(file_db_objects)
+            files = await get_embed_files(file_db_objects)
             await interaction.edit_original_message(content="", files=files)
         else:
             await ctx.interaction.channel.send(embed=embed, view=view)
@@ -98,7 +82,7 @@ class FlowCommands(discord.Cog):
     async def edit_button_for_flowentry(self, ctx, title: discord.commands.Option(str, "title"),
                                         description: discord.commands.Option(str, "description"),
                                         message_id: discord.commands.Option(str, "message id")):
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         guild_id = ctx.interaction.guild_id
         community = SUPPORTED_COMMUNITIES[guild_id]
         is_admin = community.user_has_admin_access(ctx.interaction.user)
@@ -166,7 +150,7 @@ class FlowCommands(discord.Cog):
         await message.edit(content="Loading...", attachments=[])
 
         if file_db_objects and len(file_db_objects) > 0:
-            files = get_embed_files(file_db_objects)
+            files = await get_embed_files(file_db_objects)
             # For some reason does not work without refresh
             message = await get_message()
             await message.edit(content="", embed=embed, view=view, files=files)
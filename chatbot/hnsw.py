@@ -0,0 +1,190 @@
+import heapq
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph (Malkov & Yashunin) over unit vectors, so similarity is the dot
+    product. Each node carries a label (QA document id), several nodes may share one.
+
+    Nodes are only ever added. Deleting a label marks its nodes as tombstones: they still route searches
+    but are not returned, and the owner rebuilds the index once too many of them pile up.
+
+    :param: m                   links per node on upper layers, 2 * m on the bottom layer
+    :param: ef_construction     candidate list size while inserting, higher builds a better graph slower
+    """
+
+    def __init__(self, dim, m=16, ef_construction=100, seed=0):
+        self.dim = dim
+        self.m = m
+        self.max_m0 = 2 * m
+        self.ef_construction = max(ef_construction, m)
+        self.level_multiplier = 1 / math.log(m)
+        self._rng = np.random.default_rng(seed)
+
+        self.vectors = np.empty((16, dim), dtype=np.float32)
+        self.labels = np.empty(16, dtype=np.int64)
+        self.deleted = np.zeros(16, dtype=bool)
+        self.count = 0
+        self.deleted_count = 0
+
+        # node -> neighbor lists, one per layer the node is on
+        self.graph = []
+        self.entry_point = None
+        self.max_level = -1
+
+    def __len__(self):
+        return self.count - self.deleted_count
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return self.deleted_count / self.count if self.count > 0 else 0.0
+
+    def _grow(self):
+        capacity = len(self.vectors) * 2
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        labels = np.empty(capacity, dtype=np.int64)
+        labels[:self.count] = self.labels[:self.count]
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:self.count] = self.deleted[:self.count]
+        self.vectors, self.labels, self.deleted = vectors, labels, deleted
+
+    def _search_layer(self, query, entry_points, ef, level) -> List[Tuple[float, int]]:
+        """
+        :return: up to ef (similarity, node) pairs closest to the query on the layer, most similar first
+        """
+        visited = set(entry_points)
+        similarities = (self.vectors[entry_points] @ query).tolist()
+
+        # Max-heap of nodes to expand, min-heap of the best ef found so far
+        candidates = [(-similarity, node) for similarity, node in zip(similarities, entry_points)]
+        heapq.heapify(candidates)
+        results = [(similarity, node) for similarity, node in zip(similarities, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_similarity, node = heapq.heappop(candidates)
+            if -negative_similarity < results[0][0] and len(results) >= ef:
+                break
+
+            neighbors = [neighbor for neighbor in self.graph[node][level] if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for similarity, neighbor in zip((self.vectors[neighbors] @ query).tolist(), neighbors):
+                if len(results) < ef or similarity > results[0][0]:
+                    heapq.heappush(candidates, (-similarity, neighbor))
+                    heapq.heappush(results, (similarity, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates, max_links) -> List[int]:
+        """
+        Neighbor selection heuristic: a candidate is linked only if it is closer to the new node than to every
+        neighbor selected so far. This keeps links to other clusters, otherwise tight clusters (many
+        variations of one question) end up disconnected from the rest of the graph.
+
+        :param: candidates  (similarity to the node being linked, candidate node) pairs, most similar first
+        """
+        selected = []
+        pruned = []
+        for similarity, candidate in candidates:
+            if len(selected) >= max_links:
+                break
+            if selected and (self.vectors[selected] @ self.vectors[candidate]).max() >= similarity:
+                pruned.append(candidate)
+            else:
+                selected.append(candidate)
+
+        # Free slots are filled with the closest pruned candidates
+        return selected + pruned[:max_links - len(selected)]
+
+    def add(self, vector, label):
+        """
+        :param: vector  unit vector
+        """
+        if self.count == len(self.vectors):
+            self._grow()
+
+        node = self.count
+        self.vectors[node] = vector
+        self.labels[node] = label
+        self.deleted[node] = False
+        self.count += 1
+
+        level = int(-math.log(1 - self._rng.random()) * self.level_multiplier)
+        self.graph.append([[] for _ in range(level + 1)])
+
+        if self.entry_point is None:
+            self.entry_point = node
+            self.max_level = level
+            return
+
+        query = self.vectors[node]
+        entry_points = [self.entry_point]
+        for layer in range(self.max_level, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+
+        for layer in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, layer)
+            max_links = self.max_m0 if layer == 0 else self.m
+
+            neighbors = self._select_neighbors(found, self.m)
+            self.graph[node][layer] = neighbors
+
+            for neighbor in neighbors:
+                links = self.graph[neighbor][layer]
+                links.append(node)
+                if len(links) > max_links:
+                    link_similarities = self.vectors[links] @ self.vectors[neighbor]
+                    order = np.argsort(-link_similarities)
+                    self.graph[neighbor][layer] = self._select_neighbors(
+                        [(link_similarities[i], links[i]) for i in order], max_links)
+
+            entry_points = [neighbor for _, neighbor in found]
+
+        if level > self.max_level:
+            self.max_level = level
+            self.entry_point = node
+
+    def mark_deleted(self, label) -> int:
+        nodes = np.flatnonzero((self.labels[:self.count] == label) & ~self.deleted[:self.count])
+        self.deleted[nodes] = True
+        self.deleted_count += len(nodes)
+        return len(nodes)
+
+    def search(self, query, k, ef) -> List[Tuple[float, int]]:
+        """
+        :param: query   unit vector
+        :param: ef      candidate list size, higher gives better recall at higher latency
+        :return: up to k (similarity, node) pairs of live nodes, most similar first
+        """
+        if self.entry_point is None:
+            return []
+
+        entry_points = [self.entry_point]
+        for layer in range(self.max_level, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+
+        found = self._search_layer(query, entry_points, max(ef, k), 0)
+        return [(similarity, node) for similarity, node in found if not self.deleted[node]][:k]
+
+
+def build_index(vectors: np.ndarray, labels: np.ndarray, m=16, ef_construction=100) -> HNSWIndex:
+    """
+    Builds the index over all rows, meant to run in a worker process (the build is pure Python and would
+    hold the GIL for its whole duration)
+    """
+    index = HNSWIndex(vectors.shape[1], m, ef_construction)
+    for vector, label in zip(vectors, labels):
+        index.add(vector, label)
+    return index
@@ -0,0 +1,202 @@
+import asyncio
+import collections
+import os
+import time
+import traceback
+from typing import List
+
+import discord
+
+from event_logger import EventLogger
+
+# Kicks are queued per guild and run by a pool of workers, guilds take turns (round robin) so a raid in
+# one guild does not delay kicks everywhere else. Kicks of one guild share a Discord rate limit bucket
+# (DELETE /guilds/{guild_id}/members/{user_id}), so at most one kick per guild is in flight and the
+# HTTP client's bucket handling never has to queue them. Kicks of different guilds run in parallel.
+KICK_EXECUTOR_WORKERS = int(os.environ.get('KICK_EXECUTOR_WORKERS', '4'))
+# Members that would be kicked are only reported
+KICK_DRY_RUN = os.environ.get('KICK_DRY_RUN', '0') == '1'
+KICK_TRACK_BATCH_SIZE = int(os.environ.get('KICK_TRACK_BATCH_SIZE', '50'))
+# Kicks per minute are reported over this window
+KICK_METRICS_WINDOW_SECONDS = 60
+KICK_DRY_RUN_REPORT_SIZE = 10000
+
+KICK_REASON_UNVERIFIED = 'unverified'
+KICK_REASON_SPAM = 'spam'
+
+
+class KickExecutor:
+    """
+    Workers are started with the first kick. Counters and kicks_per_minute are the throughput metrics,
+    they are printed with stats() whenever the queue drains, in dry-run mode together with dry_run_report().
+
+    :param: on_failure  called with (member, community, reason) of kicks that failed, e.g. to retry them
+    """
+
+    def __init__(self, workers=KICK_EXECUTOR_WORKERS, dry_run=KICK_DRY_RUN, on_failure=None):
+        self.workers = workers
+        self.dry_run = dry_run
+        self.on_failure = on_failure
+
+        # guild_id -> deque of (member, community, reason)
+        self._queues = {}
+        # Guilds with queued kicks and no kick in flight, in turn order
+        self._ready_guilds = collections.deque()
+        self._busy_guilds = set()
+        # (guild_id, member_id) of queued and in flight kicks
+        self._queued_members = set()
+        # Created with the workers, inside the running loop
+        self._ready = None
+        self._worker_tasks = []
+
+        # Kicks waiting to be sent to analytics in one batch
+        self._tracked_kicks = []
+
+        self.kicked = 0
+        self.failed = 0
+        self.skipped = 0
+        self.dry_run_kicks = collections.deque(maxlen=KICK_DRY_RUN_REPORT_SIZE)
+        self._kick_times = collections.deque()
+
+    def enqueue(self, member, community, reason) -> bool:
+        """
+        :return: False if the member is already queued
+        """
+        key = (member.guild.id, member.id)
+        if key in self._queued_members:
+            return False
+
+        self._start_workers()
+        self._queued_members.add(key)
+        queue = self._queues.setdefault(member.guild.id, collections.deque())
+        queue.append((member, community, reason))
+        if len(queue) == 1 and member.guild.id not in self._busy_guilds:
+            self._ready_guilds.append(member.guild.id)
+            self._ready.set()
+        return True
+
+    def _start_workers(self):
+        if not self._worker_tasks:
+            loop = asyncio.get_running_loop()
+            self._ready = asyncio.Event()
+            self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def queued(self) -> int:
+        return len(self._queued_members)
+
+    async def _worker(self):
+        while True:
+            while not self._ready_guilds:
+                self._ready.clear()
+                await self._ready.wait()
+
+            guild_id = self._ready_guilds.popleft()
+            self._busy_guilds.add(guild_id)
+            member, community, reason = self._queues[guild_id].popleft()
+            try:
+                await self._kick(member, community, reason)
+            except Exception:
+                print("kick ERROR", guild_id, member.id)
+                traceback.print_exc()
+                self._failed(member, community, reason)
+            finally:
+                self._queued_members.discard((guild_id, member.id))
+                self._busy_guilds.discard(guild_id)
+                if self._queues[guild_id]:
+                    # Back of the line, other guilds go first
+                    self._ready_guilds.append(guild_id)
+                    self._ready.set()
+                else:
+                    del self._queues[guild_id]
+
+            if not self._queued_members:
+                self._flush_tracked_kicks()
+                print("KICK EXECUTOR DRAINED", self.stats())
+                if self.dry_run:
+                    for kick in self.dry_run_report():
+                        print("DRY RUN REPORT", kick)
+
+    async def _kick(self, member, community, reason):
+        if self.dry_run:
+            self.dry_run_kicks.append({'guild_id': member.guild.id, 'member_id': member.id,
+                                       'member': str(member), 'reason': reason})
+            print("DRY RUN KICK", member.guild.id, str(member), reason)
+            return
+
+        try:
+            print("KICKING " + str(member), reason)
+            await member.kick()
+        except discord.NotFound:
+            # Left or was kicked meanwhile
+            self.skipped += 1
+            return
+        except discord.Forbidden:
+            print("KICK FORBIDDEN", member.guild.id, member.id)
+            self._failed(member, community, reason)
+            return
+
+        self.kicked += 1
+        self._kick_times.append(time.monotonic())
+        self._drop_old_kick_times()
+
+        if reason == KICK_REASON_UNVERIFIED:
+            self._tracked_kicks.append((member, community))
+            if len(self._tracked_kicks) >= KICK_TRACK_BATCH_SIZE:
+                self._flush_tracked_kicks()
+
+    def _failed(self, member, community, reason):
+        self.failed += 1
+        if self.on_failure is not None:
+            try:
+                self.on_failure(member, community, reason)
+            except Exception:
+                print("Error handling failed kick", member.guild.id, member.id)
+                traceback.print_exc()
+
+    def _flush_tracked_kicks(self):
+        if not self._tracked_kicks:
+            return
+        tracked_kicks, self._tracked_kicks = self._tracked_kicks, []
+        try:
+            EventLogger().track_user_kicks(tracked_kicks)
+        except Exception:
+            print("Error tracking user kicks")
+            traceback.print_exc()
+
+    def _drop_old_kick_times(self):
+        window_start = time.monotonic() - KICK_METRICS_WINDOW_SECONDS
+        while self._kick_times and self._kick_times[0] < window_start:
+            self._kick_times.popleft()
+
+    def kicks_per_minute(self) -> float:
+        self._drop_old_kick_times()
+        return len(self._kick_times) * 60 / KICK_METRICS_WINDOW_SECONDS
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'guilds_queued': len(self._queues),
+            'kicked': self.kicked,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'dry_run': self.dry_run,
+            'dry_run_kicks': len(self.dry_run_kicks),
+            'kicks_per_minute': self.kicks_per_minute(),
+        }
+
+    def dry_run_report(self, clear=True) -> List[dict]:
+        """
+        :return: members that would have been kicked in dry-run mode, oldest first
+        """
+        report = list(self.dry_run_kicks)
+        if clear:
+            self.dry_run_kicks.clear()
+        return report
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._flush_tracked_kicks()
@@ -0,0 +1,175 @@
+import datetime
+import heapq
+import os
+from typing import List, Optional, Tuple
+
+# Deadlines of members that have to verify in communities with a verified role. Members are scheduled on
+# join, or when a guild is loaded from the gateway member cache, and cancelled once they are verified or
+# leave. The kick loop only pops members that are due, instead of paging through all members of all guilds.
+
+KICK_SCHEDULER_TICK_SECONDS = int(os.environ.get('KICK_SCHEDULER_TICK_SECONDS', '5'))
+# Failed kicks are scheduled again after KICK_RETRY_SECONDS, doubled with every failure of the same member
+# up to KICK_RETRY_MAX_SECONDS
+KICK_RETRY_SECONDS = float(os.environ.get('KICK_RETRY_SECONDS', '60'))
+KICK_RETRY_MAX_SECONDS = float(os.environ.get('KICK_RETRY_MAX_SECONDS', '3600'))
+
+
+def kick_config(community) -> tuple:
+    """
+    Settings that decide kick deadlines, guilds are reloaded when they change
+    """
+    return (community.verified_role_id,
+            community.kick_users_who_joined_but_did_not_verify_after_days,
+            community.kick_users_who_joined_but_did_not_verify_after_hours,
+            community.kick_users_ignore_datetime_before_utc)
+
+def kick_due_time(member, community) -> Optional[float]:
+    """
+    :return: UTC timestamp at which the member is kicked unless verified, None if the member is never kicked
+    """
+    if member.bot or member.joined_at is None:
+        # joined_at is None is a Discord API edge case (unknown how to reproduce)
+        return None
+
+    joined_at = member.joined_at
+    if joined_at.tzinfo is None:
+        joined_at = joined_at.replace(tzinfo=datetime.timezone.utc)
+
+    ignore_before = community.kick_users_ignore_datetime_before_utc
+    if ignore_before is not None:
+        if ignore_before.tzinfo is None:
+            ignore_before = ignore_before.replace(tzinfo=datetime.timezone.utc)
+        if joined_at < ignore_before:
+            return None
+
+    delay = datetime.timedelta(days=community.kick_users_who_joined_but_did_not_verify_after_days or 0,
+                               hours=community.kick_users_who_joined_but_did_not_verify_after_hours or 0)
+    return (joined_at + delay).timestamp()
+
+def is_kick_exempt(member, community) -> bool:
+    if member.get_role(community.verified_role_id) is not None:
+        return True
+    permissions = member.guild_permissions
+    return permissions.manage_guild or permissions.administrator
+
+
+class KickScheduler:
+    """
+    Min-heap of (due time, guild id, member id). Cancelling or rescheduling only updates the due time
+    in a dict, heap entries that no longer match it are skipped when they surface (lazy deletion), and
+    the heap is rebuilt once stale entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # (guild_id, member_id) -> due time
+        self._due_times = {}
+        # guild_id -> kick_config the guild was loaded with
+        self._guild_configs = {}
+        # (guild_id, member_id) -> (failed kicks, earliest retry time) of members whose kick failed
+        self._retries = {}
+
+    def __len__(self):
+        return len(self._due_times)
+
+    def schedule(self, guild_id, member_id, due_time: float):
+        key = (guild_id, member_id)
+        if self._due_times.get(key) == due_time:
+            return
+        self._due_times[key] = due_time
+        heapq.heappush(self._heap, (due_time, guild_id, member_id))
+        self._compact_if_needed()
+
+    def cancel(self, guild_id, member_id) -> bool:
+        self._retries.pop((guild_id, member_id), None)
+        return self._due_times.pop((guild_id, member_id), None) is not None
+
+    def retry(self, guild_id, member_id, now: float) -> float:
+        """
+        Schedules a member whose kick failed again, with exponential backoff
+
+        :return: time of the retry
+        """
+        failures = self._retries.get((guild_id, member_id), (0, None))[0] + 1
+        retry_time = now + min(KICK_RETRY_SECONDS * 2 ** (failures - 1), KICK_RETRY_MAX_SECONDS)
+        self._retries[(guild_id, member_id)] = (failures, retry_time)
+        self.schedule(guild_id, member_id, retry_time)
+        return retry_time
+
+    def next_due_time(self) -> Optional[float]:
+        self._drop_stale_head()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[int, int]]:
+        """
+        :return: (guild_id, member_id) of members due at now, they are removed from the schedule
+        """
+        due = []
+        while True:
+            self._drop_stale_head()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, guild_id, member_id = heapq.heappop(self._heap)
+            del self._due_times[(guild_id, member_id)]
+            due.append((guild_id, member_id))
+
+    def _drop_stale_head(self):
+        while self._heap:
+            due_time, guild_id, member_id = self._heap[0]
+            if self._due_times.get((guild_id, member_id)) == due_time:
+                return
+            heapq.heappop(self._heap)
+
+    def _compact_if_needed(self):
+        if len(self._heap) > 2 * len(self._due_times) + 1000:
+            self._heap = [(due_time, guild_id, member_id) for (guild_id, member_id), due_time in self._due_times.items()]
+            heapq.heapify(self._heap)
+
+    def is_guild_loaded(self, guild_id) -> bool:
+        return guild_id in self._guild_configs
+
+    def loaded_guild_ids(self) -> List[int]:
+        return list(self._guild_configs.keys())
+
+    def clear_guild(self, guild_id):
+        self._guild_configs.pop(guild_id, None)
+        for key in [key for key in self._due_times if key[0] == guild_id]:
+            del self._due_times[key]
+        for key in [key for key in self._retries if key[0] == guild_id]:
+            del self._retries[key]
+        self._compact_if_needed()
+
+    def schedule_member(self, member, community):
+        """
+        (Re)schedules the member, or cancels it if it is verified or never kicked
+        """
+        due_time = kick_due_time(member, community)
+        if due_time is None or is_kick_exempt(member, community):
+            self.cancel(member.guild.id, member.id)
+        else:
+            # A pending retry is not brought forward
+            retry_time = self._retries.get((member.guild.id, member.id), (0, due_time))[1]
+            self.schedule(member.guild.id, member.id, max(due_time, retry_time))
+
+    def sync_guild(self, guild, community) -> bool:
+        """
+        Loads the guild from its member cache, or reloads it when kick settings of the community changed.
+        Guilds without the verified role are not scheduled, nobody there could verify.
+
+        :param: guild   guild with a complete member cache (guild.chunked)
+        :return: whether the guild is scheduled
+        """
+        config = kick_config(community)
+        if not community.verified_role_id or guild.get_role(community.verified_role_id) is None:
+            if self.is_guild_loaded(guild.id):
+                print("VERIFIED ROLE DOES NOT EXIST IN COMMUNITY", community.guild_id)
+                self.clear_guild(guild.id)
+            return False
+
+        if self._guild_configs.get(guild.id) != config:
+            self.clear_guild(guild.id)
+            for member in guild.members:
+                self.schedule_member(member, community)
+            self._guild_configs[guild.id] = config
+            print("KICK SCHEDULER LOADED", guild.id, sum(1 for key in self._due_times if key[0] == guild.id), "UNVERIFIED")
+        return True
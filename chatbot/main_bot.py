@@ -1,12 +1,14 @@
 import os
 import logging
 import discord
-from community import SUPPORTED_COMMUNITIES, initialize_all_supported_communities
+from community import SUPPORTED_COMMUNITIES, initialize_all_supported_communities, initialize_supported_community
 from qa_view import QAView
+from qa_retrieval import refresh_qa_retrieval, refresh_guild_qa_retrieval, warm_start_qa_retrieval
+from db_notifications import ChangeListener, COMMUNITY_TABLES, QA_DOCUMENT_TABLES
 from dotenv import load_dotenv
 import time
 
-from database import execute_sql
+from database import close_pool
 
 from bot_reaction_commands import REACTION_COMMANDS
 from bot_message_commands import MESSAGE_COMMANDS
@@ -35,13 +37,19 @@ import sys
 import traceback
 
 import sentry_sdk
-from event_logger import EventLogger
 
-from api_util import get_first_message_mapping_in_message_id_list, add_user_file_upload, sync_all_channels
+from api_util import get_first_message_mapping_in_message_id_list, add_user_file_upload
+from channel_sync import sync_guilds_channels, schedule_guild_channel_sync
+from kick_executor import KickExecutor, KICK_REASON_UNVERIFIED
+from kick_scheduler import KickScheduler, kick_due_time, is_kick_exempt, KICK_SCHEDULER_TICK_SECONDS
+from role_sync import sync_guild_roles, queue_member_roles, queue_role_set, iterate_members, \
+    ROLE_SYNC_RECONCILE_HOURS
+import api_util
+from slack_util import close_slack_event_logs
 
 import datetime
 
-from event_logger import EventLogger
+SAFETY_NET_POLL_INTERVAL_SECONDS = 10 * 60
 
 # Uncomment to log ALL pycord logs to stdout
 #logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -56,9 +64,13 @@ class BackgroundBot(discord.Bot):
 
         #Iterate through all communities and create a QAView for each one
         self.__qa_views_dict = dict()
-        initialize_all_supported_communities()
+        # Event loop is not running yet, nothing else can be blocked here
+        self.loop.run_until_complete(initialize_all_supported_communities())
         self.initialize_qa_views()
         self.persistent_views_added = False
+        self.change_listener = None
+        self.kick_scheduler = KickScheduler()
+        self.kick_executor = KickExecutor(on_failure=self.retry_failed_kick)
         sentry_sdk.init(
             dsn="", # Fill you Sentry DSN here
 
@@ -80,9 +92,28 @@ class BackgroundBot(discord.Bot):
             # self.add_view(TicketButton())
             self.persistent_views_added = True
 
+        if self.change_listener is None:
+            self.change_listener = ChangeListener(
+                on_change=self.on_db_change,
+                on_reconnect=self.on_db_change_listener_reconnect,
+                install_triggers=os.getenv('DB_NOTIFY_INSTALL_TRIGGERS', '0') == '1')
+            self.loop.create_task(self.change_listener.start())
+            # Guilds that were answering questions before the restart get their index from disk snapshots
+            self.loop.create_task(warm_start_qa_retrieval(set(SUPPORTED_COMMUNITIES.keys())))
+
         print(f"Logged in as {self.user} (ID: {self.user.id})")
         print("------")
     
+    async def close(self):
+        if self.change_listener is not None:
+            self.change_listener.close()
+        await self.kick_executor.close()
+        await super().close()
+        # Posts queued event logs, needs the HTTP session
+        await close_slack_event_logs()
+        await api_util.close_session()
+        close_pool()
+
     async def on_error(self, event_method: str, *args, **kwargs) -> None:
         sentry_sdk.capture_exception()
         print(f"Ignoring exception in {event_method}", file=sys.stderr)
@@ -95,6 +126,27 @@ class BackgroundBot(discord.Bot):
         for c in SUPPORTED_COMMUNITIES.values():
             self.__qa_views_dict[c.guild_id] = QAView(c)
     
+    def initialize_qa_view(self, guild_id):
+        _community = SUPPORTED_COMMUNITIES.get(guild_id)
+        if _community is None:
+            self.__qa_views_dict.pop(guild_id, None)
+        else:
+            self.__qa_views_dict[guild_id] = QAView(_community)
+
+    async def on_db_change(self, guild_id, tables):
+        print("DB CHANGE", guild_id, tables)
+        if any(table in COMMUNITY_TABLES for table in tables):
+            await initialize_supported_community(guild_id)
+            self.initialize_qa_view(guild_id)
+        if any(table in QA_DOCUMENT_TABLES for table in tables):
+            await refresh_guild_qa_retrieval(guild_id)
+
+    async def on_db_change_listener_reconnect(self):
+        # Notifications sent while disconnected are lost
+        await initialize_all_supported_communities()
+        self.initialize_qa_views()
+        await refresh_qa_retrieval(set(SUPPORTED_COMMUNITIES.keys()))
+
     def get_qa_view(self, _community):
         return self.__qa_views_dict[_community.guild_id]
 
@@ -125,6 +177,7 @@ class BackgroundBot(discord.Bot):
 
     async def on_guild_join(self, guild):
         print("on_guild_join")
+        schedule_guild_channel_sync(guild)
         embed = discord.Embed(
             title="Thanks for adding our Landing Party bot to your server!",
             description="""To contine setting up your FAQs and your Admin Portal dashboard go [here](https://app.landing.party)
@@ -139,6 +192,56 @@ class BackgroundBot(discord.Bot):
                                    embed=embed)
                 break
     
+    async def on_guild_channel_create(self, channel):
+        schedule_guild_channel_sync(channel.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        schedule_guild_channel_sync(after.guild)
+
+    async def on_guild_channel_delete(self, channel):
+        schedule_guild_channel_sync(channel.guild)
+
+    def get_role_sync_community(self, guild):
+        _community = SUPPORTED_COMMUNITIES.get(guild.id)
+        # Same communities as the reconciliation in sync_roles_to_backend
+        return _community if _community is not None and _community.admin_role_ids else None
+
+    def update_kick_schedule(self, member):
+        # Guilds are loaded by kick_unverified_users once their member cache is complete
+        _community = SUPPORTED_COMMUNITIES.get(member.guild.id)
+        if _community is not None and self.kick_scheduler.is_guild_loaded(member.guild.id):
+            self.kick_scheduler.schedule_member(member, _community)
+
+    def retry_failed_kick(self, member, community, reason):
+        # Spam kicks are not scheduled, the next spam message triggers them again
+        if reason == KICK_REASON_UNVERIFIED and self.kick_scheduler.is_guild_loaded(member.guild.id):
+            now = time.time()
+            retry_time = self.kick_scheduler.retry(member.guild.id, member.id, now)
+            print("KICK RETRY", member.guild.id, member.id, "IN", round(retry_time - now), "SECONDS")
+
+    async def on_member_join(self, member):
+        self.update_kick_schedule(member)
+
+        _community = self.get_role_sync_community(member.guild)
+        if _community is not None:
+            queue_member_roles(_community, member)
+
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self.update_kick_schedule(after)
+
+        _community = self.get_role_sync_community(after.guild)
+        if _community is not None and before.roles != after.roles:
+            queue_member_roles(_community, after)
+
+    async def on_member_remove(self, member):
+        self.kick_scheduler.cancel(member.guild.id, member.id)
+
+        _community = self.get_role_sync_community(member.guild)
+        if _community is not None and not member.bot:
+            # Roles in the guild are gone with the member
+            queue_role_set(_community, member.id, [])
+
     async def on_message(self, message):
         # Exit if the bot is the message sender
         if message.author.id == self.user.id:
@@ -332,6 +435,7 @@ class CogLoader(discord.Cog):
         self.update_supported_communities.start()
         self.kick_unverified_users.start()
         self.sync_roles_to_backend.start()
+        self.check_qa_index_watermarks.start()
         self.is_first_run = True
 
     @loop(seconds=30)
@@ -399,35 +503,11 @@ class CogLoader(discord.Cog):
             message='sync_channels',
             level='info'
         )
-        start_time = time.time()
-        guilds = self.bot.guilds
-
-        for guild in guilds:
-            try:
-                guild_data = []
-
-                guild_channels_by_id = {}
-                for channel in guild.channels:
-                    guild_channels_by_id[str(channel.id)] = {
-                        'name': channel.name
-                    }
-                guild_data.append({
-                    'id': str(guild.id),
-                    'channels_by_id': guild_channels_by_id
-                })
-
-                # Make individual HTTP request per each guild due to request overflow
-                print("GUILD", guild.id)
-                print("SYNCED CHANNEL CNT", len(guild_channels_by_id))
-
-                await sync_all_channels({
-                    'guilds': guild_data
-                })
-            except Exception as e:
-                print("Error in sync_channels", guild.id, guild_data)
-                traceback.print_exc()
-
-        print("SYNC ALL CHANNELS EXEC TIME --- %s seconds ---" % (time.time() - start_time))
+        try:
+            await sync_guilds_channels(list(self.bot.guilds))
+        except Exception:
+            print("Error in sync_channels")
+            traceback.print_exc()
 
     @loop(minutes=60)
     async def send_revision_notifications(self):
@@ -449,57 +529,58 @@ class CogLoader(discord.Cog):
             message='update_supported_communities',
             level='info'
         )
-        initialize_all_supported_communities()
-        self.bot.initialize_qa_views()
+        try:
+            await initialize_all_supported_communities()
+            self.bot.initialize_qa_views()
+        except Exception:
+            print("Error in update_supported_communities")
+            traceback.print_exc()
 
-    @loop(minutes=45)
-    async def sync_roles_to_backend(self):
-        print("ROLE SYNC START")
+        self.adjust_poll_interval(self.update_supported_communities, 60)
+
+    @loop(seconds=30)
+    async def check_qa_index_watermarks(self):
+        # Catches QA documents changed outside of the bot (e.g. in admin dashboard)
+        try:
+            await refresh_qa_retrieval(set(SUPPORTED_COMMUNITIES.keys()))
+        except Exception:
+            print("Error in refresh_qa_retrieval")
+            traceback.print_exc()
 
-        existing_users = execute_sql(
-            'SELECT id, discord_user_id FROM api_user WHERE discord_user_id IS NOT NULL',
-            [])
+        self.adjust_poll_interval(self.check_qa_index_watermarks, 30)
+
+    def adjust_poll_interval(self, poll_loop, default_seconds):
+        # While DB change notifications are delivered, polling is only a safety net
+        change_listener = self.bot.change_listener
+        if change_listener is not None and change_listener.delivers_changes:
+            interval = SAFETY_NET_POLL_INTERVAL_SECONDS
+        else:
+            interval = default_seconds
 
-        user_id_by_discord_id = {}
+        if poll_loop.hours * 3600 + poll_loop.minutes * 60 + poll_loop.seconds != interval:
+            poll_loop.change_interval(seconds=interval)
 
-        for u in existing_users:
-            user_id_by_discord_id[u['discord_user_id']] = u['id']
+    # Reconciliation only, role changes are synced from member events (see BackgroundBot.on_member_update)
+    @loop(hours=ROLE_SYNC_RECONCILE_HOURS)
+    async def sync_roles_to_backend(self):
+        print("ROLE SYNC START")
 
-        initialize_all_supported_communities()
+        await initialize_all_supported_communities()
         last_error = None
         for community in dict(SUPPORTED_COMMUNITIES).values():
             if community.admin_role_ids:
                 try:
-                    guild = await self.bot.fetch_guild(community.guild_id * 1)
-
-                    async for member in guild.fetch_members(limit=None):
-
-                        if member.id not in user_id_by_discord_id:
-                            continue
-
-                        if member.bot:
-                            print("SKIP BOT", member.id)
-                            continue
-
-                        role_ids = []
-
-                        for role in member.roles:
-                            role_ids.append(role.id)
-
-                        print("UPDATE ROLES", member.id, role_ids)
-
-                        execute_sql("""
-                            INSERT INTO api_userroleset (role_ids, community_id, user_id)
-                            VALUES (%s, %s, %s)
-                            ON CONFLICT (community_id, user_id) 
-                            DO 
-                               UPDATE SET role_ids = %s
-                        """, [
-                            role_ids,
-                            community.internal_id,
-                            user_id_by_discord_id[member.id],
-                            role_ids
-                        ], fetch=False)
+                    guild = self.bot.get_guild(community.guild_id * 1)
+                    if guild is not None and guild.chunked:
+                        # Member cache is complete, no need to page through members over REST
+                        members = iterate_members(list(guild.members))
+                    else:
+                        guild = await self.bot.fetch_guild(community.guild_id * 1)
+                        members = guild.fetch_members(limit=None)
+
+                    counts = await sync_guild_roles(community, members)
+                    print("ROLE SYNC", community.guild_id, counts['members'], "MEMBERS", counts['users'], "USERS",
+                          counts['updated'], "UPDATED IN %.1fs" % counts['seconds'])
 
                 except Exception as e:
                     print("role sync ERROR")
@@ -509,79 +590,43 @@ class CogLoader(discord.Cog):
         # if last_error:
         #     raise last_error
 
-    @loop(minutes=60)
+    @loop(seconds=KICK_SCHEDULER_TICK_SECONDS)
     async def kick_unverified_users(self):
-        initialize_all_supported_communities()
-        last_error = None
-        for community in SUPPORTED_COMMUNITIES.values():
-            if community.verified_role_id:
-                try:
-                    guild = await self.bot.fetch_guild(community.guild_id * 1)
-
-                    all_roles = await guild.fetch_roles()
-                    role_exists = False
-
-                    for role in all_roles:
-                        if role.id == community.verified_role_id:
-                            role_exists = True
-                            break
-
-                    if not role_exists:
-                        print("ROLE DOES NOT EXIST IN COMMUNITY")
-                        print(community)
-                        continue
-
-                    async for member in guild.fetch_members(limit=None):
-
-                        if member.bot:
-                            continue
-
-                        if member.joined_at is None:
-                            # Discord API edge case (unknown how to reproduce)
-                            continue
-
-                        days = datetime.timedelta(days=community.kick_users_who_joined_but_did_not_verify_after_days,
-                                                  hours=community.kick_users_who_joined_but_did_not_verify_after_hours)
-                        utcnow = datetime.datetime.utcnow()
-                        joined_at = member.joined_at.replace(tzinfo=None)
-
-                        kick_users_ignore_datetime_before_utc = \
-                            (community.kick_users_ignore_datetime_before_utc - \
-                                community.kick_users_ignore_datetime_before_utc.utcoffset()
-                             ).replace(tzinfo=None) \
-                                if community.kick_users_ignore_datetime_before_utc is not None \
-                                else None
-
-                        if kick_users_ignore_datetime_before_utc is not None \
-                                and joined_at < kick_users_ignore_datetime_before_utc:
-                            continue
-
-                        if joined_at + days > utcnow:
-                            continue
-
-                        has_verified_role = False
-                        is_moderator = False
-                        for role in member.roles:
-                            if role.id == community.verified_role_id:
-                                has_verified_role = True
-                                break
-                        permissions = member.guild_permissions
-                        if permissions.manage_guild or permissions.administrator:
-                            is_moderator = True
-
-                        if has_verified_role or is_moderator:
-                            continue
-                        else:
-                            print("KICKING " + str(member))
-                            await member.kick()
-                            EventLogger().track_user_kick(member, community)
-                except Exception as e:
-                    print("kick ERROR")
-                    traceback.print_exc()
-                    last_error = e
+        kick_scheduler = self.bot.kick_scheduler
 
-        # if last_error is not None:
-        #     raise last_error
+        synced_guild_ids = set()
+        for community in list(SUPPORTED_COMMUNITIES.values()):
+            guild = self.bot.get_guild(community.guild_id * 1)
+            # Members are loaded from the gateway member cache once it is complete
+            if guild is not None and guild.chunked and kick_scheduler.sync_guild(guild, community):
+                synced_guild_ids.add(guild.id)
+
+        for guild_id in kick_scheduler.loaded_guild_ids():
+            if guild_id not in synced_guild_ids:
+                kick_scheduler.clear_guild(guild_id)
+
+        now = time.time()
+        for guild_id, member_id in kick_scheduler.pop_due(now):
+            try:
+                community = SUPPORTED_COMMUNITIES.get(guild_id)
+                guild = self.bot.get_guild(guild_id)
+                member = guild.get_member(member_id) if guild is not None else None
+                if community is None or member is None:
+                    continue
+
+                # Checked again against the current member and community settings
+                due_time = kick_due_time(member, community)
+                if due_time is None or is_kick_exempt(member, community):
+                    continue
+                if due_time > now:
+                    kick_scheduler.schedule(guild_id, member_id, due_time)
+                    continue
+
+                self.bot.kick_executor.enqueue(member, community, KICK_REASON_UNVERIFIED)
+            except Exception as e:
+                print("kick ERROR")
+                traceback.print_exc()
+                kick_scheduler.retry(guild_id, member_id, now)
 
 def main():
     print("Starting bot")
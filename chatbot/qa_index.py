@@ -0,0 +1,444 @@
+import asyncio
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_codec import decode_embedding
+from hnsw import build_index
+from qa_loader import fetch_qa_watermark, load_guild_qa_data
+from qa_snapshot import QA_SNAPSHOT_DIR, QASnapshot, snapshot_watermark, save_snapshot, load_snapshot, \
+    list_snapshots, delete_snapshot
+
+# Approximate nearest neighbour search for very large guilds. Below QA_ANN_MIN_ROWS a NumPy scan over all
+# rows is faster than walking the graph in Python.
+QA_ANN_ENABLED = os.environ.get('QA_ANN_ENABLED', '0') == '1'
+QA_ANN_MIN_ROWS = int(os.environ.get('QA_ANN_MIN_ROWS', '50000'))
+QA_ANN_M = int(os.environ.get('QA_ANN_M', '16'))
+QA_ANN_EF_CONSTRUCTION = int(os.environ.get('QA_ANN_EF_CONSTRUCTION', '100'))
+# Recall/latency trade-off of a query
+QA_ANN_EF_SEARCH = int(os.environ.get('QA_ANN_EF_SEARCH', '64'))
+# Documents re-scored exactly after the graph search
+QA_ANN_RERANK_CANDIDATES = int(os.environ.get('QA_ANN_RERANK_CANDIDATES', '50'))
+QA_ANN_MAX_TOMBSTONE_RATIO = float(os.environ.get('QA_ANN_MAX_TOMBSTONE_RATIO', '0.3'))
+
+# Graphs are built in a worker process, created on the first build
+_ann_executor = None
+
+def get_ann_executor() -> ProcessPoolExecutor:
+    global _ann_executor
+
+    if _ann_executor is None:
+        _ann_executor = ProcessPoolExecutor(max_workers=1)
+    return _ann_executor
+
+
+def parse_embedding(embedding_from_db: Any) -> np.ndarray:
+    return decode_embedding(embedding_from_db)
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    matrix = np.array(vectors, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(vectors), 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors have no direction, leave them as zero rows (similarity 0)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return np.ascontiguousarray(matrix)
+
+
+def select_top_k(scores, top_k, min_score) -> np.ndarray:
+    """
+    Positions of the top_k scores above min_score, highest first and ties by position, the same order a
+    stable sort of all scores gives. Only the thresholded candidates are partitioned and only the top_k
+    are sorted, so a query costs O(n + k log k) instead of a full O(n log n) sort.
+    """
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    candidates = np.flatnonzero(scores > min_score)
+    if len(candidates) > top_k:
+        negative_scores = -scores[candidates]
+        kth = np.partition(negative_scores, top_k - 1)[top_k - 1]
+        above = candidates[negative_scores < kth]
+        # Ties at the cut-off are taken in position order, candidates are already sorted by position
+        tied = candidates[negative_scores == kth][:top_k - len(above)]
+        candidates = np.concatenate([above, tied])
+
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class QAIndex:
+    """
+    In-memory embedding index for the QA documents of a single guild.
+
+    Vectors of documents and of their alternative prompts are stored pre-normalized as rows of one
+    contiguous float32 matrix. Rows belonging to the same document are kept next to each other, so the
+    similarity of a document (max over its prompt and alternative prompts) is a single reduceat over
+    the matrix-vector product.
+    """
+
+    def __init__(self, documents: List[dict], vectors: List[List[List[float]]]):
+        """
+        :param: documents   QA document rows (without embedding_vector)
+        :param: vectors     For each document, its own embedding followed by embeddings of its alternative prompts
+        """
+        row_doc_ids = []
+        rows = []
+        for doc, doc_vectors in zip(documents, vectors):
+            for vector in doc_vectors:
+                rows.append(vector)
+                row_doc_ids.append(doc['id'])
+
+        self._init(documents, normalize_rows(rows), np.array(row_doc_ids, dtype=np.int64))
+
+    @classmethod
+    def from_rows(cls, documents: List[dict], matrix: np.ndarray, row_doc_ids: np.ndarray) -> 'QAIndex':
+        """
+        Index over rows that are already normalized and grouped by document (e.g. from a snapshot). The
+        matrix may be read-only or memory-mapped, it is never modified in place.
+        """
+        index = cls.__new__(cls)
+        index._init(documents, matrix, row_doc_ids)
+        return index
+
+    def _init(self, documents, matrix, row_doc_ids):
+        self.documents = documents
+        # doc id -> completion buttons
+        self.buttons_by_doc_id = {}
+        self.watermark = None
+        # Watermark of the last snapshot written or read for this index
+        self.snapshot_watermark = None
+        self.ann = None
+        self._ann_build_task = None
+        self._snapshot_task = None
+        self._version = 0
+        self._set_rows(matrix, row_doc_ids)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _set_rows(self, matrix: np.ndarray, row_doc_ids: np.ndarray):
+        # Arrays are never modified in place, a delta builds new ones and swaps them in
+        self._version += 1
+        self.matrix = matrix
+        self.row_doc_ids = row_doc_ids
+        self.doc_row_starts = np.flatnonzero(np.r_[True, row_doc_ids[1:] != row_doc_ids[:-1]]) \
+            if len(row_doc_ids) > 0 else np.empty(0, dtype=np.int64)
+        self._position_by_doc_id = {doc['id']: position for position, doc in enumerate(self.documents)}
+
+    def upsert_document(self, doc: dict, doc_vectors: List[List[float]]):
+        """
+        Adds the document (or replaces it, if it is already indexed) with its own embedding followed by
+        embeddings of its alternative prompts.
+        """
+        self.remove_document(doc['id'])
+
+        rows = normalize_rows(doc_vectors)
+        if len(self.matrix) > 0 and rows.shape[1] != self.matrix.shape[1]:
+            raise ValueError(f"Embedding dimension {rows.shape[1]} does not match index dimension {self.matrix.shape[1]}")
+
+        self.documents = self.documents + [doc]
+        self._set_rows(np.concatenate([self.matrix, rows]) if len(self.matrix) > 0 else rows,
+                       np.concatenate([self.row_doc_ids, np.full(len(rows), doc['id'], dtype=np.int64)]))
+
+        # Adding to the graph is pure Python too, so it is not done on the event loop. The graph is rebuilt
+        # in the background after the next query, the exact scan covers the meantime.
+        self.ann = None
+
+    def update_document(self, doc_id, **fields) -> bool:
+        position = self._position_by_doc_id.get(doc_id)
+        if position is None:
+            return False
+
+        documents = list(self.documents)
+        documents[position] = {**documents[position], **fields}
+        self.documents = documents
+        return True
+
+    def remove_document(self, doc_id) -> bool:
+        position = self._position_by_doc_id.get(doc_id)
+        if position is None:
+            return False
+
+        keep_rows = self.row_doc_ids != doc_id
+        self.buttons_by_doc_id.pop(doc_id, None)
+        self.documents = self.documents[:position] + self.documents[position + 1:]
+        self._set_rows(np.ascontiguousarray(self.matrix[keep_rows]), self.row_doc_ids[keep_rows])
+
+        if self.ann is not None:
+            self.ann.mark_deleted(doc_id)
+            if self.ann.tombstone_ratio > QA_ANN_MAX_TOMBSTONE_RATIO:
+                # Rebuilt on a next query
+                self.ann = None
+        return True
+
+    def document_similarities(self, embedding: List[float]) -> np.ndarray:
+        """
+        :return: cosine similarity of every document to the embedding, aligned with self.documents
+        """
+        if len(self.documents) == 0:
+            return np.empty(0, dtype=np.float32)
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return np.zeros(len(self.documents), dtype=np.float32)
+
+        row_similarities = self.matrix @ (query / norm)
+        return np.maximum.reduceat(row_similarities, self.doc_row_starts)
+
+    def top_documents(self, embedding: List[float], top_k, min_similarity) -> List[Tuple[float, int]]:
+        """
+        :return: up to top_k (similarity, position in self.documents) pairs with similarity > min_similarity,
+                 most similar first
+        """
+        if self.ann is not None:
+            return self._top_documents_ann(embedding, top_k, min_similarity)
+
+        self._schedule_ann_build()
+
+        similarities = self.document_similarities(embedding)
+        positions = select_top_k(similarities, top_k, min_similarity)
+        return [(float(similarities[i]), int(i)) for i in positions]
+
+    def _top_documents_ann(self, embedding, top_k, min_similarity) -> List[Tuple[float, int]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        candidate_positions = []
+        seen_doc_ids = set()
+        for _, node in self.ann.search(query, QA_ANN_RERANK_CANDIDATES * 2, max(QA_ANN_EF_SEARCH, top_k)):
+            doc_id = int(self.ann.labels[node])
+            if doc_id in seen_doc_ids or doc_id not in self._position_by_doc_id:
+                continue
+            seen_doc_ids.add(doc_id)
+            candidate_positions.append(self._position_by_doc_id[doc_id])
+            if len(candidate_positions) >= QA_ANN_RERANK_CANDIDATES:
+                break
+
+        if not candidate_positions:
+            return []
+
+        # Exact re-rank, each candidate is scored over all of its rows like document_similarities does, so
+        # returned similarities (and the direct answer threshold decision on them) are not approximate
+        positions = np.array(candidate_positions, dtype=np.int64)
+        row_ends = np.r_[self.doc_row_starts[1:], len(self.matrix)]
+        row_ranges = [np.arange(self.doc_row_starts[p], row_ends[p]) for p in positions]
+        row_similarities = self.matrix[np.concatenate(row_ranges)] @ query
+        range_starts = np.cumsum([0] + [len(r) for r in row_ranges[:-1]])
+        similarities = np.maximum.reduceat(row_similarities, range_starts)
+
+        # Same order as the exact path, ties by position
+        order = np.lexsort((positions, -similarities))[:top_k]
+        return [(float(similarities[i]), int(positions[i])) for i in order if similarities[i] > min_similarity]
+
+    def _schedule_ann_build(self):
+        if not QA_ANN_ENABLED or len(self.matrix) < QA_ANN_MIN_ROWS or self._ann_build_task is not None:
+            return
+
+        # Built in a worker process from the current (immutable) arrays, queries use the exact scan meanwhile
+        self._ann_build_task = asyncio.get_running_loop().create_task(self._build_ann())
+
+    async def _build_ann(self):
+        version = self._version
+        matrix, row_doc_ids = self.matrix, self.row_doc_ids
+
+        try:
+            print("QA ANN BUILD START", len(matrix))
+            ann = await asyncio.get_running_loop().run_in_executor(
+                get_ann_executor(), build_index, np.asarray(matrix), row_doc_ids, QA_ANN_M, QA_ANN_EF_CONSTRUCTION)
+            # Rows changed while building, the next query starts over
+            if version == self._version:
+                self.ann = ann
+                print("QA ANN BUILD DONE", len(matrix))
+        except Exception:
+            print("Error building QA ANN index")
+            traceback.print_exc()
+        finally:
+            self._ann_build_task = None
+
+
+async def get_qa_index_watermark(guild_id, model) -> tuple:
+    return await fetch_qa_watermark(guild_id, model)
+
+async def load_qa_index(guild_id, model) -> QAIndex:
+    data = await load_guild_qa_data(guild_id, model)
+
+    index = QAIndex(data.documents, data.vectors)
+    index.buttons_by_doc_id = data.buttons_by_doc_id
+    index.watermark = data.watermark
+    return index
+
+
+async def load_qa_index_snapshot(guild_id, model) -> Optional[QAIndex]:
+    """
+    :return: index from the on-disk snapshot, None if there is none or the DB watermark has moved since
+    """
+    if not QA_SNAPSHOT_DIR:
+        return None
+
+    snapshot = await asyncio.get_running_loop().run_in_executor(None, load_snapshot, guild_id, model)
+    if snapshot is None:
+        return None
+
+    watermark = await get_qa_index_watermark(guild_id, model)
+    if snapshot_watermark(watermark) != snapshot.watermark:
+        print("QA SNAPSHOT STALE", guild_id)
+        return None
+
+    index = QAIndex.from_rows(snapshot.documents, snapshot.matrix, snapshot.row_doc_ids)
+    index.buttons_by_doc_id = snapshot.buttons_by_doc_id
+    index.watermark = watermark
+    index.snapshot_watermark = watermark
+    return index
+
+async def save_qa_index_snapshot(guild_id, model, index: QAIndex):
+    if not QA_SNAPSHOT_DIR or index.watermark is None or index.snapshot_watermark == index.watermark:
+        return
+
+    # Deltas replace documents, matrix and row doc ids instead of modifying them, only buttons need a copy
+    watermark = index.watermark
+    snapshot = QASnapshot(guild_id, model, snapshot_watermark(watermark), index.documents,
+                          dict(index.buttons_by_doc_id), index.matrix, index.row_doc_ids)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, save_snapshot, snapshot)
+        index.snapshot_watermark = watermark
+    except Exception:
+        print("Error saving QA snapshot", guild_id)
+        traceback.print_exc()
+
+def _schedule_snapshot(key, index: QAIndex):
+    if QA_SNAPSHOT_DIR and index._snapshot_task is None:
+        async def save():
+            try:
+                await save_qa_index_snapshot(*key, index)
+            finally:
+                index._snapshot_task = None
+
+        index._snapshot_task = asyncio.get_running_loop().create_task(save())
+
+async def _load_qa_index_warm(guild_id, model) -> QAIndex:
+    index = await load_qa_index_snapshot(guild_id, model)
+    if index is None:
+        index = await load_qa_index(guild_id, model)
+        # Written in the background, the question waiting for this index is answered right away
+        _schedule_snapshot((guild_id, model), index)
+    return index
+
+
+# (guild_id, model) -> QAIndex
+QA_INDEXES = {}
+# (guild_id, model) -> task loading the index, shared by everyone waiting for it
+_loading_indexes = {}
+
+async def get_qa_index(guild_id, model) -> QAIndex:
+    """
+    Concurrent first requests for a guild wait for one load, so deltas are never applied to an index that
+    another load replaces afterwards.
+    """
+    key = (guild_id, model)
+    if key in QA_INDEXES:
+        return QA_INDEXES[key]
+
+    task = _loading_indexes.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_and_cache_qa_index(key))
+        _loading_indexes[key] = task
+        task.add_done_callback(lambda done_task: _loading_indexes.pop(key, None))
+    # A waiter being cancelled does not cancel the load for the others
+    return await asyncio.shield(task)
+
+async def _load_and_cache_qa_index(key) -> QAIndex:
+    index = await _load_qa_index_warm(*key)
+    return QA_INDEXES.setdefault(key, index)
+
+async def warm_start_qa_indexes(guild_ids):
+    """
+    Loads indexes of all guilds that have a snapshot, before their first question. Guilds are loaded one
+    by one, so that a restart does not hit the DB with all of them at once.
+    """
+    keys = await asyncio.get_running_loop().run_in_executor(None, list_snapshots)
+    loaded_from_snapshot = 0
+    for key in keys:
+        guild_id, model = key
+        if guild_id not in guild_ids or key in QA_INDEXES:
+            continue
+
+        try:
+            index = await get_qa_index(guild_id, model)
+        except Exception:
+            print("Error in warm start of QA index", guild_id)
+            traceback.print_exc()
+            continue
+
+        loaded_from_snapshot += index.snapshot_watermark is not None
+
+    print("QA WARM START", len(keys), "SNAPSHOTS", loaded_from_snapshot, "VALID")
+
+async def refresh_qa_indexes(guild_ids=None):
+    """
+    Reloads cached indexes whose DB watermark no longer matches, and drops indexes of guilds that are
+    not in guild_ids anymore. Snapshots of indexes changed by deltas are rewritten.
+    """
+    for key, index in list(QA_INDEXES.items()):
+        guild_id, model = key
+
+        if guild_ids is not None and guild_id not in guild_ids:
+            del QA_INDEXES[key]
+            if QA_SNAPSHOT_DIR:
+                await asyncio.get_running_loop().run_in_executor(None, delete_snapshot, guild_id, model)
+            continue
+
+        await _reload_if_changed(key, index)
+
+async def refresh_guild_qa_indexes(guild_id):
+    for key, index in _cached_indexes(guild_id):
+        await _reload_if_changed(key, index)
+
+async def _reload_if_changed(key, index):
+    guild_id, model = key
+    if await get_qa_index_watermark(guild_id, model) != index.watermark:
+        print("QA INDEX RELOAD", guild_id)
+        index = QA_INDEXES[key] = await load_qa_index(guild_id, model)
+
+    await save_qa_index_snapshot(guild_id, model, index)
+
+
+# Changes made by the bot itself are applied to cached indexes as row-level deltas, and the expected
+# watermark is moved accordingly, so the periodic refresh does not reload the whole guild for them.
+
+def _cached_indexes(guild_id, model=None):
+    return [(key, index) for key, index in QA_INDEXES.items()
+            if key[0] == guild_id and (model is None or key[1] == model)]
+
+def on_qa_document_inserted(guild_id, model, doc, embedding, last_modified_on):
+    for _, index in _cached_indexes(guild_id, model):
+        index.upsert_document(doc, [embedding])
+        if index.watermark is not None:
+            document_count, watermark_last_modified_on, alternative_prompt_count, button_fingerprint = index.watermark
+            index.watermark = (document_count + 1,
+                               max(filter(None, [watermark_last_modified_on, last_modified_on])),
+                               alternative_prompt_count, button_fingerprint)
+
+def on_qa_document_updated(guild_id, doc_id, last_modified_on, **fields):
+    for _, index in _cached_indexes(guild_id):
+        if index.update_document(doc_id, **fields) and index.watermark is not None:
+            document_count, watermark_last_modified_on, alternative_prompt_count, button_fingerprint = index.watermark
+            index.watermark = (document_count,
+                               max(filter(None, [watermark_last_modified_on, last_modified_on])),
+                               alternative_prompt_count, button_fingerprint)
+
+def on_qa_document_deleted(guild_id, model, doc_id):
+    for _, index in _cached_indexes(guild_id, model):
+        alternative_prompt_rows = int((index.row_doc_ids == doc_id).sum()) - 1
+        if index.remove_document(doc_id) and index.watermark is not None:
+            document_count, last_modified_on, alternative_prompt_count, button_fingerprint = index.watermark
+            index.watermark = (document_count - 1, last_modified_on,
+                               alternative_prompt_count - alternative_prompt_rows, button_fingerprint)
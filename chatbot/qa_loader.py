@@ -0,0 +1,119 @@
+from typing import List
+
+from database import fetch
+from embedding_codec import decode_embedding
+
+# Loads everything retrieval needs for one guild (QA documents, alternative prompts, completion buttons and
+# the watermark they correspond to) in a single round-trip. All parts come from one statement, so they are
+# a consistent snapshot and the watermark cannot be ahead of or behind the loaded rows.
+
+WATERMARK_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM api_qadocument
+            WHERE guild_id = %(guild_id)s AND model = %(model_used)s AND deleted_on IS NULL) AS document_count,
+        (SELECT MAX(last_modified_on) FROM api_qadocument
+            WHERE guild_id = %(guild_id)s) AS last_modified_on,
+        (SELECT COUNT(*) FROM api_qadocumentalternativeprompt ap JOIN api_qadocument qa ON ap.qa_document_id = qa.id
+            WHERE guild_id = %(guild_id)s AND ap.model = %(model_used)s AND deleted_on IS NULL) AS alternative_prompt_count,
+        -- Buttons are edited without touching their document, deleted documents are included so that
+        -- a deletion by the bot does not change it
+        (SELECT md5(string_agg(concat_ws(':', b.id, b.qa_document_id, b.label, b.button_style, b.triggered_flow_id),
+                               ',' ORDER BY b.id))
+            FROM api_qadocumentcompletionbutton b JOIN api_qadocument qa ON b.qa_document_id = qa.id
+            WHERE guild_id = %(guild_id)s) AS button_fingerprint
+"""
+
+# One row per part, 'kind' tells which columns are set
+GUILD_QA_DATA_SQL = f"""
+    WITH documents AS (
+        SELECT id, prompt, completion, embedding_vector, question_jump_url, answer_jump_url, is_spam
+        FROM api_qadocument
+        WHERE guild_id = %(guild_id)s AND model = %(model_used)s AND deleted_on IS NULL
+    )
+    SELECT 'watermark' AS kind, NULL::bigint AS qa_document_id, NULL::text AS prompt, NULL::text AS completion,
+           NULL::bytea AS embedding_vector, NULL::text AS question_jump_url, NULL::text AS answer_jump_url,
+           NULL::boolean AS is_spam, NULL::text AS label, NULL::integer AS button_style,
+           NULL::bigint AS triggered_flow_id, NULL::bigint AS button_id,
+           w.document_count, w.last_modified_on, w.alternative_prompt_count, w.button_fingerprint
+    FROM ({WATERMARK_SQL}) w
+    UNION ALL
+    SELECT 'document', id, prompt, completion, embedding_vector, question_jump_url, answer_jump_url, is_spam,
+           NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+    FROM documents
+    UNION ALL
+    SELECT 'alternative_prompt', ap.qa_document_id, NULL, NULL, ap.embedding_vector, NULL, NULL, NULL,
+           NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+    FROM api_qadocumentalternativeprompt ap JOIN documents ON ap.qa_document_id = documents.id
+    WHERE ap.model = %(model_used)s
+    UNION ALL
+    SELECT 'button', b.qa_document_id, NULL, NULL, NULL, NULL, NULL, NULL,
+           b.label, b.button_style, b.triggered_flow_id, b.id, NULL, NULL, NULL, NULL
+    FROM api_qadocumentcompletionbutton b JOIN documents ON b.qa_document_id = documents.id
+"""
+
+DOCUMENT_COLUMNS = ['prompt', 'completion', 'question_jump_url', 'answer_jump_url', 'is_spam']
+BUTTON_COLUMNS = ['label', 'button_style', 'triggered_flow_id']
+
+
+def watermark_from_row(row) -> tuple:
+    return (row['document_count'], row['last_modified_on'], row['alternative_prompt_count'],
+            row['button_fingerprint'])
+
+async def fetch_qa_watermark(guild_id, model) -> tuple:
+    """
+    Cheap fingerprint of a guild's QA documents, used to detect changes made outside of the bot
+    (e.g. in the admin dashboard).
+    """
+    rows = await fetch(WATERMARK_SQL, {"guild_id": guild_id, "model_used": model})
+    return watermark_from_row(rows[0])
+
+
+class GuildQAData:
+    def __init__(self, watermark: tuple, documents: List[dict], vectors: List[list], buttons_by_doc_id: dict):
+        """
+        :param: documents           QA document rows with an embedding, without embedding_vector
+        :param: vectors             For each document, its own embedding followed by embeddings of its alternative prompts
+        :param: buttons_by_doc_id   doc id -> completion buttons (label, button_style, triggered_flow_id), documents
+                                    without buttons are left out
+        """
+        self.watermark = watermark
+        self.documents = documents
+        self.vectors = vectors
+        self.buttons_by_doc_id = buttons_by_doc_id
+
+
+async def load_guild_qa_data(guild_id, model) -> GuildQAData:
+    rows = await fetch(GUILD_QA_DATA_SQL, {"guild_id": guild_id, "model_used": model}, timeout=120)
+
+    watermark = None
+    documents = []
+    alternative_prompt_vectors_by_doc_id = {}
+    buttons_by_doc_id = {}
+    for row in rows:
+        kind = row['kind']
+        if kind == 'document':
+            documents.append(row)
+        elif kind == 'alternative_prompt':
+            alternative_prompt_vectors_by_doc_id.setdefault(row['qa_document_id'], []).append(
+                decode_embedding(row['embedding_vector']))
+        elif kind == 'button':
+            buttons_by_doc_id.setdefault(row['qa_document_id'], []).append(
+                (row['button_id'], {column: row[column] for column in BUTTON_COLUMNS}))
+        else:
+            watermark = watermark_from_row(row)
+
+    loaded_documents = []
+    vectors = []
+    for row in documents:
+        embedding = row['embedding_vector']
+        if not embedding:
+            continue
+
+        doc_id = row['qa_document_id']
+        loaded_documents.append({'id': doc_id, **{column: row[column] for column in DOCUMENT_COLUMNS}})
+        vectors.append([decode_embedding(embedding)] + alternative_prompt_vectors_by_doc_id.get(doc_id, []))
+
+    buttons_by_doc_id = {doc_id: [button for _, button in sorted(buttons, key=lambda b: b[0])]
+                         for doc_id, buttons in buttons_by_doc_id.items()}
+
+    return GuildQAData(watermark, loaded_documents, vectors, buttons_by_doc_id)
@@ -0,0 +1,63 @@
+import os
+from typing import List, Tuple
+
+import qa_index
+import qa_vectors
+
+# 'memory' (default): per-guild embedding matrix in the bot process (qa_index)
+# 'pgvector': similarity search runs in Postgres (qa_vectors)
+QA_RETRIEVAL_BACKEND = os.environ.get('QA_RETRIEVAL_BACKEND', 'memory')
+
+def uses_pgvector() -> bool:
+    return QA_RETRIEVAL_BACKEND == 'pgvector'
+
+async def search_documents(guild_id, model, embedding, top_k, min_similarity) -> List[Tuple[float, dict]]:
+    """
+    :return: up to top_k (similarity, document) pairs with similarity > min_similarity, most similar first.
+             Documents carry their completion buttons, so answering needs no further query.
+    """
+    if uses_pgvector():
+        return await qa_vectors.search_documents(guild_id, model, embedding, top_k, min_similarity)
+
+    index = await qa_index.get_qa_index(guild_id, model)
+
+    print("ALL QA DOCUMENTS CNT", len(index))
+
+    results = []
+    for similarity, position in index.top_documents(embedding, top_k, min_similarity):
+        doc = index.documents[position]
+        results.append((similarity, {**doc, 'buttons': index.buttons_by_doc_id.get(doc['id'], [])}))
+    return results
+
+async def warm_start_qa_retrieval(guild_ids):
+    # pgvector keeps its state in Postgres, nothing to warm up
+    if not uses_pgvector():
+        await qa_index.warm_start_qa_indexes(guild_ids)
+
+async def refresh_qa_retrieval(guild_ids=None):
+    if uses_pgvector():
+        await qa_vectors.refresh_vectors(guild_ids)
+    else:
+        await qa_index.refresh_qa_indexes(guild_ids)
+
+async def refresh_guild_qa_retrieval(guild_id):
+    if uses_pgvector():
+        await qa_vectors.refresh_guild_vectors(guild_id)
+    else:
+        await qa_index.refresh_guild_qa_indexes(guild_id)
+
+# Changes made by the bot itself
+
+async def on_qa_document_inserted(guild_id, model, doc, embedding, last_modified_on):
+    if uses_pgvector():
+        await qa_vectors.on_document_inserted(guild_id, model, doc['id'], embedding)
+    else:
+        qa_index.on_qa_document_inserted(guild_id, model, doc, embedding, last_modified_on)
+
+def on_qa_document_updated(guild_id, doc_id, last_modified_on, **fields):
+    # pgvector search reads document fields at query time
+    qa_index.on_qa_document_updated(guild_id, doc_id, last_modified_on, **fields)
+
+def on_qa_document_deleted(guild_id, model, doc_id):
+    # pgvector search skips deleted documents at query time, mirror rows are dropped by the next sync
+    qa_index.on_qa_document_deleted(guild_id, model, doc_id)
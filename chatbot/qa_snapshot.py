@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import traceback
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# On-disk snapshots of in-memory QA indexes, so a restarted bot does not load and decode all embeddings
+# of every guild again. Each snapshot is a JSON metadata file (documents, buttons, the DB watermark it
+# corresponds to) pointing at .npy files with the row matrix and row doc ids. Matrices are memory-mapped
+# when loaded, so a warm start reads only the pages that queries touch.
+#
+# Empty QA_SNAPSHOT_DIR disables snapshots. The directory may be shared by bot instances of one deployment.
+QA_SNAPSHOT_DIR = os.environ.get('QA_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'qa-snapshots'))
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Saves of different guilds are rare and short, one lock keeps array files and metadata of a key consistent
+_save_lock = threading.Lock()
+
+
+class QASnapshot:
+    def __init__(self, guild_id, model, watermark: list, documents: List[dict], buttons_by_doc_id: dict,
+                 matrix: np.ndarray, row_doc_ids: np.ndarray):
+        self.guild_id = guild_id
+        self.model = model
+        self.watermark = watermark
+        self.documents = documents
+        self.buttons_by_doc_id = buttons_by_doc_id
+        self.matrix = matrix
+        self.row_doc_ids = row_doc_ids
+
+
+def snapshot_watermark(watermark: tuple) -> list:
+    """
+    JSON form of a QA index watermark, snapshots are valid only while it equals the one of the DB
+    """
+    return [value.isoformat() if hasattr(value, 'isoformat') else value for value in watermark]
+
+def _base_name(guild_id, model) -> str:
+    return f"{guild_id}-{hashlib.sha1(model.encode('utf-8')).hexdigest()[:12]}"
+
+def _metadata_path(guild_id, model) -> str:
+    return os.path.join(QA_SNAPSHOT_DIR, _base_name(guild_id, model) + '.json')
+
+def _remove_unreferenced_files(base_name, referenced_files):
+    for file_name in os.listdir(QA_SNAPSHOT_DIR):
+        if file_name.startswith(base_name + '-') and file_name.endswith('.npy') and file_name not in referenced_files:
+            # Indexes that memory-mapped the old file keep reading it until they are dropped
+            os.remove(os.path.join(QA_SNAPSHOT_DIR, file_name))
+
+def save_snapshot(snapshot: QASnapshot):
+    """
+    Blocking file IO, run in an executor.
+    """
+    base_name = _base_name(snapshot.guild_id, snapshot.model)
+    token = uuid.uuid4().hex[:12]
+    matrix_file = f"{base_name}-{token}.matrix.npy"
+    row_doc_ids_file = f"{base_name}-{token}.row_doc_ids.npy"
+
+    with _save_lock:
+        os.makedirs(QA_SNAPSHOT_DIR, exist_ok=True)
+        np.save(os.path.join(QA_SNAPSHOT_DIR, matrix_file), np.ascontiguousarray(snapshot.matrix, dtype=np.float32))
+        np.save(os.path.join(QA_SNAPSHOT_DIR, row_doc_ids_file), np.asarray(snapshot.row_doc_ids, dtype=np.int64))
+
+        metadata = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'guild_id': snapshot.guild_id,
+            'model': snapshot.model,
+            'watermark': snapshot.watermark,
+            'rows': len(snapshot.row_doc_ids),
+            'matrix_file': matrix_file,
+            'row_doc_ids_file': row_doc_ids_file,
+            'documents': snapshot.documents,
+            # JSON object keys are strings
+            'buttons_by_doc_id': {str(doc_id): buttons for doc_id, buttons in snapshot.buttons_by_doc_id.items()},
+        }
+
+        # Metadata is switched atomically and last, readers never see it pointing at partly written arrays
+        metadata_path = _metadata_path(snapshot.guild_id, snapshot.model)
+        tmp_path = metadata_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, metadata_path)
+
+        _remove_unreferenced_files(base_name, {matrix_file, row_doc_ids_file})
+
+def load_snapshot(guild_id, model) -> Optional[QASnapshot]:
+    """
+    Blocking file IO, run in an executor.
+
+    :return: None if there is no snapshot or it can not be used
+    """
+    try:
+        with open(_metadata_path(guild_id, model)) as f:
+            metadata = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    try:
+        if metadata['format_version'] != SNAPSHOT_FORMAT_VERSION:
+            return None
+
+        matrix = np.load(os.path.join(QA_SNAPSHOT_DIR, metadata['matrix_file']), mmap_mode='r')
+        row_doc_ids = np.load(os.path.join(QA_SNAPSHOT_DIR, metadata['row_doc_ids_file']))
+        if matrix.dtype != np.float32 or matrix.ndim != 2 or len(matrix) != metadata['rows'] \
+                or len(row_doc_ids) != metadata['rows']:
+            print("QA SNAPSHOT MALFORMED", guild_id)
+            return None
+
+        return QASnapshot(guild_id, model, metadata['watermark'], metadata['documents'],
+                          {int(doc_id): buttons for doc_id, buttons in metadata['buttons_by_doc_id'].items()},
+                          matrix, row_doc_ids)
+    except Exception:
+        print("Error loading QA snapshot", guild_id)
+        traceback.print_exc()
+        return None
+
+def list_snapshots() -> List[Tuple[int, str]]:
+    """
+    :return: (guild_id, model) of all snapshots in QA_SNAPSHOT_DIR
+    """
+    if not QA_SNAPSHOT_DIR or not os.path.isdir(QA_SNAPSHOT_DIR):
+        return []
+
+    keys = []
+    for file_name in os.listdir(QA_SNAPSHOT_DIR):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(QA_SNAPSHOT_DIR, file_name)) as f:
+                metadata = json.load(f)
+            keys.append((metadata['guild_id'], metadata['model']))
+        except Exception:
+            print("Error reading QA snapshot", file_name)
+            traceback.print_exc()
+    return keys
+
+def delete_snapshot(guild_id, model):
+    with _save_lock:
+        try:
+            os.remove(_metadata_path(guild_id, model))
+        except FileNotFoundError:
+            return
+        _remove_unreferenced_files(_base_name(guild_id, model), set())
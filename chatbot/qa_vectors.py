@@ -0,0 +1,232 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from database import fetch, execute, execute_values, transaction
+from qa_index import get_qa_index_watermark, parse_embedding
+
+# pgvector retrieval backend (QA_RETRIEVAL_BACKEND=pgvector).
+#
+# The api_* tables belong to the backend and store embeddings as bytea, so vectors are mirrored into a
+# table owned by the bot, one row per document prompt and per alternative prompt. Mirror rows are synced
+# by comparing md5 of the source embeddings, so only changed rows are decoded and written. Document text,
+# deletion and spam flags are read from api_qadocument at query time and are never stale.
+
+PGVECTOR_DIMENSION = int(os.environ.get('PGVECTOR_DIMENSION', '1024'))
+# 'hnsw' or 'ivfflat'
+PGVECTOR_INDEX_TYPE = os.environ.get('PGVECTOR_INDEX_TYPE', 'hnsw')
+PGVECTOR_IVFFLAT_LISTS = int(os.environ.get('PGVECTOR_IVFFLAT_LISTS', '100'))
+# Recall/latency trade-off of the ANN index scan
+PGVECTOR_HNSW_EF_SEARCH = int(os.environ.get('PGVECTOR_HNSW_EF_SEARCH', '100'))
+PGVECTOR_IVFFLAT_PROBES = int(os.environ.get('PGVECTOR_IVFFLAT_PROBES', '10'))
+# 'relaxed_order' or 'strict_order' keeps scanning the index until enough rows pass the guild filter. Needs
+# pgvector >= 0.8 (older versions reject the setting), empty disables it
+PGVECTOR_ITERATIVE_SCAN = os.environ.get('PGVECTOR_ITERATIVE_SCAN', '')
+# The vector table is normally created beforehand, with the SQL printed by `python3 qa_vectors.py`. With
+# PGVECTOR_CREATE_SCHEMA=1 the bot runs it on first use, which needs rights to create the extension.
+PGVECTOR_CREATE_SCHEMA = os.environ.get('PGVECTOR_CREATE_SCHEMA', '0') == '1'
+
+# Prompt rows fetched per wanted document, a document can match with several of its prompts
+CANDIDATES_PER_DOCUMENT = 4
+
+SYNC_CHUNK_SIZE = 500
+
+VECTOR_TABLE = 'qa_embedding_vector'
+
+def get_schema_sql(dimension=PGVECTOR_DIMENSION, index_type=PGVECTOR_INDEX_TYPE) -> str:
+    if index_type == 'ivfflat':
+        index_sql = f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {PGVECTOR_IVFFLAT_LISTS})"
+    else:
+        index_sql = "USING hnsw (embedding vector_cosine_ops)"
+
+    return f"""
+        CREATE EXTENSION IF NOT EXISTS vector;
+
+        CREATE TABLE IF NOT EXISTS {VECTOR_TABLE} (
+            source_key text PRIMARY KEY,
+            qa_document_id bigint NOT NULL,
+            guild_id bigint NOT NULL,
+            model text NOT NULL,
+            source_md5 text NOT NULL,
+            embedding vector({dimension}) NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS {VECTOR_TABLE}_guild_model ON {VECTOR_TABLE} (guild_id, model);
+        CREATE INDEX IF NOT EXISTS {VECTOR_TABLE}_{index_type} ON {VECTOR_TABLE} {index_sql};
+    """
+
+schema_ready = False
+
+async def ensure_schema():
+    global schema_ready
+
+    if not schema_ready:
+        if PGVECTOR_CREATE_SCHEMA:
+            await execute(get_schema_sql(), timeout=300)
+        schema_ready = True
+
+def vector_literal(embedding) -> str:
+    return '[' + ','.join(map(str, np.asarray(embedding, dtype=np.float32).tolist())) + ']'
+
+
+# Source rows, same selection as load_qa_index
+SOURCE_ROWS_SQL = """
+    SELECT 'doc:' || qa.id AS source_key, qa.id AS qa_document_id, NULL::bigint AS alternative_prompt_id,
+           md5(qa.embedding_vector) AS source_md5
+    FROM api_qadocument qa
+    WHERE qa.guild_id = %(guild_id)s AND qa.model = %(model)s AND qa.deleted_on IS NULL
+        AND qa.embedding_vector IS NOT NULL AND length(qa.embedding_vector) > 0
+    UNION ALL
+    SELECT 'alt:' || ap.id, ap.qa_document_id, ap.id, md5(ap.embedding_vector)
+    FROM api_qadocumentalternativeprompt ap JOIN api_qadocument qa ON ap.qa_document_id = qa.id
+    WHERE qa.guild_id = %(guild_id)s AND qa.model = %(model)s AND ap.model = %(model)s AND qa.deleted_on IS NULL
+        AND qa.embedding_vector IS NOT NULL AND length(qa.embedding_vector) > 0
+        AND ap.embedding_vector IS NOT NULL
+"""
+
+async def _fetch_source_embeddings(rows) -> dict:
+    doc_ids = [row['qa_document_id'] for row in rows if row['alternative_prompt_id'] is None]
+    alt_ids = [row['alternative_prompt_id'] for row in rows if row['alternative_prompt_id'] is not None]
+
+    embedding_by_source_key = {}
+    if doc_ids:
+        for row in await fetch("SELECT id, embedding_vector FROM api_qadocument WHERE id = ANY(%s)", [doc_ids]):
+            embedding_by_source_key[f"doc:{row['id']}"] = row['embedding_vector']
+    if alt_ids:
+        for row in await fetch("SELECT id, embedding_vector FROM api_qadocumentalternativeprompt WHERE id = ANY(%s)",
+                               [alt_ids]):
+            embedding_by_source_key[f"alt:{row['id']}"] = row['embedding_vector']
+    return embedding_by_source_key
+
+async def sync_guild_vectors(guild_id, model) -> int:
+    """
+    Brings the mirror rows of the guild in line with its QA documents.
+
+    :return: number of rows written or deleted
+    """
+    await ensure_schema()
+
+    source_rows = await fetch(SOURCE_ROWS_SQL, {"guild_id": guild_id, "model": model}, timeout=120)
+    existing_md5_by_key = {row['source_key']: row['source_md5'] for row in await fetch(
+        f"SELECT source_key, source_md5 FROM {VECTOR_TABLE} WHERE guild_id = %s AND model = %s", [guild_id, model])}
+
+    changed_rows = [row for row in source_rows if existing_md5_by_key.get(row['source_key']) != row['source_md5']]
+    removed_keys = list(set(existing_md5_by_key) - {row['source_key'] for row in source_rows})
+
+    for start in range(0, len(changed_rows), SYNC_CHUNK_SIZE):
+        chunk = changed_rows[start:start + SYNC_CHUNK_SIZE]
+        embedding_by_source_key = await _fetch_source_embeddings(chunk)
+
+        values = []
+        for row in chunk:
+            blob = embedding_by_source_key.get(row['source_key'])
+            if blob is None:
+                continue
+            values.append((row['source_key'], row['qa_document_id'], guild_id, model, row['source_md5'],
+                           vector_literal(parse_embedding(blob))))
+
+        await execute_values(f"""
+            INSERT INTO {VECTOR_TABLE} (source_key, qa_document_id, guild_id, model, source_md5, embedding)
+            VALUES %s
+            ON CONFLICT (source_key) DO UPDATE SET
+                qa_document_id = EXCLUDED.qa_document_id, guild_id = EXCLUDED.guild_id, model = EXCLUDED.model,
+                source_md5 = EXCLUDED.source_md5, embedding = EXCLUDED.embedding
+        """, values, template='(%s, %s, %s, %s, %s, %s::vector)', timeout=120)
+
+    if removed_keys:
+        await execute(f"DELETE FROM {VECTOR_TABLE} WHERE source_key = ANY(%s)", [removed_keys])
+
+    if changed_rows or removed_keys:
+        print("PGVECTOR SYNC", guild_id, len(changed_rows), "CHANGED", len(removed_keys), "REMOVED")
+    return len(changed_rows) + len(removed_keys)
+
+
+# (guild_id, model) -> QA watermark at the last sync
+SYNCED_WATERMARKS = {}
+
+async def sync_guild_vectors_if_changed(guild_id, model):
+    key = (guild_id, model)
+    watermark = await get_qa_index_watermark(guild_id, model)
+    if SYNCED_WATERMARKS.get(key) != watermark:
+        await sync_guild_vectors(guild_id, model)
+        SYNCED_WATERMARKS[key] = watermark
+
+async def refresh_vectors(guild_ids=None):
+    for key in list(SYNCED_WATERMARKS.keys()):
+        guild_id, model = key
+        if guild_ids is not None and guild_id not in guild_ids:
+            del SYNCED_WATERMARKS[key]
+            continue
+        await sync_guild_vectors_if_changed(guild_id, model)
+
+async def refresh_guild_vectors(guild_id):
+    for key in [key for key in SYNCED_WATERMARKS if key[0] == guild_id]:
+        await sync_guild_vectors_if_changed(*key)
+
+async def on_document_inserted(guild_id, model, qa_document_id, embedding):
+    if (guild_id, model) not in SYNCED_WATERMARKS:
+        return
+
+    # Written right away so the new answer is found without waiting for the next sync. The next sync
+    # compares md5 of the stored bytes and rewrites the row once with the exact stored value.
+    await execute(f"""
+        INSERT INTO {VECTOR_TABLE} (source_key, qa_document_id, guild_id, model, source_md5, embedding)
+        VALUES (%s, %s, %s, %s, '', %s::vector)
+        ON CONFLICT (source_key) DO NOTHING
+    """, [f'doc:{qa_document_id}', qa_document_id, guild_id, model, vector_literal(embedding)])
+
+
+SEARCH_SQL = f"""
+    WITH nearest AS (
+        SELECT qa_document_id, embedding <=> %(embedding)s::vector AS distance
+        FROM {VECTOR_TABLE}
+        WHERE guild_id = %(guild_id)s AND model = %(model)s
+        ORDER BY embedding <=> %(embedding)s::vector
+        LIMIT %(candidates)s
+    )
+    SELECT qa.id, qa.prompt, qa.completion, qa.question_jump_url, qa.answer_jump_url, qa.is_spam,
+           1 - MIN(nearest.distance) AS similarity,
+           COALESCE((SELECT json_agg(json_build_object('label', b.label, 'button_style', b.button_style,
+                                                       'triggered_flow_id', b.triggered_flow_id) ORDER BY b.id)
+                     FROM api_qadocumentcompletionbutton b WHERE b.qa_document_id = qa.id), '[]') AS buttons
+    FROM nearest JOIN api_qadocument qa ON qa.id = nearest.qa_document_id AND qa.deleted_on IS NULL
+    GROUP BY qa.id
+    HAVING 1 - MIN(nearest.distance) > %(min_similarity)s
+    ORDER BY similarity DESC, qa.id
+    LIMIT %(top_k)s
+"""
+
+async def search_documents(guild_id, model, embedding, top_k, min_similarity) -> List[Tuple[float, dict]]:
+    """
+    Top-k documents by cosine similarity, a document scores the max over its prompt and alternative prompts.
+    Completion buttons of the returned documents are fetched by the same query.
+
+    :return: (similarity, document) pairs, most similar first
+    """
+    if (guild_id, model) not in SYNCED_WATERMARKS:
+        await sync_guild_vectors_if_changed(guild_id, model)
+
+    settings = [f"SET LOCAL hnsw.ef_search = {max(PGVECTOR_HNSW_EF_SEARCH, top_k * CANDIDATES_PER_DOCUMENT)}",
+                f"SET LOCAL ivfflat.probes = {PGVECTOR_IVFFLAT_PROBES}"]
+    if PGVECTOR_ITERATIVE_SCAN:
+        settings.append(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}")
+        settings.append(f"SET LOCAL ivfflat.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}")
+
+    async with transaction() as tx:
+        await tx.execute('; '.join(settings))
+        rows = await tx.fetch(SEARCH_SQL, {
+            "embedding": vector_literal(embedding),
+            "guild_id": guild_id,
+            "model": model,
+            "candidates": top_k * CANDIDATES_PER_DOCUMENT,
+            "min_similarity": min_similarity,
+            "top_k": top_k,
+        })
+
+    return [(float(row.pop('similarity')), row) for row in rows]
+
+
+if __name__ == '__main__':
+    # e.g. python3 qa_vectors.py | psql "$DATABASE_URL"
+    print(get_schema_sql())
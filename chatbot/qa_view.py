@@ -1,18 +1,17 @@
 import community
 import sqlite3
-from scipy import spatial
 import logging
-from typing import List, Any
+from typing import List, Optional
 from dotenv import load_dotenv
-import pickle
 import os
 from embeddings_service import EmbeddingsService
+from qa_retrieval import search_documents, on_qa_document_inserted, on_qa_document_updated, on_qa_document_deleted
 from utils import create_user_if_not_exists
 
 load_dotenv()
 import openai
 
-from database import execute_sql
+from database import fetch, execute
 
 class BotException(Exception):
     """
@@ -46,132 +45,77 @@ class QAView:
         
         self.__guild_id = community.guild_id
 
-    def parse_embedding_from_db(self, embedding_from_db: Any) -> List[float]:
-        # return embedding_str.split(",")
-        # TODO: validate this is a list of floats
-        return pickle.loads(embedding_from_db)
+    async def update_answer_for_qa_doc(self, doc_idx, answer):
+        updated = await fetch(
+            "update api_qadocument set completion=%(completion)s, last_modified_on=NOW() where id=%(doc_idx)s returning last_modified_on",
+            {"completion": answer, "doc_idx": doc_idx})
+        if updated:
+            on_qa_document_updated(self.__guild_id, doc_idx, updated[0]['last_modified_on'], completion=answer)
 
-    def compute_spatial_distance_for_embedding(self, list1,list2):
+    async def find_similar_documents(self, question, top_k, min_similarity) -> List[QASingleMatch]:
         """
-        :param: list1, list2    Vectors (lists) of floats, representing embeddings.
+        :return: up to top_k QA documents with similarity above min_similarity, most similar first
         """
-        return 1 - spatial.distance.cosine(list1, list2)
-
-    async def update_answer_for_qa_doc(self, doc_idx, answer):
-        execute_sql(
-            "update api_qadocument set completion=%(completion)s where id=%(doc_idx)s",
-            {"completion": answer, "doc_idx": doc_idx},
-            fetch=False)
-
-    async def get_answer_for_question(self, question):
-        community = self.__community
-
         try:
             new_embedding = await self.__embeddings_service.get_embedding_for_text(question)
         except:
-            return QaMatchesResult(
-                direct_answer=None,
-                alternative_answers=[]
-            )
-
-        qa_documents = execute_sql("select id, prompt, completion, embedding_vector, question_jump_url, answer_jump_url, is_spam from api_qadocument where guild_id=%(guild_id)s AND model=%(model_used)s AND deleted_on IS NULL", {"guild_id": self.__guild_id, "model_used": self.__embeddings_service.api_engine})
-
-        print("ALL QA DOCUMENTS CNT", len(qa_documents))
-
-        if len(qa_documents) == 0:
-            return QaMatchesResult(
-                direct_answer=None,
-                alternative_answers=[]
-            )
-
-        alternative_prompts = execute_sql('SELECT alternative_prompt, ap.embedding_vector, qa_document_id FROM api_qadocumentalternativeprompt ap JOIN api_qadocument qa ON ap.qa_document_id = qa.id where guild_id=%(guild_id)s AND ap.model=%(model_used)s AND deleted_on IS NULL', {"guild_id": self.__guild_id, "model_used": self.__embeddings_service.api_engine})
-
-        alternative_prompts_by_qa_doc_id = {}
-
-        for alt_prompt in alternative_prompts:
-            doc_id = alt_prompt['qa_document_id']
-            alternative_prompts_by_qa_doc_id[doc_id] = alternative_prompts_by_qa_doc_id.get(doc_id, [])
-            alternative_prompts_by_qa_doc_id[doc_id].append(alt_prompt)
-
-        similarity_map = []
-        for qa_doc in qa_documents:
-            embedding = qa_doc['embedding_vector']
-            if embedding:
-                vector = self.parse_embedding_from_db(embedding)
-                similarity = self.compute_spatial_distance_for_embedding(vector, new_embedding)
-
-                for alt_prompt in alternative_prompts_by_qa_doc_id.get(qa_doc['id'], []):
-                    embedding = alt_prompt['embedding_vector']
-                    vector = self.parse_embedding_from_db(embedding)
-                    alt_similarity = self.compute_spatial_distance_for_embedding(vector, new_embedding)
-
-                    if alt_similarity > similarity:
-                        similarity = alt_similarity
+            return []
+
+        similarity_map = await search_documents(self.__guild_id, self.__embeddings_service.api_engine,
+                                                new_embedding, top_k=top_k, min_similarity=min_similarity)
+
+        return [QASingleMatch(
+            doc_idx=qa_pair['id'],
+            question=qa_pair['prompt'],
+            answer=qa_pair['completion'],
+            question_jump_url=qa_pair['question_jump_url'],
+            answer_jump_url=qa_pair['answer_jump_url'],
+            confidence=confidence,
+            is_spam=qa_pair['is_spam'],
+            buttons=qa_pair['buttons']
+        ) for confidence, qa_pair in similarity_map]
+
+    async def find_direct_match(self, question) -> Optional[QASingleMatch]:
+        """
+        Document that would be given as the direct answer to the question
+        """
+        matches = await self.find_similar_documents(question, top_k=1, min_similarity=0.5)
+        if matches and matches[0].confidence >= self.__community.minimum_threshold:
+            return matches[0]
+        return None
 
-                # map to document index
-                similarity_map.append((similarity,qa_doc))
+    async def get_answer_for_question(self, question):
+        community = self.__community
 
-        # Sort by similarity score (first member of tuple)
-        similarity_map.sort(key = lambda x: x[0], reverse=True)
-        similarity_map = list(filter(lambda x: x[0] > 0.5, similarity_map))
+        # A direct answer and up to 3 alternatives
+        similar_matches = await self.find_similar_documents(question, top_k=4, min_similarity=0.5)
 
-        if not similarity_map:
+        if not similar_matches:
             return QaMatchesResult(
                 direct_answer=None,
                 alternative_answers=[]
             )
 
-        most_similar_qa_mapping = similarity_map[0]
         direct_answer = None
-        if most_similar_qa_mapping[0] >= community.minimum_threshold:
-            most_similar_qa_pair = most_similar_qa_mapping[1]
-
-            buttons = execute_sql("SELECT label, button_style, triggered_flow_id FROM api_qadocumentcompletionbutton WHERE qa_document_id = %s",
-                                  [ most_similar_qa_pair['id'] ])
-
-            direct_answer = QASingleMatch(
-                doc_idx=most_similar_qa_pair['id'],
-                question=most_similar_qa_pair['prompt'],
-                answer=most_similar_qa_pair['completion'],
-                question_jump_url=most_similar_qa_pair['question_jump_url'],
-                answer_jump_url=most_similar_qa_pair['answer_jump_url'],
-                confidence=most_similar_qa_mapping[0],
-                is_spam=most_similar_qa_pair['is_spam'],
-                buttons=buttons
-            )
-        
+        if similar_matches[0].confidence >= community.minimum_threshold:
+            direct_answer = similar_matches[0]
+
         #If we have a direct answer (i.e with a 0.9 similarity or greater) the next closest answers will be starting at index 1s
         start_index = 1 if direct_answer else 0
 
         #Add up to 3 close results to the output
         end_index = start_index + 3
 
-        highest_alternative_answers = []
-        for x in range(start_index, end_index):
-            if x >= len(similarity_map):
-                break
-            current_qa_mapping = similarity_map[x]
-            current_confidence = current_qa_mapping[0]
-            current_qa_pair =  current_qa_mapping[1]
-            current_answer = QASingleMatch(
-                doc_idx=current_qa_pair['id'],
-                question=current_qa_pair['prompt'],
-                answer=current_qa_pair['completion'],
-                question_jump_url=current_qa_pair['question_jump_url'],
-                answer_jump_url=current_qa_pair['answer_jump_url'],
-                confidence=current_confidence,
-                is_spam=current_qa_pair['is_spam']
-            )
-            highest_alternative_answers.append(current_answer)
-        
         return QaMatchesResult(
             direct_answer=direct_answer,
-            alternative_answers=highest_alternative_answers
+            alternative_answers=similar_matches[start_index:end_index]
         )
     
-    def delete_qa_pair_from_db(self, idx) -> None:
-        execute_sql("update api_qadocument set deleted_on=NOW() where id=%(idx)s", {"idx": idx},
-                    fetch=False)
+    async def delete_qa_pair_from_db(self, idx) -> None:
+        deleted = await fetch("update api_qadocument set deleted_on=NOW() where id=%(idx)s AND deleted_on IS NULL returning model",
+                              {"idx": idx})
+        for row in deleted:
+            on_qa_document_deleted(self.__guild_id, row['model'], idx)
 
     async def insert_qa_pair_into_db(self, question, answer, asked_by, answered_by, question_jump_url=None, answer_jump_url=None):
         try:
@@ -180,31 +124,39 @@ class QAView:
         except:
             return
 
-        create_user_if_not_exists(asked_by)
-        create_user_if_not_exists(answered_by)
+        await create_user_if_not_exists(asked_by)
+        await create_user_if_not_exists(answered_by)
 
-        execute_sql('insert into api_qadocument (guild_id, prompt, completion, asked_by_id, answered_by_id, model, embedding_vector, created_on, last_modified_on, is_public, question_jump_url, answer_jump_url, is_spam) values (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW(), FALSE, %s, %s, FALSE)',
-                    [self.__guild_id, question, answer, asked_by.id, answered_by.id, self.__embeddings_service.api_engine, embedding_str, question_jump_url, answer_jump_url],
-                    fetch=False)
+        inserted = await fetch('insert into api_qadocument (guild_id, prompt, completion, asked_by_id, answered_by_id, model, embedding_vector, created_on, last_modified_on, is_public, question_jump_url, answer_jump_url, is_spam) values (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW(), FALSE, %s, %s, FALSE) returning id, last_modified_on',
+                               [self.__guild_id, question, answer, asked_by.id, answered_by.id, self.__embeddings_service.api_engine, embedding_str, question_jump_url, answer_jump_url])
 
-        self.remove_unanswered_questions_for_prompt(question)
+        await on_qa_document_inserted(self.__guild_id, self.__embeddings_service.api_engine,
+                                      {
+                                          "id": inserted[0]['id'],
+                                          "prompt": question,
+                                          "completion": answer,
+                                          "question_jump_url": question_jump_url,
+                                          "answer_jump_url": answer_jump_url,
+                                          "is_spam": False
+                                      },
+                                      embedding,
+                                      inserted[0]['last_modified_on'])
 
-    def insert_unanswered_question_into_db(self, question, user_id):
+        await self.remove_unanswered_questions_for_prompt(question)
 
-        existing_unanswered_questions = execute_sql('select id from api_unansweredquestion where guild_id = %s and prompt = %s',
+    async def insert_unanswered_question_into_db(self, question, user_id):
+
+        existing_unanswered_questions = await fetch('select id from api_unansweredquestion where guild_id = %s and prompt = %s',
                                         [self.__guild_id, question])
 
         if len(existing_unanswered_questions) > 0:
             return
 
-        execute_sql(
+        await execute(
             'insert into api_unansweredquestion (guild_id, user_id, prompt, created_on, last_modified_on) values (%s, %s, %s, NOW(), NOW())',
-            [self.__guild_id, user_id, question],
-            fetch=False)
+            [self.__guild_id, user_id, question])
 
-    def remove_unanswered_questions_for_prompt(self, prompt):
-        execute_sql(
+    async def remove_unanswered_questions_for_prompt(self, prompt):
+        await execute(
             'update api_unansweredquestion set deleted_on = NOW() where guild_id = %s and prompt = %s',
-            [self.__guild_id, prompt],
-            fetch=False
-        )
+            [self.__guild_id, prompt])
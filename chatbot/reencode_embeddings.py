@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from database import create_connection
+from embedding_codec import decode_embedding, encode_embedding, is_encoded_embedding
+
+
+# Re-encodes stored embeddings from pickle to the embedding_codec format, while the bot keeps running
+# (it reads both formats).
+# Run as
+# python3 reencode_embeddings.py [--batch-size 1000] [--workers 4] [--checkpoint-file reencode_embeddings.checkpoint]
+#
+# Rows are streamed with a server-side cursor in id order. After each batch is committed the last id is
+# written to the checkpoint file, and a restarted run continues from there. Rows already in the new format
+# are skipped, and a row is only updated if its embedding did not change since it was read, so running it
+# again, or next to the admin dashboard, is safe.
+
+TABLES = ['api_qadocument', 'api_qadocumentalternativeprompt']
+
+
+def reencode_rows(rows):
+    """
+    Runs in a worker process.
+
+    :param: rows    (id, embedding bytes) pairs
+    :return: (id, new embedding bytes, md5 of the old bytes) for rows that need updating, and the number of
+             rows that could not be decoded
+    """
+    updates = []
+    failed = 0
+
+    for row_id, blob in rows:
+        if is_encoded_embedding(blob):
+            continue
+
+        try:
+            new_blob = encode_embedding(decode_embedding(blob))
+        except Exception as e:
+            print("Could not decode embedding", row_id, e)
+            failed += 1
+            continue
+
+        updates.append((row_id, new_blob, hashlib.md5(blob).hexdigest()))
+
+    return updates, failed
+
+
+def load_checkpoint(path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path, checkpoint: dict):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def read_batches(connection, table, after_id, batch_size):
+    cursor = connection.cursor(name=f'reencode_{table}')
+    cursor.itersize = batch_size
+    cursor.execute(f"SELECT id, embedding_vector FROM {table} WHERE id > %s AND embedding_vector IS NOT NULL ORDER BY id",
+                   [after_id])
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        yield [(row_id, bytes(blob)) for row_id, blob in rows]
+
+    cursor.close()
+
+
+def write_updates(connection, table, updates):
+    cursor = connection.cursor()
+    execute_values(cursor, f"""
+        UPDATE {table} t SET embedding_vector = data.embedding_vector
+        FROM (VALUES %s) AS data (id, embedding_vector, old_md5)
+        WHERE t.id = data.id AND md5(t.embedding_vector) = data.old_md5
+    """, [(row_id, psycopg2.Binary(blob), old_md5) for row_id, blob, old_md5 in updates],
+                   template='(%s, %s::bytea, %s)')
+    updated = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    return updated
+
+
+def reencode_table(table, executor, workers, batch_size, checkpoint, checkpoint_file):
+    read_connection = create_connection()
+    write_connection = create_connection()
+
+    after_id = checkpoint.get(table, 0)
+    print("TABLE", table, "STARTING AFTER ID", after_id)
+
+    scanned = updated = failed = 0
+    start_time = time.time()
+    # Batches are converted in parallel but committed in id order, so the checkpoint never skips a batch.
+    # Only a few batches are in flight, the table is never held in memory.
+    in_flight = deque()
+
+    def commit_oldest():
+        nonlocal scanned, updated, failed
+        last_id, rows_count, future = in_flight.popleft()
+        updates, failed_count = future.result()
+        if len(updates) > 0:
+            updated += write_updates(write_connection, table, updates)
+
+        scanned += rows_count
+        failed += failed_count
+        checkpoint[table] = last_id
+        save_checkpoint(checkpoint_file, checkpoint)
+
+        elapsed = time.time() - start_time
+        print(f"{table}: scanned {scanned}, updated {updated}, failed {failed}, last id {last_id}, "
+              f"{scanned / elapsed if elapsed > 0 else 0:.0f} rows/s")
+
+    for rows in read_batches(read_connection, table, after_id, batch_size):
+        in_flight.append((rows[-1][0], len(rows), executor.submit(reencode_rows, rows)))
+        if len(in_flight) >= workers * 2:
+            commit_oldest()
+
+    while in_flight:
+        commit_oldest()
+
+    read_connection.close()
+    write_connection.close()
+    print("TABLE", table, "DONE", scanned, "ROWS SCANNED", updated, "UPDATED", failed, "FAILED")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-encode stored embeddings from pickle to the binary format")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint-file', default='reencode_embeddings.checkpoint')
+    parser.add_argument('--table', choices=TABLES, action='append',
+                        help="Table to re-encode, can be repeated (default: all)")
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.checkpoint_file)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for table in args.table or TABLES:
+            reencode_table(table, executor, args.workers, args.batch_size, checkpoint, args.checkpoint_file)
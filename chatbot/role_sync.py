@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+import traceback
+from typing import Dict, List
+
+from database import transaction
+
+# Role sets of guild members are written to api_userroleset in chunks. A chunk looks up only the users
+# it contains together with their stored role sets, and upserts the changed ones with one statement,
+# all in one transaction.
+ROLE_SYNC_CHUNK_SIZE = int(os.environ.get('ROLE_SYNC_CHUNK_SIZE', '1000'))
+
+USERS_WITH_ROLE_SETS_SQL = """
+    SELECT u.id AS user_id, u.discord_user_id, rs.role_ids
+    FROM api_user u
+    LEFT JOIN api_userroleset rs ON rs.user_id = u.id AND rs.community_id = %(community_id)s
+    WHERE u.discord_user_id = ANY(%(discord_user_ids)s)
+"""
+
+UPSERT_ROLE_SETS_SQL = """
+    INSERT INTO api_userroleset (role_ids, community_id, user_id)
+    VALUES %s
+    ON CONFLICT (community_id, user_id)
+    DO UPDATE SET role_ids = EXCLUDED.role_ids
+"""
+
+
+def member_role_ids(member) -> List[int]:
+    return [role.id for role in member.roles]
+
+async def sync_role_sets(community_id, role_ids_by_discord_id: Dict[int, List[int]]) -> dict:
+    """
+    Writes role sets of one chunk of members. Members without a user in the backend are ignored, and
+    rows whose stored role set is equal are not written.
+
+    :param: community_id    internal id of the community
+    :return: counts of 'members', 'users' (known to the backend) and 'updated'
+    """
+    if not role_ids_by_discord_id:
+        return {'members': 0, 'users': 0, 'updated': 0}
+
+    async with transaction(timeout=120) as tx:
+        rows = await tx.fetch(USERS_WITH_ROLE_SETS_SQL, {
+            "community_id": community_id,
+            "discord_user_ids": list(role_ids_by_discord_id.keys())
+        })
+
+        values = []
+        for row in rows:
+            role_ids = role_ids_by_discord_id[int(row['discord_user_id'])]
+            if row['role_ids'] is not None and set(row['role_ids']) == set(role_ids):
+                continue
+            values.append((role_ids, community_id, row['user_id']))
+
+        if values:
+            await tx.execute_values(UPSERT_ROLE_SETS_SQL, values, page_size=ROLE_SYNC_CHUNK_SIZE)
+
+    return {'members': len(role_ids_by_discord_id), 'users': len(rows), 'updated': len(values)}
+
+async def sync_guild_roles(community, members) -> dict:
+    """
+    Streams members (an async iterator, e.g. guild.fetch_members) into chunks. A chunk is written while
+    the next one is being fetched, at most one write is in flight.
+
+    :return: summed counts of sync_role_sets, plus 'seconds'
+    """
+    start_time = time.monotonic()
+    totals = {'members': 0, 'users': 0, 'updated': 0}
+    pending_write = None
+
+    async def flush(chunk):
+        nonlocal pending_write
+        if pending_write is not None:
+            counts = await pending_write
+            for name in totals:
+                totals[name] += counts[name]
+        pending_write = asyncio.ensure_future(sync_role_sets(community.internal_id, chunk)) if chunk else None
+
+    chunk = {}
+    try:
+        async for member in members:
+            if member.bot:
+                continue
+            chunk[member.id] = member_role_ids(member)
+            if len(chunk) >= ROLE_SYNC_CHUNK_SIZE:
+                await flush(chunk)
+                chunk = {}
+    except Exception:
+        # Chunk already handed to the DB is finished before giving up
+        if pending_write is not None:
+            await asyncio.wait([pending_write])
+        raise
+
+    await flush(chunk)
+    await flush({})
+
+    totals['seconds'] = time.monotonic() - start_time
+    return totals
+
+
+# Incremental sync from member gateway events. Role sets are queued per community and written behind,
+# ROLE_SYNC_DEBOUNCE_SECONDS after the first change of a batch, so a burst (e.g. a role given to many
+# members) is written as chunks. The full member scan only reconciles what events missed.
+ROLE_SYNC_DEBOUNCE_SECONDS = float(os.environ.get('ROLE_SYNC_DEBOUNCE_SECONDS', '5'))
+ROLE_SYNC_RECONCILE_HOURS = float(os.environ.get('ROLE_SYNC_RECONCILE_HOURS', '12'))
+
+# community internal id -> discord user id -> role ids waiting to be written
+_pending_role_sets = {}
+_flush_task = None
+# One flush at a time, a later flush must not overtake an earlier one still writing older role sets.
+# Created on first use inside the running loop
+_flush_lock = None
+
+def queue_role_set(community, discord_user_id, role_ids: List[int]):
+    _pending_role_sets.setdefault(community.internal_id, {})[discord_user_id] = role_ids
+
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.get_running_loop().create_task(_flush_later())
+
+def queue_member_roles(community, member):
+    if not member.bot:
+        queue_role_set(community, member.id, member_role_ids(member))
+
+async def _flush_later():
+    global _flush_task
+
+    await asyncio.sleep(ROLE_SYNC_DEBOUNCE_SECONDS)
+    _flush_task = None
+    await flush_role_sets()
+
+def get_flush_lock() -> asyncio.Lock:
+    global _flush_lock
+
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    return _flush_lock
+
+async def flush_role_sets():
+    async with get_flush_lock():
+        await _flush_pending_role_sets()
+
+    global _flush_task
+    if _pending_role_sets and _flush_task is None:
+        _flush_task = asyncio.get_running_loop().create_task(_flush_later())
+
+async def _flush_pending_role_sets():
+    pending = dict(_pending_role_sets)
+    _pending_role_sets.clear()
+
+    for community_id, role_ids_by_discord_id in pending.items():
+        items = list(role_ids_by_discord_id.items())
+        for start in range(0, len(items), ROLE_SYNC_CHUNK_SIZE):
+            chunk = dict(items[start:start + ROLE_SYNC_CHUNK_SIZE])
+            try:
+                counts = await sync_role_sets(community_id, chunk)
+                if counts['updated']:
+                    print("ROLE SYNC QUEUE", community_id, counts['updated'], "UPDATED")
+            except Exception:
+                print("Error in role sync queue flush", community_id)
+                traceback.print_exc()
+                # Retried with the next flush, changes queued meanwhile are newer and win
+                requeued = _pending_role_sets.setdefault(community_id, {})
+                for discord_user_id, role_ids in chunk.items():
+                    requeued.setdefault(discord_user_id, role_ids)
+
+async def iterate_members(members):
+    """
+    Members from the gateway member cache, as the async iterator sync_guild_roles expects
+    """
+    for member in members:
+        yield member
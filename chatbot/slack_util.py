@@ -1,20 +1,126 @@
+import asyncio
+import collections
 import os
-import requests
+import random
+import traceback
+
+from api_util import get_session
 
 SLACK_WEBHOOK_DIRECT_ANSWER_LOGS_URL = os.environ['SLACK_WEBHOOK_DIRECT_ANSWER_LOGS_URL']
 SLACK_WEBHOOK_OTHER_LOGS_URL = os.environ['SLACK_WEBHOOK_OTHER_LOGS_URL']
 
+# Event logs are posted to Slack in the background. Messages wait in a bounded queue per webhook, when it
+# is full the oldest message is dropped. Every SLACK_LOG_FLUSH_SECONDS queued messages are merged into one
+# Slack message (a section block per log, Slack allows 50 blocks), failed posts are retried with backoff.
+SLACK_LOG_QUEUE_SIZE = int(os.environ.get('SLACK_LOG_QUEUE_SIZE', '1000'))
+SLACK_LOG_FLUSH_SECONDS = float(os.environ.get('SLACK_LOG_FLUSH_SECONDS', '2'))
+SLACK_LOG_MESSAGES_PER_POST = int(os.environ.get('SLACK_LOG_MESSAGES_PER_POST', '20'))
+SLACK_LOG_MAX_ATTEMPTS = int(os.environ.get('SLACK_LOG_MAX_ATTEMPTS', '4'))
+SLACK_LOG_BACKOFF_SECONDS = float(os.environ.get('SLACK_LOG_BACKOFF_SECONDS', '1'))
+# Slack rejects section blocks with longer text
+SLACK_SECTION_TEXT_MAX_LENGTH = 3000
+
+# webhook url -> messages waiting to be posted
+_queues = {}
+_wakeup = None
+_worker_task = None
+
+dropped_messages = 0
+posted_messages = 0
+failed_messages = 0
+
+
 def post_message_to_slack_event_logs(message, is_direct_answer):
-    response = requests.post(SLACK_WEBHOOK_DIRECT_ANSWER_LOGS_URL if is_direct_answer else SLACK_WEBHOOK_OTHER_LOGS_URL,
-        json={
-            "text": "",
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": message
-                    }
-                }
-            ]
+    """
+    Queues the message and returns right away, it is posted by the background worker.
+    """
+    global dropped_messages, _wakeup, _worker_task
+
+    url = SLACK_WEBHOOK_DIRECT_ANSWER_LOGS_URL if is_direct_answer else SLACK_WEBHOOK_OTHER_LOGS_URL
+    queue = _queues.setdefault(url, collections.deque(maxlen=SLACK_LOG_QUEUE_SIZE))
+    if len(queue) == queue.maxlen:
+        dropped_messages += 1
+        if dropped_messages % 100 == 1:
+            print("SLACK LOG QUEUE FULL, DROPPED", dropped_messages)
+    queue.append(message)
+
+    if _worker_task is None or _worker_task.done():
+        _wakeup = asyncio.Event()
+        _worker_task = asyncio.get_running_loop().create_task(_worker())
+    _wakeup.set()
+
+def slack_blocks(messages) -> list:
+    blocks = []
+    for message in messages:
+        if blocks:
+            blocks.append({"type": "divider"})
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": message[:SLACK_SECTION_TEXT_MAX_LENGTH]
+            }
         })
+    return blocks
+
+async def _post(url, messages) -> bool:
+    """
+    :return: whether the messages were posted, they are dropped after SLACK_LOG_MAX_ATTEMPTS
+    """
+    for attempt in range(1, SLACK_LOG_MAX_ATTEMPTS + 1):
+        retry_after = None
+        try:
+            async with get_session().post(url, json={"text": "", "blocks": slack_blocks(messages)}) as response:
+                if response.status < 300:
+                    return True
+                if response.status != 429 and response.status < 500:
+                    print("SLACK POST REJECTED", response.status, await response.text())
+                    return False
+                if response.status == 429:
+                    retry_after = float(response.headers.get('Retry-After', 1))
+        except Exception:
+            print("Error posting to Slack, attempt", attempt)
+            traceback.print_exc()
+
+        if attempt < SLACK_LOG_MAX_ATTEMPTS:
+            await asyncio.sleep(retry_after if retry_after is not None
+                                else SLACK_LOG_BACKOFF_SECONDS * 2 ** (attempt - 1) * (0.5 + random.random()))
+    return False
+
+async def flush_slack_event_logs():
+    global posted_messages, failed_messages
+
+    for url, queue in list(_queues.items()):
+        while queue:
+            messages = [queue.popleft() for _ in range(min(len(queue), SLACK_LOG_MESSAGES_PER_POST))]
+            if await _post(url, messages):
+                posted_messages += len(messages)
+            else:
+                failed_messages += len(messages)
+
+async def _worker():
+    while True:
+        await _wakeup.wait()
+        # Messages arriving meanwhile go out with the same post
+        await asyncio.sleep(SLACK_LOG_FLUSH_SECONDS)
+        _wakeup.clear()
+        try:
+            await flush_slack_event_logs()
+        except Exception:
+            print("Error in Slack event log worker")
+            traceback.print_exc()
+
+async def close_slack_event_logs():
+    """
+    Stops the worker and posts what is still queued.
+    """
+    global _worker_task
+
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    await flush_slack_event_logs()
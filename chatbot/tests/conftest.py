@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Bot modules import each other by module name, as they do when main_bot.py runs from chatbot/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
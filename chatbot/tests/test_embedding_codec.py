@@ -0,0 +1,73 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from embedding_codec import HEADER, MAGIC, EmbeddingFormatError, decode_embedding, encode_embedding, \
+    is_encoded_embedding, read_embedding_header
+
+
+def test_round_trip_keeps_float32_values():
+    embedding = [0.25, -1.5, 3.0, 1e-8]
+    blob = encode_embedding(embedding)
+
+    assert is_encoded_embedding(blob)
+    assert len(blob) == HEADER.size + 4 * len(embedding)
+    decoded = decode_embedding(blob)
+    assert decoded.dtype == np.float32
+    assert np.array_equal(decoded, np.asarray(embedding, dtype=np.float32))
+
+
+def test_header_carries_dimension_and_norm():
+    header = read_embedding_header(encode_embedding([3.0, 4.0]))
+
+    assert header['version'] == 1
+    assert header['dimension'] == 2
+    assert header['norm'] == pytest.approx(5.0)
+
+
+def test_decodes_from_memoryview():
+    # psycopg2 returns bytea columns as memoryview
+    blob = encode_embedding([1.0, 2.0])
+
+    assert np.array_equal(decode_embedding(memoryview(blob)), [1.0, 2.0])
+
+
+def test_legacy_pickled_list_is_decoded():
+    embedding = [0.1, 0.2, 3]
+    decoded = decode_embedding(pickle.dumps(embedding))
+
+    assert decoded.dtype == np.float32
+    assert np.allclose(decoded, embedding)
+
+
+def test_legacy_pickle_with_globals_is_refused():
+    with pytest.raises(pickle.UnpicklingError):
+        decode_embedding(pickle.dumps(np.array([1.0, 2.0])))
+
+
+def test_legacy_pickle_of_other_values_is_refused():
+    with pytest.raises(EmbeddingFormatError):
+        decode_embedding(pickle.dumps({'a': 1.0}))
+
+
+def test_truncated_blob_is_refused():
+    blob = encode_embedding([1.0, 2.0, 3.0])
+
+    with pytest.raises(EmbeddingFormatError):
+        decode_embedding(blob[:-1])
+    with pytest.raises(EmbeddingFormatError):
+        read_embedding_header(MAGIC)
+
+
+def test_unknown_version_is_refused():
+    blob = bytearray(encode_embedding([1.0]))
+    blob[len(MAGIC)] = 99
+
+    with pytest.raises(EmbeddingFormatError):
+        decode_embedding(bytes(blob))
+
+
+def test_only_one_dimensional_embeddings_are_encoded():
+    with pytest.raises(EmbeddingFormatError):
+        encode_embedding([[1.0, 2.0]])
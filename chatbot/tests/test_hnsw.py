@@ -0,0 +1,77 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from hnsw import HNSWIndex, build_index
+
+
+def unit_vectors(count, dim, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_search_finds_exact_vector_first():
+    vectors = unit_vectors(500, 16)
+    index = build_index(vectors, np.arange(500), m=8, ef_construction=50)
+
+    for node in [0, 123, 499]:
+        similarity, found = index.search(vectors[node], 1, 32)[0]
+        assert found == node
+        assert similarity == pytest.approx(1.0, abs=1e-5)
+
+
+def test_recall_against_exact_search():
+    vectors = unit_vectors(1000, 16, seed=1)
+    queries = unit_vectors(50, 16, seed=2)
+    index = build_index(vectors, np.arange(1000), m=16, ef_construction=100)
+
+    hits = 0
+    for query in queries:
+        exact = set(np.argsort(-(vectors @ query))[:10])
+        hits += len(exact & {node for _, node in index.search(query, 10, 64)})
+
+    assert hits / (10 * len(queries)) >= 0.9
+
+
+def test_results_are_most_similar_first():
+    vectors = unit_vectors(300, 8)
+    index = build_index(vectors, np.arange(300))
+
+    similarities = [similarity for similarity, _ in index.search(vectors[7], 20, 50)]
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_deleted_labels_are_not_returned():
+    vectors = unit_vectors(200, 8)
+    # Two nodes per label, like a document with one alternative prompt
+    labels = np.arange(200) // 2
+    index = build_index(vectors, labels)
+
+    assert index.mark_deleted(3) == 2
+    assert index.mark_deleted(3) == 0
+    assert len(index) == 198
+    assert index.tombstone_ratio == 0.01
+    assert all(index.labels[node] != 3 for _, node in index.search(vectors[6], 50, 100))
+
+
+def test_empty_index_returns_nothing():
+    assert HNSWIndex(4).search(np.ones(4, dtype=np.float32) / 2, 5, 10) == []
+
+
+def test_index_grows_past_initial_capacity():
+    vectors = unit_vectors(40, 4)
+    index = HNSWIndex(4, m=4)
+    for node, vector in enumerate(vectors):
+        index.add(vector, node)
+
+    assert len(index) == 40
+    assert list(index.labels[:40]) == list(range(40))
+
+
+def test_built_index_survives_pickling():
+    # Indexes are built in a worker process and sent back pickled
+    vectors = unit_vectors(100, 8)
+    index = pickle.loads(pickle.dumps(build_index(vectors, np.arange(100))))
+
+    assert index.search(vectors[42], 1, 32)[0][1] == 42
@@ -0,0 +1,152 @@
+import datetime
+from types import SimpleNamespace
+
+import kick_scheduler
+from kick_scheduler import KickScheduler, kick_due_time
+
+
+def make_community(**settings):
+    defaults = {
+        'guild_id': 10,
+        'verified_role_id': 100,
+        'kick_users_who_joined_but_did_not_verify_after_days': 1,
+        'kick_users_who_joined_but_did_not_verify_after_hours': 0,
+        'kick_users_ignore_datetime_before_utc': None,
+    }
+    return SimpleNamespace(**{**defaults, **settings})
+
+
+def make_member(member_id=1, joined_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+                roles=(), bot=False, admin=False):
+    return SimpleNamespace(
+        id=member_id, bot=bot, joined_at=joined_at, guild=SimpleNamespace(id=10),
+        get_role=lambda role_id: role_id if role_id in roles else None,
+        guild_permissions=SimpleNamespace(manage_guild=admin, administrator=admin))
+
+
+def test_due_time_is_join_plus_delay():
+    joined_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    community = make_community(kick_users_who_joined_but_did_not_verify_after_days=1,
+                               kick_users_who_joined_but_did_not_verify_after_hours=2)
+
+    assert kick_due_time(make_member(joined_at=joined_at), community) == \
+        (joined_at + datetime.timedelta(days=1, hours=2)).timestamp()
+
+
+def test_bots_and_members_joined_before_cutoff_are_never_due():
+    community = make_community(kick_users_ignore_datetime_before_utc=datetime.datetime(2024, 6, 1))
+
+    assert kick_due_time(make_member(bot=True), make_community()) is None
+    assert kick_due_time(make_member(), community) is None
+
+
+def test_pop_due_returns_members_in_due_order_once():
+    scheduler = KickScheduler()
+    scheduler.schedule(10, 1, 30)
+    scheduler.schedule(10, 2, 10)
+    scheduler.schedule(11, 3, 20)
+
+    assert scheduler.next_due_time() == 10
+    assert scheduler.pop_due(25) == [(10, 2), (11, 3)]
+    assert scheduler.pop_due(25) == []
+    assert scheduler.pop_due(30) == [(10, 1)]
+    assert len(scheduler) == 0
+
+
+def test_cancelled_and_rescheduled_entries_are_skipped_lazily():
+    scheduler = KickScheduler()
+    scheduler.schedule(10, 1, 10)
+    scheduler.schedule(10, 2, 20)
+    scheduler.cancel(10, 1)
+    scheduler.schedule(10, 2, 50)
+
+    # Stale heap entries are still there until they surface
+    assert len(scheduler._heap) == 3
+    assert scheduler.next_due_time() == 50
+    assert scheduler.pop_due(40) == []
+    assert scheduler.pop_due(50) == [(10, 2)]
+
+
+def test_heap_is_compacted_when_stale_entries_pile_up():
+    scheduler = KickScheduler()
+    for due_time in range(3000):
+        scheduler.schedule(10, 1, due_time)
+
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 1000
+    assert scheduler.pop_due(5000) == [(10, 1)]
+
+
+def test_retry_backs_off_exponentially_up_to_max(monkeypatch):
+    monkeypatch.setattr(kick_scheduler, 'KICK_RETRY_SECONDS', 60)
+    monkeypatch.setattr(kick_scheduler, 'KICK_RETRY_MAX_SECONDS', 200)
+    scheduler = KickScheduler()
+
+    assert scheduler.retry(10, 1, 1000) == 1060
+    assert scheduler.retry(10, 1, 1000) == 1120
+    assert scheduler.retry(10, 1, 1000) == 1200
+    assert scheduler.pop_due(1199) == []
+    assert scheduler.pop_due(1200) == [(10, 1)]
+
+
+def test_cancel_resets_retry_backoff(monkeypatch):
+    monkeypatch.setattr(kick_scheduler, 'KICK_RETRY_SECONDS', 60)
+    scheduler = KickScheduler()
+    scheduler.retry(10, 1, 0)
+    scheduler.retry(10, 1, 0)
+    scheduler.cancel(10, 1)
+
+    assert scheduler.retry(10, 1, 0) == 60
+
+
+def test_schedule_member_does_not_bring_a_retry_forward(monkeypatch):
+    monkeypatch.setattr(kick_scheduler, 'KICK_RETRY_SECONDS', 60)
+    scheduler = KickScheduler()
+    member = make_member()
+    community = make_community()
+    retry_time = scheduler.retry(10, member.id, kick_due_time(member, community) + 3600)
+
+    scheduler.schedule_member(member, community)
+
+    assert scheduler.next_due_time() == retry_time
+
+
+def test_schedule_member_cancels_verified_and_admin_members():
+    scheduler = KickScheduler()
+    community = make_community()
+    scheduler.schedule_member(make_member(1), community)
+    scheduler.schedule_member(make_member(2), community)
+    assert len(scheduler) == 2
+
+    scheduler.schedule_member(make_member(1, roles=(100,)), community)
+    scheduler.schedule_member(make_member(2, admin=True), community)
+    assert len(scheduler) == 0
+
+
+def test_sync_guild_loads_once_per_config():
+    scheduler = KickScheduler()
+    community = make_community()
+    guild = SimpleNamespace(id=10, members=[make_member(1), make_member(2, roles=(100,))],
+                            get_role=lambda role_id: role_id)
+
+    assert scheduler.sync_guild(guild, community)
+    assert scheduler.is_guild_loaded(10)
+    assert len(scheduler) == 1
+
+    scheduler.cancel(10, 1)
+    assert scheduler.sync_guild(guild, community)
+    assert len(scheduler) == 0
+
+    assert scheduler.sync_guild(guild, make_community(kick_users_who_joined_but_did_not_verify_after_days=2))
+    assert len(scheduler) == 1
+
+
+def test_sync_guild_clears_guild_without_verified_role():
+    scheduler = KickScheduler()
+    guild = SimpleNamespace(id=10, members=[make_member(1)], get_role=lambda role_id: role_id)
+    scheduler.sync_guild(guild, make_community())
+
+    guild.get_role = lambda role_id: None
+    assert not scheduler.sync_guild(guild, make_community())
+    assert not scheduler.is_guild_loaded(10)
+    assert len(scheduler) == 0
@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+
+import numpy as np
+
+import qa_index
+from qa_index import QAIndex
+
+
+def make_index():
+    documents = [{'id': 1, 'completion': 'one'}, {'id': 2, 'completion': 'two'}]
+    vectors = [[[1, 0, 0]], [[0, 1, 0], [0, 0, 1]]]
+    return QAIndex(documents, vectors)
+
+
+def top_ids(index, embedding, top_k=5, min_similarity=0.5):
+    return [index.documents[position]['id'] for _, position in index.top_documents(embedding, top_k, min_similarity)]
+
+
+def test_upsert_adds_document_with_alternative_prompts():
+    index = make_index()
+    index.upsert_document({'id': 3}, [[1, 1, 0], [0, -1, 0]])
+
+    assert [doc['id'] for doc in index.documents] == [1, 2, 3]
+    assert list(index.row_doc_ids) == [1, 2, 2, 3, 3]
+    assert top_ids(index, [0, -1, 0]) == [3]
+
+
+def test_upsert_replaces_existing_document():
+    index = make_index()
+    index.upsert_document({'id': 1, 'completion': 'new'}, [[0, 0, 1]])
+
+    assert [doc['id'] for doc in index.documents] == [2, 1]
+    assert index.documents[1]['completion'] == 'new'
+    assert top_ids(index, [1, 0, 0]) == []
+    assert top_ids(index, [0, 0, 1]) == [2, 1]
+
+
+def test_update_document_keeps_rows():
+    index = make_index()
+    matrix = index.matrix
+
+    assert index.update_document(2, completion='changed')
+    assert not index.update_document(99, completion='missing')
+    assert index.documents[1]['completion'] == 'changed'
+    assert index.matrix is matrix
+
+
+def test_remove_document_drops_rows_and_buttons():
+    index = make_index()
+    index.buttons_by_doc_id = {2: [{'label': 'button'}]}
+
+    assert index.remove_document(2)
+    assert not index.remove_document(2)
+    assert [doc['id'] for doc in index.documents] == [1]
+    assert list(index.row_doc_ids) == [1]
+    assert index.buttons_by_doc_id == {}
+    assert top_ids(index, [0, 0, 1]) == []
+
+
+def test_similarity_is_max_over_document_rows():
+    index = make_index()
+    similarities = index.document_similarities([0, 0, 2])
+
+    assert np.allclose(similarities, [0, 1])
+
+
+def test_delta_hooks_move_watermark(monkeypatch):
+    old = datetime.datetime(2024, 1, 1)
+    new = datetime.datetime(2024, 1, 2)
+    index = make_index()
+    index.watermark = (2, old, 1, 'buttons')
+    monkeypatch.setattr(qa_index, 'QA_INDEXES', {(10, 'model'): index})
+
+    qa_index.on_qa_document_inserted(10, 'model', {'id': 3}, [1, 1, 1], new)
+    assert index.watermark == (3, new, 1, 'buttons')
+
+    qa_index.on_qa_document_updated(10, 3, old, completion='answer')
+    assert index.watermark == (3, new, 1, 'buttons')
+    assert index.documents[-1]['completion'] == 'answer'
+
+    qa_index.on_qa_document_deleted(10, 'model', 2)
+    assert index.watermark == (2, new, 0, 'buttons')
+
+
+def test_delta_hooks_ignore_other_guilds(monkeypatch):
+    index = make_index()
+    index.watermark = (2, None, 1, None)
+    monkeypatch.setattr(qa_index, 'QA_INDEXES', {(10, 'model'): index})
+
+    qa_index.on_qa_document_deleted(11, 'model', 1)
+
+    assert len(index) == 2
+    assert index.watermark == (2, None, 1, None)
+
+
+def test_concurrent_first_requests_share_one_load(monkeypatch):
+    loads = []
+
+    async def load(guild_id, model):
+        loads.append((guild_id, model))
+        await asyncio.sleep(0.01)
+        return make_index()
+
+    monkeypatch.setattr(qa_index, 'QA_INDEXES', {})
+    monkeypatch.setattr(qa_index, '_load_qa_index_warm', load)
+
+    async def main():
+        return await asyncio.gather(*[qa_index.get_qa_index(10, 'model') for _ in range(5)])
+
+    indexes = asyncio.run(main())
+
+    assert loads == [(10, 'model')]
+    assert all(index is indexes[0] for index in indexes)
+    assert qa_index.QA_INDEXES[(10, 'model')] is indexes[0]
@@ -0,0 +1,43 @@
+import numpy as np
+
+from qa_index import select_top_k
+
+
+def stable_sort_top_k(scores, top_k, min_score):
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    return [i for i in order if scores[i] > min_score][:top_k]
+
+
+def test_highest_scores_first():
+    scores = np.array([0.2, 0.9, 0.5, 0.7], dtype=np.float32)
+
+    assert list(select_top_k(scores, 3, 0.0)) == [1, 3, 2]
+
+
+def test_scores_at_or_below_threshold_are_dropped():
+    scores = np.array([0.5, 0.6, 0.4], dtype=np.float32)
+
+    assert list(select_top_k(scores, 5, 0.5)) == [1]
+
+
+def test_ties_are_taken_in_position_order():
+    scores = np.array([0.8, 0.9, 0.8, 0.8, 0.1], dtype=np.float32)
+
+    assert list(select_top_k(scores, 3, 0.0)) == [1, 0, 2]
+
+
+def test_no_results_for_empty_scores_or_zero_k():
+    assert len(select_top_k(np.empty(0, dtype=np.float32), 3, 0.0)) == 0
+    assert len(select_top_k(np.array([0.9], dtype=np.float32), 0, 0.0)) == 0
+
+
+def test_same_order_as_a_stable_sort():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        size = int(rng.integers(1, 60))
+        # Few distinct values, so ties are common
+        scores = rng.integers(0, 8, size).astype(np.float32) / 8
+        top_k = int(rng.integers(1, 10))
+        min_score = float(rng.choice([-1.0, 0.25, 0.5]))
+
+        assert list(select_top_k(scores, top_k, min_score)) == stable_sort_top_k(scores, top_k, min_score)
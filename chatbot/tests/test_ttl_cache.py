@@ -0,0 +1,56 @@
+from ttl_cache import TTLCache
+
+
+def test_get_counts_hits_and_misses():
+    cache = TTLCache(max_size=10, ttl_seconds=None)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b', 'default') == 'default'
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('ttl_cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(max_size=10, ttl_seconds=5)
+    cache.set('a', 1)
+
+    now[0] = 104.9
+    assert cache.get('a') == 1
+    now[0] = 105.0
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl_seconds=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_set_replaces_value_and_refreshes_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('ttl_cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(max_size=10, ttl_seconds=5)
+    cache.set('a', 1)
+
+    now[0] = 4.0
+    cache.set('a', 2)
+    now[0] = 8.0
+    assert cache.get('a') == 2
+
+
+def test_clear_keeps_counters():
+    cache = TTLCache(max_size=10, ttl_seconds=None)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.clear()
+
+    assert cache.stats() == {'size': 0, 'hits': 1, 'misses': 0}
@@ -1,5 +1,5 @@
 import re
-from database import execute_sql
+from database import execute
 
 alphabets= "([A-Za-z])"
 prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
@@ -50,13 +50,12 @@ def check_if_text_contains_question(text):
                 return is_whitespace_after_q_start
     return False
 
-def create_user_if_not_exists(user):
+async def create_user_if_not_exists(user):
     avatar_key = None
     if user.avatar:
         avatar_key = user.avatar.key
         
-    execute_sql('insert into api_user ' +
-                '(discord_user_id, discord_username, discord_avatar_hash, password, date_registered, is_superuser, is_staff, is_active) ' +
-                'VALUES (%s, %s, %s, %s, NOW(), FALSE, FALSE, TRUE) ON CONFLICT DO NOTHING',
-                [user.id, user.display_name, avatar_key, ""],
-                fetch=False)
+    await execute('insert into api_user ' +
+                  '(discord_user_id, discord_username, discord_avatar_hash, password, date_registered, is_superuser, is_staff, is_active) ' +
+                  'VALUES (%s, %s, %s, %s, NOW(), FALSE, FALSE, TRUE) ON CONFLICT DO NOTHING',
+                  [user.id, user.display_name, avatar_key, ""])